@@ -1,13 +1,26 @@
 const mongoose = require("mongoose");
 const { v4: uuidv4 } = require("uuid");
 const axios = require("axios");
+const http = require("http");
 const fs = require("fs");
 const path = require("path");
 const Chat = require("../models/chatModel");
 const AssessmentResult = require("../models/assessmentResultModel");
 
 const AI_API_URL = "http://10.55.17.30:1234/v1/chat/completions";
-const SEMANTIC_SERVICE_URL = "http://localhost:5000/map-response";
+const SEMANTIC_TURN_URL = "http://localhost:5000/map-turn";
+const SEMANTIC_TIMEOUT_MS = 1000000; // Also sent as the semantic service's deadline
+const SEMANTIC_SLOW_MS = 500; // Log the semantic service's timing breakdown for slower calls
+const SEMANTIC_IDLE_MS = 60000; // Close idle connections before the service does (its keepalive is 75s)
+
+// Connections to the semantic service are kept alive and reused. When the service
+// listens on a Unix domain socket (SEMANTIC_SERVICE_SOCKET), calls go over it
+// instead of loopback TCP; the URL then only supplies the path.
+const semanticAgent = new http.Agent({ keepAlive: true, maxSockets: 16, timeout: SEMANTIC_IDLE_MS });
+const semanticConnection = {
+  httpAgent: semanticAgent,
+  ...(process.env.SEMANTIC_SERVICE_SOCKET && { socketPath: process.env.SEMANTIC_SERVICE_SOCKET })
+};
 
 // Helper function for error handling
 const handleError = (res, error, context) => {
@@ -139,150 +152,92 @@ const sendMessageController = async (req, res) => {
         conversationId 
       }).sort({ timestamp: -1 });
 
-      let semanticPayload = {
+      // A question asked but not answered yet is the pending question; the
+      // semantic service decides whether this message answers or abandons it
+      const pendingAssessment = lastAssessment &&
+        (lastAssessment.response === null || lastAssessment.response === undefined) ? lastAssessment : null;
+
+      const semanticPayload = {
         message: message.trim(),
-        conversationId
+        conversationId,
+        pendingQuestion: pendingAssessment
+          ? { category: pendingAssessment.category, question: pendingAssessment.question }
+          : null
       };
 
-      // If we have a previous assessment with a question but no response yet,
-      // we're expecting an option response
-      if (lastAssessment && (lastAssessment.response === null || lastAssessment.response === undefined)) {
-        semanticPayload.mappingType = 'option';
-        semanticPayload.category = lastAssessment.category;
-        semanticPayload.question = lastAssessment.question;
-      } else {
-        // Otherwise, we're looking for a new question match
-        semanticPayload.mappingType = 'question';
-      }
-
       try {
-        // Call semantic service with a longer timeout
+        // One call per turn: the option result, the fallback question result and
+        // the decision come back together. The request id ties this call to the
+        // semantic service's logs and its Ollama calls.
+        const semanticRequestId = uuidv4();
+        const semanticStart = Date.now();
         const semanticResponse = await axios.post(
-          SEMANTIC_SERVICE_URL, 
+          SEMANTIC_TURN_URL,
           semanticPayload,
-          { timeout: 1000000 }
+          {
+            ...semanticConnection,
+            timeout: SEMANTIC_TIMEOUT_MS,
+            headers: { "X-Request-ID": semanticRequestId, "X-Deadline-Ms": String(SEMANTIC_TIMEOUT_MS) }
+          }
         );
+        const semanticMs = Date.now() - semanticStart;
+        if (semanticMs >= SEMANTIC_SLOW_MS) {
+          console.warn(`Slow semantic mapping (${semanticMs}ms, request ${semanticRequestId}): ${semanticResponse.headers["server-timing"]}`);
+        }
+
+        const turn = semanticResponse.data;
+        if (turn && turn.success) {
+          const { decision } = turn.transition;
+          const option = turn.option;
+          const question = turn.question;
+
+          if (decision === 'option') {
+            // A confident option for the pending question
+            console.log(`DEBUG: Option: "${option.mappedOption}" with confidence: ${option.confidence}`);
+            await AssessmentResult.findByIdAndUpdate(
+              pendingAssessment._id,
+              {
+                response: option.mappedOption,
+                score: option.score
+              }
+            );
 
-        if (semanticResponse.data && semanticResponse.data.success) {
-          if (semanticResponse.data.mappingType === 'question') {
-            // Save the mapped question
-            await AssessmentResult.create({
-              user: userId,
-              conversationId,
-              category: semanticResponse.data.category,
-              question: semanticResponse.data.question,
-              // These fields are now optional in the schema
-              response: null,
-              score: -1,
-              timestamp: new Date()
-            });
-            
-            console.log(`Mapped user message to question: ${semanticResponse.data.question} (${semanticResponse.data.category})`);
-          } 
-          else if (semanticResponse.data.mappingType === 'option') {
-            // Check if the confidence is high enough to consider it a valid option match
-            const confidenceThreshold = 0.6; // Adjust this threshold as needed
-            
-            // Get the last assessment to ensure we're matching an option to the correct question
-            const lastAssessment = await AssessmentResult.findOne({ 
-              user: userId, 
-              conversationId,
-              response: null,  // Only get questions without responses
-              score: -1
-            }).sort({ timestamp: -1 });
-            
-            console.log(`DEBUG: Last assessment question: "${lastAssessment?.question}" (${lastAssessment?.category})`);
-            console.log(`DEBUG: Mapped option for question: "${semanticResponse.data.question}" (${semanticResponse.data.category})`);
-            console.log(`DEBUG: Option: "${semanticResponse.data.mappedOption}" with confidence: ${semanticResponse.data.confidence}`);
-            
-            // Strict question matching - only match if the questions are exactly the same
-            const questionsMatch = lastAssessment && 
-                                  lastAssessment.question === semanticResponse.data.question && 
-                                  lastAssessment.category === semanticResponse.data.category;
-            
-            if (lastAssessment && 
-                semanticResponse.data.confidence >= confidenceThreshold &&
-                questionsMatch) {
-              
-              // Update the assessment with the option response
+            console.log(`Mapped user message to option: ${option.mappedOption} (score: ${option.score}, confidence: ${option.confidence})`);
+          } else {
+            if (decision === 'abandon_low_confidence' || decision === 'abandon_question_mismatch') {
+              // Mark the previous question as abandoned
               await AssessmentResult.findByIdAndUpdate(
-                lastAssessment._id,
+                pendingAssessment._id,
                 {
-                  response: semanticResponse.data.mappedOption,
-                  score: semanticResponse.data.score
+                  response: "Not answered",
+                  score: -2  // Special score to indicate abandoned question
                 }
               );
-              
-              console.log(`Mapped user message to option: ${semanticResponse.data.mappedOption} (score: ${semanticResponse.data.score}, confidence: ${semanticResponse.data.confidence})`);
-            } else {
-              // Either confidence too low or question mismatch, check if it matches a new question instead
-              if (!lastAssessment) {
-                console.log("No pending assessment question found");
-              } else if (semanticResponse.data.confidence < confidenceThreshold) {
-                console.log(`Option match confidence too low (${semanticResponse.data.confidence}), checking for question match instead`);
-                
-                // Mark the previous question as abandoned if option doesn't match well
-                await AssessmentResult.findByIdAndUpdate(
-                  lastAssessment._id,
-                  {
-                    response: "Not answered",
-                    score: -2  // Special score to indicate abandoned question
-                  }
-                );
-                
-                console.log(`Marked question "${lastAssessment.question}" as abandoned due to low option match confidence`);
-              } else if (!questionsMatch) {
-                console.log(`Question mismatch: Expected "${lastAssessment.question}" (${lastAssessment.category}), got "${semanticResponse.data.question}" (${semanticResponse.data.category})`);
-                
-                // Mark the previous question as abandoned if option is for a different question
-                await AssessmentResult.findByIdAndUpdate(
-                  lastAssessment._id,
-                  {
-                    response: "Not answered",
-                    score: -2  // Special score to indicate abandoned question
-                  }
-                );
-                
-                console.log(`Marked question "${lastAssessment.question}" as abandoned due to question mismatch`);
-              }
-              
-              // Create a new payload for question mapping
-              const questionPayload = {
-                message: message.trim(),
+
+              console.log(`Marked question "${pendingAssessment.question}" as abandoned (${decision}, option confidence ${option ? option.confidence : "n/a"})`);
+            }
+
+            // A new question is recorded for a fresh turn, and after abandoning
+            // only with enough confidence
+            if (decision === 'question' || question.confidence >= 0.6) {
+              await AssessmentResult.create({
+                user: userId,
                 conversationId,
-                mappingType: 'question'
-              };
-              
-              // Call semantic service again to check for question match
-              const questionResponse = await axios.post(
-                SEMANTIC_SERVICE_URL, 
-                questionPayload,
-                { timeout: 1000000 }
-              );
-              
-              if (questionResponse.data && 
-                  questionResponse.data.success && 
-                  questionResponse.data.confidence >= 0.6) { // Higher threshold for questions
-                
-                // Save the new mapped question
-                await AssessmentResult.create({
-                  user: userId,
-                  conversationId,
-                  category: questionResponse.data.category,
-                  question: questionResponse.data.question,
-                  response: null,
-                  score: -1,
-                  timestamp: new Date()
-                });
-                
-                console.log(`Message mapped to new question instead: ${questionResponse.data.question} (${questionResponse.data.category})`);
-              } else {
-                console.log("Message doesn't match an option or a new question with sufficient confidence");
-              }
+                category: question.category,
+                question: question.question,
+                // These fields are now optional in the schema
+                response: null,
+                score: -1,
+                timestamp: new Date()
+              });
+
+              console.log(`Mapped user message to question: ${question.question} (${question.category})`);
+            } else {
+              console.log("Message doesn't match an option or a new question with sufficient confidence");
             }
           }
         } else {
-          console.log("Semantic service returned unsuccessful response:", semanticResponse.data);
+          console.log("Semantic service returned unsuccessful response:", turn);
         }
       } catch (apiError) {
         console.error("Error calling semantic service API:", apiError.message);
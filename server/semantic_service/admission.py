@@ -0,0 +1,149 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+
+# Admission control for the mapping handlers.
+#
+# At most `max_in_flight` requests are mapped at once; the rest wait in a
+# bounded queue with two lanes. When a slot frees up it is handed directly to
+# the oldest waiter of the priority lane (option mapping on a conversation
+# with a pending question), then of the normal lane, so answers to questions
+# already asked are not stuck behind fresh question mapping. A request is shed
+# when its lane's queue is full or it waits longer than its timeout; the
+# caller then answers in degraded mode or with 503 and Retry-After.
+#
+# Both threads (acquire) and asyncio tasks (acquire_async) can wait; a waiter
+# is woken through its own callback, so one controller serves either kind.
+
+PRIORITY = "priority"
+NORMAL = "normal"
+LANES = (PRIORITY, NORMAL)
+
+QUEUE_FULL = "queue_full"
+QUEUE_TIMEOUT = "queue_timeout"
+
+
+class _Waiter:
+    __slots__ = ("lane", "wake", "granted")
+
+    def __init__(self, lane, wake):
+        self.lane = lane
+        self.wake = wake
+        self.granted = False
+
+
+class AdmissionController:
+    """In-flight limit with a bounded, two-lane wait queue"""
+
+    def __init__(self, max_in_flight=8, max_queue=32, queue_timeout=5.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._waiters = {lane: deque() for lane in LANES}
+        self._service_seconds = 0.05   # moving average, for Retry-After
+        self.admitted = 0
+        self.shed = {(lane, reason): 0 for lane in LANES for reason in (QUEUE_FULL, QUEUE_TIMEOUT)}
+
+    def queued(self, lane=None):
+        if lane is None:
+            return sum(len(waiters) for waiters in self._waiters.values())
+        return len(self._waiters[lane])
+
+    def _try_enter(self, lane, wake):
+        """Take a slot now, or queue a waiter; returns (admitted, waiter, reason)"""
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self.queued():
+                self.in_flight += 1
+                self.admitted += 1
+                return True, None, None
+            # The priority lane may use the whole queue, the normal lane half of it
+            limit = self.max_queue if lane == PRIORITY else self.max_queue // 2
+            if len(self._waiters[lane]) >= limit:
+                self.shed[lane, QUEUE_FULL] += 1
+                return False, None, QUEUE_FULL
+            waiter = _Waiter(lane, wake)
+            self._waiters[lane].append(waiter)
+            return False, waiter, None
+
+    def _give_up(self, waiter):
+        """Leave the queue after a timeout; returns True if a slot arrived meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters[waiter.lane].remove(waiter)
+            self.shed[waiter.lane, QUEUE_TIMEOUT] += 1
+            return False
+
+    def acquire(self, lane=NORMAL, timeout=None):
+        """Wait for a slot; returns (admitted, seconds waited, shed reason)"""
+        start = time.perf_counter()
+        event = threading.Event()
+        admitted, waiter, reason = self._try_enter(lane, event.set)
+        if waiter is None:
+            return admitted, 0.0, reason
+        timeout = self.queue_timeout if timeout is None else timeout
+        if event.wait(max(timeout, 0.0)) or self._give_up(waiter):
+            return True, time.perf_counter() - start, None
+        return False, time.perf_counter() - start, QUEUE_TIMEOUT
+
+    async def acquire_async(self, lane=NORMAL, timeout=None):
+        """acquire() for asyncio tasks"""
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        admitted, waiter, reason = self._try_enter(lane, wake)
+        if waiter is None:
+            return admitted, 0.0, reason
+        timeout = self.queue_timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max(timeout, 0.0))
+            return True, time.perf_counter() - start, None
+        except asyncio.TimeoutError:
+            if self._give_up(waiter):
+                return True, time.perf_counter() - start, None
+            return False, time.perf_counter() - start, QUEUE_TIMEOUT
+        except asyncio.CancelledError:
+            # Caller went away; pass on a slot we may already have been given
+            if self._give_up(waiter):
+                self.release()
+            raise
+
+    def release(self, service_seconds=None):
+        """Free a slot, handing it to the next waiter (priority lane first)"""
+        with self._lock:
+            if service_seconds is not None:
+                self._service_seconds += 0.1 * (service_seconds - self._service_seconds)
+            for lane in LANES:
+                if self._waiters[lane]:
+                    waiter = self._waiters[lane].popleft()
+                    waiter.granted = True
+                    self.admitted += 1
+                    break
+            else:
+                self.in_flight -= 1
+                return
+        waiter.wake()
+
+    def retry_after(self):
+        """Whole seconds until the current queue is likely to have drained"""
+        backlog = self.queued() + self.in_flight
+        return max(1, math.ceil(backlog * self._service_seconds / self.max_in_flight))
+
+    def stats(self):
+        return {
+            "inFlight": self.in_flight,
+            "maxInFlight": self.max_in_flight,
+            "queued": {lane: self.queued(lane) for lane in LANES},
+            "maxQueue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": {f"{lane}:{reason}": count for (lane, reason), count in self.shed.items()},
+            "serviceSecondsAvg": round(self._service_seconds, 4),
+        }
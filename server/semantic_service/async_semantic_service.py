@@ -0,0 +1,391 @@
+from quart import Quart, Response, request, jsonify
+import asyncio
+import os
+import threading
+import time
+import httpx
+
+# Asyncio build of the optimized semantic service.
+#
+# Serves the same /map-response contract, but Ollama calls are made with a
+# pooled async HTTP client, so a request waiting on Ollama costs a suspended
+# coroutine instead of a blocked thread. The question bank, compiled index,
+# caches, conversation state and mapping logic are shared with
+# optimized_semantic_service: every embedding a request needs is fetched
+# asynchronously first, then the (microseconds of NumPy) scoring runs inline.
+# With a remote state backend (Redis), calls that read or write conversation
+# state run in a thread instead, as each is a blocking network round trip.
+#
+#   hypercorn async_semantic_service:app --bind 0.0.0.0:5000
+import optimized_semantic_service as service
+from ollama_residency import is_cold_load
+from ollama_retry import backoff
+from ollama_scheduler import INTERACTIVE, work_class
+from request_deadline import (DEADLINE_HEADER, bounded, expired, no_deadline, parse_budget, request_deadline,
+                              time_left)
+from serialization import embedding_from_json, encode_body
+from service_logging import TRACE_HEADER, logger, note, request_log, trace_headers
+import service_metrics as metrics
+from service_metrics import stage, time_request
+
+app = Quart(__name__)
+
+# Configuration
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_CONNECTIONS", 16))   # HTTP connection pool size
+
+ollama_client = None
+
+# Embeddings currently being fetched, so concurrent requests share one call:
+# cache key -> [fetch task, number of requests waiting for it]
+in_flight_embeddings = {}
+
+@app.before_serving
+async def startup():
+    global ollama_client
+    ollama_client = httpx.AsyncClient(
+        timeout=service.EMBEDDING_TIMEOUT,
+        limits=httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS,
+                            max_keepalive_connections=OLLAMA_MAX_CONNECTIONS)
+    )
+
+    # Load the embedding artifact and compile the question index off the event loop
+    await asyncio.to_thread(service.create_app)
+    if service.OLLAMA_KEEP_WARM_IDLE > 0:
+        threading.Thread(target=service.keep_warm_worker, daemon=True).start()
+    if service.near_duplicates is not None and service.NEAR_DUPLICATE_AUDIT_RATE > 0:
+        threading.Thread(target=service.near_duplicate_audit_worker, daemon=True).start()
+    if service.STATE_PURGE_INTERVAL > 0 and hasattr(service.conversation_state, 'purge_expired'):
+        threading.Thread(target=service.state_purge_worker, daemon=True).start()
+
+@app.after_serving
+async def shutdown():
+    await ollama_client.aclose()
+
+# Ollama calls share the sync service's scheduler, instance pool and hedging
+async def post_to_ollama(path, payload, timeout):
+    """Async counterpart of service.post_to_ollama; None if no slot frees up in time"""
+    work = work_class.get()
+    with stage("ollama_queue"):
+        acquired, waited = await service.ollama_scheduler.acquire_async(
+            work, bounded(timeout) if work == INTERACTIVE else None)
+    metrics.OLLAMA_QUEUE_WAIT.labels(work).observe(waited)
+    if not acquired:
+        note(ollamaQueueTimeout=True)
+        return None
+    if work == INTERACTIVE:
+        timeout = max(timeout - waited, 0.001)
+    start = time.perf_counter()
+    try:
+        with stage("ollama"):
+            if service.ollama_hedging is not None and work == INTERACTIVE and path == service.OLLAMA_API_PATH:
+                return await hedged_send(path, payload, timeout)
+            return await send_to_ollama(path, payload, timeout)
+    finally:
+        service.ollama_scheduler.release(work)
+        metrics.OLLAMA_CALL_SECONDS.labels(work).observe(time.perf_counter() - start)
+
+async def send_to_ollama(path, payload, timeout, avoid=(), used=None):
+    """Async counterpart of service.send_to_ollama"""
+    tried = []
+    refused = httpx.ConnectError("no Ollama instance available")
+    while True:
+        endpoint = service.ollama_pool.acquire(exclude=[*avoid, *tried]) if avoid else None
+        if endpoint is None:
+            endpoint = service.ollama_pool.acquire(exclude=tried)
+        if endpoint is None:
+            raise refused
+        if used is not None:
+            used.append(endpoint)
+        call_start = time.perf_counter()
+        try:
+            response = await ollama_client.post(endpoint.url + path, json=payload, headers=trace_headers(),
+                                                timeout=timeout)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            service.ollama_pool.release(endpoint, time.perf_counter() - call_start, ok=False, refused=True)
+            tried.append(endpoint)
+            refused = e
+            continue
+        except httpx.HTTPError:
+            service.ollama_pool.release(endpoint, time.perf_counter() - call_start, ok=False)
+            raise
+        except asyncio.CancelledError:
+            # Cancelled by the request's deadline or a won hedge, not failed by the instance
+            service.ollama_pool.release(endpoint, time.perf_counter() - call_start, ok=None)
+            raise
+        seconds = time.perf_counter() - call_start
+        service.ollama_pool.release(endpoint, seconds, ok=response.status_code < 500)
+        metrics.OLLAMA_INSTANCE_SECONDS.labels(endpoint.url).observe(seconds)
+        if response.status_code == 200:
+            if path == service.OLLAMA_API_PATH and is_cold_load(seconds, service.ollama_latency[path]):
+                service.record_cold_load(endpoint, seconds, "request")
+            else:
+                service.ollama_latency[path].record(seconds)
+        return response
+
+async def hedged_send(path, payload, timeout):
+    """Async counterpart of service.hedged_send; here the losing call is cancelled"""
+    delay = service.ollama_hedging.delay()
+    if delay is None or delay >= timeout:
+        return await send_to_ollama(path, payload, timeout)
+    used = []
+    primary = asyncio.ensure_future(send_to_ollama(path, payload, timeout, (), used))
+    hedge = None
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        if not (await service.ollama_scheduler.acquire_async(INTERACTIVE, timeout=0))[0]:
+            metrics.OLLAMA_HEDGES.labels("no_slot").inc()
+            return await primary
+        if not service.ollama_hedging.take():
+            service.ollama_scheduler.release(INTERACTIVE)
+            metrics.OLLAMA_HEDGES.labels("over_budget").inc()
+            return await primary
+        note(hedged=True)
+        hedge = asyncio.ensure_future(send_to_ollama(path, payload, timeout - delay, list(used)))
+        hedge.add_done_callback(lambda _: service.ollama_scheduler.release(INTERACTIVE))
+        winner = None
+        pending = {primary, hedge}
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((task for task in (primary, hedge) if task in done and task.exception() is None), None)
+        if winner is None:
+            return primary.result()
+        service.ollama_hedging.settle(winner is hedge)
+        metrics.OLLAMA_HEDGES.labels("won" if winner is hedge else "lost").inc()
+        return winner.result()
+    finally:
+        # Cancelling the loser closes its connection, so Ollama can drop the call
+        for task in (primary, hedge):
+            if task is not None and not task.done():
+                task.cancel()
+
+# Fetch one embedding from Ollama with retries, falling back like the sync service
+async def fetch_embedding(text, cache_key):
+    """Async counterpart of get_ollama_embedding's network path"""
+    short_circuited = out_of_time = out_of_retries = False
+    for attempt in range(service.EMBEDDING_RETRY_COUNT):
+        if not service.ollama_circuit.allow():
+            short_circuited = True
+            break
+        if attempt:
+            if not service.ollama_retry_budget.take():
+                out_of_retries = True
+                break
+            metrics.OLLAMA_RETRIES.inc()
+            await asyncio.sleep(backoff(attempt, service.EMBEDDING_RETRY_DELAY, service.EMBEDDING_RETRY_MAX_DELAY))
+        else:
+            service.ollama_retry_budget.record_call()
+        try:
+            payload = {"model": service.OLLAMA_MODEL, "prompt": text, "keep_alive": service.OLLAMA_KEEP_ALIVE}
+            timeout = service.embedding_timeout.timeout() if service.ollama_pool.warm() else service.EMBEDDING_TIMEOUT
+            response = await post_to_ollama(service.OLLAMA_API_PATH, payload, timeout)
+            if response is None:
+                # No scheduler slot freed up in time
+                out_of_time = True
+                break
+            metrics.OLLAMA_REQUESTS.labels("embeddings", str(response.status_code)).inc()
+            if response.status_code == 200:
+                service.ollama_circuit.record_success()
+                embedding = embedding_from_json(response.content)
+                service.cache_embedding(cache_key, embedding)
+                if service.near_duplicates is not None:
+                    service.near_duplicates.add(text, embedding)
+                return embedding
+            service.ollama_circuit.record_failure()
+            logger.warning("Error from Ollama API (attempt %d/%d): %s", attempt + 1,
+                           service.EMBEDDING_RETRY_COUNT, response.status_code)
+        except httpx.HTTPError as e:
+            metrics.OLLAMA_REQUESTS.labels("embeddings", "exception").inc()
+            service.ollama_circuit.record_failure()
+            logger.warning("Request exception (attempt %d/%d): %r", attempt + 1, service.EMBEDDING_RETRY_COUNT, e)
+
+    if out_of_time:
+        return service.degraded_embedding(text, cache_key)
+    if short_circuited:
+        logger.debug("Ollama circuit is open, falling back to simple embedding")
+    elif out_of_retries:
+        logger.warning("Ollama retry budget spent, falling back to simple embedding")
+        metrics.OLLAMA_RETRIES_DENIED.inc()
+    else:
+        logger.error("All %d attempts failed, falling back to simple embedding", service.EMBEDDING_RETRY_COUNT)
+    metrics.EMBEDDING_FALLBACKS.inc()
+    return service.simple_text_embedding(text)
+
+async def get_embedding(text):
+    """Return the embedding for a text from the caches or Ollama"""
+    with stage("normalization"):
+        cache_key = text.strip().lower()
+    with stage("cache_lookup"):
+        cached = service.find_cached_embedding(cache_key)
+    if cached is not None:
+        return cached
+    reused = service.find_near_duplicate(text)
+    if reused is not None:
+        return reused
+
+    entry = in_flight_embeddings.get(cache_key)
+    if entry is None:
+        # The fetch is shared, so it runs without this request's deadline
+        with no_deadline():
+            task = asyncio.ensure_future(fetch_embedding(text, cache_key))
+        entry = in_flight_embeddings[cache_key] = [task, 0]
+        task.add_done_callback(lambda _: in_flight_embeddings.pop(cache_key, None))
+    task = entry[0]
+    entry[1] += 1
+    try:
+        # Shielded so one caller going away does not cancel the shared fetch;
+        # each caller waits only as long as its own deadline allows
+        return await asyncio.wait_for(asyncio.shield(task), time_left())
+    except asyncio.TimeoutError:
+        note(deadlineExceeded=True)
+        return service.degraded_embedding(text, cache_key)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and not task.done():
+            # Every request that wanted this embedding has gone
+            task.cancel()
+
+async def get_message_embedding(text):
+    """Embedding of a user message, or a ChunkedMessage with its chunks fetched concurrently"""
+    chunks = service.chunks_of(text)
+    if chunks is not None:
+        message = service.chunked_message(chunks, await asyncio.gather(*(get_embedding(chunk) for chunk in chunks)))
+        if message is not None:
+            return message
+    return await get_embedding(text)
+
+async def with_state(function, *args):
+    """Run a call that touches conversation state
+
+    With a remote state backend each state operation is a blocking network
+    round trip, so the call runs in a thread instead of on the event loop.
+    """
+    if service.conversation_state.remote:
+        return await asyncio.to_thread(function, *args)
+    return function(*args)
+
+def pending_options(data, mapper):
+    """Options of the conversation's pending question, after applying the caller's"""
+    if mapper is service.map_turn:
+        service.apply_pending_question(data)
+    prev_state = service.conversation_state.get(data.get('conversationId', 'default'))
+    if prev_state is not None:
+        return service.question_bank.options(prev_state.question_id)
+    return None
+
+async def map_message(data, mapper=service.map_message):
+    """Fetch every embedding the mapping needs, then run the shared mapping logic
+
+    `mapper` is service.map_message or service.map_turn.
+    """
+    user_message = data['message']
+    mapping_type = data.get('mappingType', 'auto')
+
+    query_embedding = await get_message_embedding(user_message)
+    if query_embedding is None:
+        return service.deadline_exceeded_response()[:2]
+
+    # Compiling the index may call Ollama, so never do it on the event loop
+    index = service.question_index
+    if index is None or index.dim != len(query_embedding):
+        await asyncio.to_thread(service.get_question_index, len(query_embedding))
+
+    # Prefetch the embeddings of the options this message may be scored against
+    options = None
+    if mapping_type == 'option':
+        category, question = data.get('category'), data.get('question')
+        if category and question:
+            _, options = service.resolve_question_options(category, question)
+    elif mapping_type != 'question':
+        options = await with_state(pending_options, data, mapper)
+    offload = service.conversation_state.remote
+    if options:
+        await asyncio.gather(*(get_embedding(option) for option in options))
+        # An option whose fetch failed is not cached, and the mapper would
+        # embed it with a blocking call to Ollama
+        offload = offload or not all(service.embedding_cached(option.strip().lower()) for option in options)
+    if offload:
+        return await asyncio.to_thread(mapper, data, query_embedding)
+    return mapper(data, query_embedding)
+
+async def map_admitted(data, mapper=service.map_message):
+    """Async counterpart of service.map_admitted; shares its admission controller"""
+    lane = await with_state(service.admission_lane, data)
+    admitted, waited, reason = await service.admission.acquire_async(lane, bounded(service.admission.queue_timeout))
+    service.record_admission(lane, admitted, waited, reason)
+    if admitted:
+        start = time.perf_counter()
+        try:
+            payload, status = await map_message(data, mapper)
+        finally:
+            service.admission.release(time.perf_counter() - start)
+        if status == 500 and expired():
+            return service.deadline_exceeded_response()
+        return payload, status, {}
+    if service.DEGRADED_MODE:
+        payload, status = await with_state(service.map_degraded, data, mapper)
+        if status != 500:
+            return payload, status, {}
+    return service.overloaded_response()
+
+@app.route('/map-response', methods=['POST'])
+async def map_response():
+    return await serve_mapping('/map-response', service.map_message)
+
+@app.route('/map-turn', methods=['POST'])
+async def map_turn():
+    """One patient turn: option result, fallback question result and state transition"""
+    return await serve_mapping('/map-turn', service.map_turn)
+
+async def serve_mapping(route, mapper):
+    start = time.perf_counter()
+    with request_log(route, request.headers.get(TRACE_HEADER)) as log, time_request() as timer:
+        headers = {}
+        data, error = service.decode_request(await request.get_data(), request.content_type)
+        if error is not None:
+            payload, status = error
+        else:
+            try:
+                with request_deadline(parse_budget(request.headers.get(DEADLINE_HEADER), data)):
+                    payload, status, headers = await map_admitted(data, mapper)
+            except Exception as e:
+                logger.exception("Error in %s: %s", route, e)
+                payload, status = {
+                    "success": False,
+                    "message": f"Error processing request: {str(e)}"
+                }, 500
+        service.log_result(log, status, payload)
+        payload = service.add_debug_timing(payload, data, log, timer)
+        with stage("serialization"):
+            body, content_type = encode_body(payload, request.headers.get("Accept"))
+            response = Response(body, content_type=content_type)
+            response.vary.add("Accept")
+        headers = dict(headers, **service.timing_headers(log, timer))
+    metrics.REQUEST_SECONDS.labels(route).observe(time.perf_counter() - start)
+    metrics.REQUESTS.labels(route, str(status)).inc()
+    return response, status, headers
+
+# Health endpoints; the checks may ping the state backend, so they run off the event loop
+@app.route('/healthz', methods=['GET'])
+async def healthz():
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/readyz', methods=['GET'])
+async def readyz():
+    checks = await asyncio.to_thread(service.readiness_checks)
+    ready = all(checks.values())
+    return jsonify({"ready": ready, "checks": checks}), 200 if ready else 503
+
+@app.route('/status', methods=['GET'])
+async def status():
+    return jsonify(await asyncio.to_thread(service.service_status)), 200
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    """Prometheus metrics of this process"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+if __name__ == '__main__':
+    logger.info("Starting async semantic service...")
+    app.run(host='0.0.0.0', port=5000)
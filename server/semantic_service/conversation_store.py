@@ -0,0 +1,215 @@
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+# Conversation state for the semantic service.
+#
+# StateBackend is the interface the service uses. ConversationStateStore keeps
+# state in process memory; RedisStateBackend (redis_state_backend.py) keeps it
+# in a Redis-protocol server so any worker or node can handle any turn, and
+# JournaledStateStore (state_journal.py) adds a restart-safe journal to the
+# in-memory store. create_state_backend() picks one from a URL.
+#
+# ConversationStateStore entries live in lock-striped shards so concurrent
+# request threads only contend when their conversations hash to the same
+# shard. Each shard is an OrderedDict kept in last-touched order, which gives
+# LRU eviction when the shard is full and lets expired entries be swept from
+# the front cheaply.
+# Every entry has a TTL that is refreshed whenever it is read or written, so
+# abandoned conversations disappear after TTL seconds of inactivity.
+
+
+class SessionState:
+    """Pending question of a conversation: a question id and when it was asked"""
+
+    __slots__ = ('question_id', 'asked_at')
+
+    def __init__(self, question_id, asked_at):
+        self.question_id = question_id
+        self.asked_at = asked_at
+
+    def __eq__(self, other):
+        return (isinstance(other, SessionState) and self.question_id == other.question_id
+                and self.asked_at == other.asked_at)
+
+    def __repr__(self):
+        return f"SessionState(question_id={self.question_id}, asked_at={self.asked_at})"
+
+
+# question id, asked_at (unix seconds)
+STATE_CODEC = struct.Struct('<II')
+
+
+def encode_state(state):
+    """Encode a state compactly for external backends"""
+    return STATE_CODEC.pack(state.question_id, int(state.asked_at))
+
+
+def decode_state(data):
+    """Inverse of encode_state"""
+    return SessionState(*STATE_CODEC.unpack_from(data))
+
+
+class StateBackend:
+    """Interface for conversation state storage
+
+    get() refreshes the entry's TTL. lock() returns a re-entrant lock that
+    makes a read-decide-write sequence for one conversation atomic within this
+    process, or, for a shared backend, across every process that uses it.
+    `remote` is True when operations are network round trips.
+    """
+
+    remote = False
+
+    def get(self, conversation_id, default=None):
+        raise NotImplementedError
+
+    def get_many(self, conversation_ids):
+        """Return {conversation_id: state} for the ids that have state"""
+        states = {}
+        for conversation_id in conversation_ids:
+            state = self.get(conversation_id)
+            if state is not None:
+                states[conversation_id] = state
+        return states
+
+    def set(self, conversation_id, state):
+        raise NotImplementedError
+
+    def pop(self, conversation_id, default=None):
+        raise NotImplementedError
+
+    def lock(self, conversation_id):
+        raise NotImplementedError
+
+    def __contains__(self, conversation_id):
+        return self.get(conversation_id) is not None
+
+    def ping(self):
+        """Return True if the backend can serve requests"""
+        return True
+
+    def stats(self):
+        return {}
+
+
+class ConversationStateStore(StateBackend):
+    """Bounded, thread-safe mapping of conversation id -> state with TTL"""
+
+    def __init__(self, max_entries=100000, ttl=3600, shards=16):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._shards = [OrderedDict() for _ in range(shards)]
+        # Re-entrant so a caller holding lock() can still call get/set/pop
+        self._locks = [threading.RLock() for _ in range(shards)]
+        self._max_per_shard = max(1, -(-max_entries // shards))
+        self.evictions = 0
+        self.expirations = 0
+
+    def _index(self, conversation_id):
+        return hash(conversation_id) % len(self._shards)
+
+    def lock(self, conversation_id):
+        """Lock guarding this conversation, for atomic read-decide-write"""
+        return self._locks[self._index(conversation_id)]
+
+    def _sweep(self, shard, now):
+        """Drop expired entries from the least recently touched end"""
+        while shard:
+            conversation_id, (expires_at, _) = next(iter(shard.items()))
+            if expires_at > now:
+                break
+            del shard[conversation_id]
+            self.expirations += 1
+
+    def get(self, conversation_id, default=None):
+        index = self._index(conversation_id)
+        with self._locks[index]:
+            shard = self._shards[index]
+            entry = shard.get(conversation_id)
+            if entry is None:
+                return default
+            now = time.monotonic()
+            expires_at, state = entry
+            if expires_at <= now:
+                del shard[conversation_id]
+                self.expirations += 1
+                return default
+            shard[conversation_id] = (now + self.ttl, state)
+            shard.move_to_end(conversation_id)
+            return state
+
+    def set(self, conversation_id, state):
+        index = self._index(conversation_id)
+        with self._locks[index]:
+            shard = self._shards[index]
+            now = time.monotonic()
+            shard[conversation_id] = (now + self.ttl, state)
+            shard.move_to_end(conversation_id)
+            self._sweep(shard, now)
+            evicted = []
+            while len(shard) > self._max_per_shard:
+                evicted.append(shard.popitem(last=False)[0])
+                self.evictions += 1
+        for evicted_id in evicted:
+            self._evicted(evicted_id)
+
+    def _evicted(self, conversation_id):
+        """Called after a session was evicted to stay under max_entries"""
+
+    def pop(self, conversation_id, default=None):
+        index = self._index(conversation_id)
+        with self._locks[index]:
+            entry = self._shards[index].pop(conversation_id, None)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def purge_expired(self):
+        """Sweep every shard; returns the number of live sessions left"""
+        now = time.monotonic()
+        for lock, shard in zip(self._locks, self._shards):
+            with lock:
+                self._sweep(shard, now)
+        return len(self)
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "liveSessions": len(self),
+            "maxEntries": self.max_entries,
+            "ttlSeconds": self.ttl,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# In-memory stores are the default
+InMemoryStateBackend = ConversationStateStore
+
+
+def create_state_backend(url=None, max_entries=100000, ttl=3600, journal_dir=None, namespace=None):
+    """Create the state backend for a URL (redis://host:port/db) or in memory
+
+    With `journal_dir` the in-memory store is journaled to that directory and
+    restored from it (see state_journal.py). External state is kept apart per
+    `namespace` (the question bank version), since question ids are only
+    meaningful within one bank.
+    """
+    if url and url.startswith(('redis://', 'unix://')):
+        from redis_state_backend import RedisStateBackend
+        prefix = f"semantic:conversation:{namespace}:" if namespace else "semantic:conversation:"
+        return RedisStateBackend(url, ttl=ttl, prefix=prefix)
+    if url and url != 'memory://':
+        raise ValueError(f"Unsupported state backend URL '{url}'")
+    if journal_dir:
+        from state_journal import JournaledStateStore
+        if namespace:
+            journal_dir = os.path.join(journal_dir, namespace)
+        return JournaledStateStore(journal_dir, max_entries=max_entries, ttl=ttl)
+    return InMemoryStateBackend(max_entries=max_entries, ttl=ttl)
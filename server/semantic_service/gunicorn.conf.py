@@ -0,0 +1,42 @@
+# Gunicorn settings for running a semantic service with several worker processes
+#
+#   cd server/semantic_service
+#   gunicorn -c gunicorn.conf.py
+#
+# The app is created once in the master (preload_app) so the embedding artifact
+# and compiled question index are loaded before fork and shared copy-on-write.
+# Background threads are started per worker in post_fork.
+import gc
+import multiprocessing
+import os
+import sys
+
+# A co-located caller can use a Unix domain socket (SEMANTIC_SERVICE_SOCKET)
+# instead of loopback TCP; set SEMANTIC_SERVICE_BIND empty to serve only the
+# socket. Idle connections are kept open for `keepalive` seconds, so callers
+# can reuse them (see "Persistent connections" in OPTIMIZED_README.md).
+
+wsgi_app = os.environ.get("SEMANTIC_SERVICE_APP", "optimized_semantic_service:create_app()")
+bind = [address for address in [os.environ.get("SEMANTIC_SERVICE_BIND", "0.0.0.0:5000")] if address]
+if os.environ.get("SEMANTIC_SERVICE_SOCKET"):
+    bind.append("unix:" + os.environ["SEMANTIC_SERVICE_SOCKET"])
+keepalive = int(os.environ.get("SEMANTIC_SERVICE_KEEPALIVE", 75))
+umask = 0o007  # The socket is usable by the service's user and group only
+workers = int(os.environ.get("SEMANTIC_SERVICE_WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("SEMANTIC_SERVICE_THREADS", 8))
+preload_app = True
+timeout = 120  # A cold Ollama model load can take a while
+
+
+def when_ready(server):
+    """Move preloaded objects out of the GC's reach so collections in workers
+    do not write to (and un-share) the pages inherited from the master"""
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Start the per-process embedding worker threads in each worker"""
+    module = sys.modules.get(wsgi_app.split(":")[0])
+    if hasattr(module, "start_background_workers"):
+        module.start_background_workers()
@@ -0,0 +1,89 @@
+import math
+import re
+
+import numpy as np
+
+# Lexical stand-in for Ollama embeddings, used when a request is answered in
+# degraded mode.
+#
+# The tier is built from bank texts (questions, variants and options) whose
+# embeddings are already cached. A message is scored against those texts by
+# IDF-weighted word overlap, and its stand-in embedding is the score-weighted
+# mean of the best matches' embeddings. It therefore lives in the same space
+# as the question index and option embeddings, so the normal mapping logic,
+# thresholds included, runs on it unchanged. A message that shares no
+# informative word with the bank gets None.
+
+TOKEN_PATTERN = re.compile(r"[a-z]+(?:'[a-z]+)?")
+STOPWORDS = frozenset(
+    "a an and are as at be been but by do does for from had has have i i'm in is it it's me my "
+    "of on or so than that the this to was were what with you your".split())
+SUFFIXES = ("ing", "ed", "ly", "es", "s")
+TOP_MATCHES = 3
+
+
+def stem(token):
+    """Strip one common suffix, so "sleeping" and "sleep" match"""
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokens(text):
+    return {stem(token) for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS}
+
+
+class LexicalTier:
+    """IDF-weighted word overlap against bank texts with known embeddings"""
+
+    def __init__(self, texts, embeddings):
+        self.texts = list(texts)
+        self._tokens = [tokens(text) for text in self.texts]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self._vectors = vectors / np.where(norms == 0, 1, norms)
+
+        document_frequency = {}
+        for text_tokens in self._tokens:
+            for token in text_tokens:
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+        count = len(self.texts)
+        self._idf = {token: math.log(1 + count / frequency) for token, frequency in document_frequency.items()}
+        self._weights = [sum(self._idf[token] for token in text_tokens) for text_tokens in self._tokens]
+        self._postings = {}
+        for i, text_tokens in enumerate(self._tokens):
+            for token in text_tokens:
+                self._postings.setdefault(token, []).append(i)
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def dim(self):
+        return self._vectors.shape[1]
+
+    def matches(self, text, k=TOP_MATCHES):
+        """Return [(bank text index, score)] for the best overlapping texts"""
+        message_tokens = tokens(text) & self._idf.keys()
+        if not message_tokens:
+            return []
+        message_weight = sum(self._idf[token] for token in message_tokens)
+        overlap = {}
+        for token in message_tokens:
+            for i in self._postings[token]:
+                overlap[i] = overlap.get(i, 0.0) + self._idf[token]
+        scored = [(i, shared / math.sqrt(message_weight * self._weights[i])) for i, shared in overlap.items()]
+        scored.sort(key=lambda match: -match[1])
+        return scored[:k]
+
+    def embed(self, text):
+        """Stand-in embedding for a message, or None if nothing overlaps"""
+        matches = self.matches(text)
+        if not matches:
+            return None
+        indices = [i for i, _ in matches]
+        weights = np.array([score for _, score in matches], dtype=np.float32)
+        embedding = weights @ self._vectors[indices]
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else None
@@ -0,0 +1,80 @@
+import re
+
+import numpy as np
+
+# Chunked mapping of long messages.
+#
+# A pasted paragraph embedded in one call is slow, since Ollama's cost grows
+# with the input length, and its one vector averages the sentence that
+# matters with everything around it. A message of at least `min_words`
+# words is therefore split into sentences. A sentence longer than
+# `window_words` is cut into windows that overlap by half. The chunks are
+# embedded together in one batched call, and each chunk is scored against
+# the candidates (questions or options) on its own.
+#
+# The chunk scores of each candidate are then pooled:
+#   max        the candidate's best chunk score, so one clear sentence decides
+#   attention  a mean of the chunk scores, weighted by a softmax over each
+#              chunk's best score at ATTENTION_TEMPERATURE, so chunks that
+#              match nothing well weigh little but several relevant ones
+#              all count
+# The chunk that contributed most to the winning candidate is reported as
+# the one that drove the match.
+
+SENTENCE_BREAK = re.compile(r"(?<=[.!?;])\s+|\s*\n+\s*")
+MAX_CHUNKS = 16                 # Adjacent chunks are merged in pairs beyond this
+ATTENTION_TEMPERATURE = 0.05
+POOLING_MODES = ("max", "attention")
+
+
+def split_message(text, min_words=40, window_words=24):
+    """Return the chunks of a long message, or None for a message shorter than `min_words`"""
+    if len(text.split()) < min_words:
+        return None
+    chunks = []
+    for sentence in SENTENCE_BREAK.split(text.strip()):
+        words = sentence.split()
+        if len(words) <= window_words:
+            if words:
+                chunks.append(" ".join(words))
+            continue
+        stride = max(window_words // 2, 1)
+        for start in range(0, len(words) - window_words + stride, stride):
+            chunks.append(" ".join(words[start:start + window_words]))
+    while len(chunks) > MAX_CHUNKS:
+        chunks = [" ".join(chunks[i:i + 2]) for i in range(0, len(chunks), 2)]
+    return chunks if len(chunks) > 1 else None
+
+
+def pool_scores(scores, mode="max", temperature=ATTENTION_TEMPERATURE):
+    """Pool a (chunks, candidates) score matrix
+
+    Returns the pooled score of each candidate and, for each candidate, the
+    chunk that contributed most to it.
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    if mode == "attention":
+        salience = scores.max(axis=1)
+        weights = np.exp((salience - salience.max()) / temperature)
+        weights /= weights.sum()
+        contributions = weights[:, None] * scores
+        return contributions.sum(axis=0), contributions.argmax(axis=0)
+    if mode != "max":
+        raise ValueError(f"Unknown pooling mode {mode!r}; use one of {POOLING_MODES}")
+    return scores.max(axis=0), scores.argmax(axis=0)
+
+
+class ChunkedMessage:
+    """The chunks of a long message and their embeddings, one row per chunk"""
+
+    def __init__(self, chunks, vectors):
+        self.chunks = list(chunks)
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+
+    def __len__(self):
+        # The embedding size, as for a single embedding
+        return self.vectors.shape[1]
+
+    def describe(self, chunk):
+        """The `matchedChunk` of a response: which chunk drove the match"""
+        return {"index": chunk, "count": len(self.chunks), "text": self.chunks[chunk]}
@@ -0,0 +1,174 @@
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+# Near-duplicate reuse of user-message embeddings.
+#
+# The embedding caches are keyed by the exact (lowercased) text, so "I'm so
+# tired" and "im so so tired" each cost an Ollama call. Messages are first
+# normalized (apostrophes and punctuation dropped, a word repeated in a row
+# kept once), which makes many such pairs identical. What normalization
+# misses, typos and small rewordings, shows up as a small Jaccard distance
+# between the texts' sets of character trigrams. A message within
+# `distance` of one already embedded reuses that embedding.
+#
+# Candidates are found with MinHash-LSH: a signature of PERMUTATIONS
+# minimum hashes, cut into BANDS bands, and only messages that agree on a
+# whole band are compared. With 16 bands of 4, a pair at distance 0.2 is a
+# candidate with probability 0.9998, and one at 0.7 with probability 0.12.
+# Candidates are then checked against the exact distance, so the bands only
+# make lookups cheap and never cause a reuse by themselves.
+#
+# Character similarity cannot tell "I don't enjoy anything" from "I do enjoy
+# anything", or "for 3 days" from "for 5 days", so two messages must also
+# contain the same negation words and numbers. Among many similar messages,
+# a band remembers only the BUCKET_SIZE latest, and only the MAX_CANDIDATES
+# that agree on the most bands are compared.
+#
+# The index only learns embeddings Ollama returned, never reused ones, so
+# errors do not compound. Whether reuse changes outcomes is measured, not
+# assumed: the services re-embed a sample of reused messages in the
+# background and record here how close the true embedding was and whether
+# it maps to the same question.
+
+PERMUTATIONS = 64
+BANDS = 16
+BUCKET_SIZE = 64
+MAX_CANDIDATES = 16
+PRIME = 4294967311          # First prime above 2**32
+NON_WORD = re.compile(r"[^a-z0-9]+")
+NEGATIONS = frozenset(
+    "no not never nothing none nobody nowhere neither nor without hardly barely cannot cant dont doesnt didnt "
+    "wont wouldnt isnt arent wasnt werent havent hasnt hadnt couldnt shouldnt aint".split())
+
+_random = np.random.default_rng(20240601)
+_A = _random.integers(1, 1 << 31, PERMUTATIONS, dtype=np.uint64)
+_B = _random.integers(0, 1 << 31, PERMUTATIONS, dtype=np.uint64)
+
+
+def normalize(text):
+    """Lowercase words without punctuation, a word repeated in a row kept once"""
+    words = NON_WORD.sub(" ", text.lower().replace("'", "").replace("’", "")).split()
+    return " ".join(word for i, word in enumerate(words) if i == 0 or word != words[i - 1])
+
+
+def anchors(normalized):
+    """Words that change a message's meaning however few characters they are"""
+    return frozenset(word for word in normalized.split() if word in NEGATIONS or word.isdigit())
+
+
+def trigrams(normalized):
+    padded = f" {normalized} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def signature(shingles):
+    """MinHash signature of a set of shingles"""
+    hashes = np.array([zlib.crc32(shingle.encode()) for shingle in shingles], dtype=np.uint64)
+    return ((np.outer(hashes, _A) + _B) % PRIME).min(axis=0)
+
+
+def jaccard_distance(first, second):
+    return 1 - len(first & second) / len(first | second)
+
+
+class NearDuplicateIndex:
+    """Embeddings of recent messages, found by Jaccard distance of their trigrams"""
+
+    def __init__(self, max_entries=10000, distance=0.15):
+        self.max_entries = max_entries
+        self.distance = distance
+        self._entries = OrderedDict()   # normalized text -> (trigrams, anchors, band keys, embedding)
+        self._buckets = {}              # band key -> normalized texts, oldest first
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.reuses = 0
+        self.audits = 0
+        self.agreed = 0
+        self._cosine_total = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _describe(normalized):
+        shingles = trigrams(normalized)
+        rows = signature(shingles).reshape(BANDS, -1)
+        keys = [(band, row.tobytes()) for band, row in enumerate(rows)]
+        return shingles, anchors(normalized), keys
+
+    def find(self, text):
+        """Return (embedding, Jaccard distance) of the nearest indexed message, or None"""
+        normalized = normalize(text)
+        if not normalized:
+            return None
+        shingles, words, keys = self._describe(normalized)
+        with self._lock:
+            self.lookups += 1
+            entry = self._entries.get(normalized)
+            if entry is not None:
+                best, best_distance = normalized, 0.0
+            else:
+                candidates = Counter()
+                for key in keys:
+                    candidates.update(tuple(self._buckets.get(key, ())))
+                best, best_distance = None, self.distance
+                for candidate, _ in candidates.most_common(MAX_CANDIDATES):
+                    other_shingles, other_words, _, _ = self._entries[candidate]
+                    if other_words != words:
+                        continue
+                    distance = jaccard_distance(shingles, other_shingles)
+                    if distance <= best_distance:
+                        best, best_distance = candidate, distance
+                if best is None:
+                    return None
+            self._entries.move_to_end(best)
+            self.reuses += 1
+            return self._entries[best][3], best_distance
+
+    def add(self, text, embedding):
+        """Index the embedding Ollama returned for a message"""
+        normalized = normalize(text)
+        if not normalized or self.max_entries <= 0:
+            return
+        shingles, words, keys = self._describe(normalized)
+        with self._lock:
+            if normalized not in self._entries:
+                for key in keys:
+                    bucket = self._buckets.setdefault(key, {})
+                    bucket[normalized] = None
+                    if len(bucket) > BUCKET_SIZE:
+                        del bucket[next(iter(bucket))]
+            self._entries[normalized] = (shingles, words, keys, embedding)
+            self._entries.move_to_end(normalized)
+            while len(self._entries) > self.max_entries:
+                evicted, (_, _, evicted_keys, _) = self._entries.popitem(last=False)
+                for key in evicted_keys:
+                    bucket = self._buckets.get(key)
+                    if bucket is not None:
+                        bucket.pop(evicted, None)
+                        if not bucket:
+                            del self._buckets[key]
+
+    def record_audit(self, cosine, agreed):
+        """Record how a reused embedding compared with the message's true one"""
+        with self._lock:
+            self.audits += 1
+            self.agreed += bool(agreed)
+            self._cosine_total += float(cosine)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "distance": self.distance,
+                "lookups": self.lookups,
+                "reuses": self.reuses,
+                "reuseRate": round(self.reuses / self.lookups, 4) if self.lookups else None,
+                "audits": self.audits,
+                "agreement": round(self.agreed / self.audits, 4) if self.audits else None,
+                "meanCosine": round(self._cosine_total / self.audits, 4) if self.audits else None,
+            }
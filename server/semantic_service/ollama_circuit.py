@@ -0,0 +1,94 @@
+import threading
+import time
+
+# Circuit breaker for calls to Ollama.
+#
+# After `failure_threshold` consecutive failures the circuit opens: allow()
+# returns False and callers go straight to their fallback instead of waiting
+# out timeouts and retries against an Ollama that is down. After
+# `reset_seconds` the circuit is half-open and lets one trial call through;
+# its success closes the circuit and its failure opens it again. A trial that
+# never reports back (the caller died) is given up after another
+# `reset_seconds`.
+#
+# Breakers are per process. Each worker learns Ollama's state from its own
+# calls, which keeps /status and /readyz free of network calls.
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open trial"""
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0            # consecutive failures
+        self._opened_at = 0.0
+        self._trial_started = None    # monotonic time of the half-open trial in flight
+        self.opens = 0
+        self.short_circuited = 0
+        self.last_success = None      # wall clock, for /status
+        self.last_failure = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.reset_seconds:
+            self._state = HALF_OPEN
+            self._trial_started = None
+        return self._state
+
+    def allow(self):
+        """Return True if a call to Ollama may be made now"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and (self._trial_started is None
+                                       or now - self._trial_started >= self.reset_seconds):
+                self._trial_started = now
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_started = None
+            self.last_success = time.time()
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self.last_failure = time.time()
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.opens += 1
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_started = None
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            retry_in = self.reset_seconds - (now - self._opened_at) if state == OPEN else 0.0
+            return {
+                "state": state,
+                "consecutiveFailures": self._failures,
+                "retryInSeconds": round(max(retry_in, 0.0), 3),
+                "opens": self.opens,
+                "shortCircuited": self.short_circuited,
+                "lastSuccess": self.last_success,
+                "lastFailure": self.last_failure,
+            }
@@ -0,0 +1,72 @@
+import threading
+
+# Hedged Ollama calls.
+#
+# A call that has not answered by the observed p95 (of a LatencyWindow) is
+# sent a second time, to another instance when the pool has one, and the
+# first answer wins. Only about one call in twenty gets that far, so p99
+# drops to roughly p95 plus one more call at little extra load. A budget
+# caps the extra load outright: each eligible call earns `max_rate` of a
+# hedge, up to a burst of `burst`, and each hedge spends one. When Ollama as
+# a whole slows down, the budget runs out instead of doubling its load.
+#
+# This class only decides when to hedge and keeps the score; the services
+# send the calls and settle the race.
+
+MIN_DELAY = 0.005   # Never hedge sooner than this, however fast Ollama has been
+
+
+class HedgePolicy:
+    """Delay before hedging a call, and a budget for hedges"""
+
+    def __init__(self, latencies, percentile=95, max_rate=0.05, burst=5):
+        self.latencies = latencies
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.won = 0
+        self.lost = 0
+        self.over_budget = 0
+
+    def delay(self):
+        """Seconds to wait before hedging a call that starts now, or None
+
+        Each call asked about counts towards the hedge budget.
+        """
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(self.burst, self._tokens + self.max_rate)
+        threshold = self.latencies.percentile(self.percentile)
+        return None if threshold is None else max(threshold, MIN_DELAY)
+
+    def take(self):
+        """Spend budget on one hedge; False if there is none left"""
+        with self._lock:
+            if self._tokens < 1:
+                self.over_budget += 1
+                return False
+            self._tokens -= 1
+            self.hedged += 1
+            return True
+
+    def settle(self, hedge_won):
+        with self._lock:
+            if hedge_won:
+                self.won += 1
+            else:
+                self.lost += 1
+
+    def stats(self):
+        return {
+            "percentile": self.percentile,
+            "maxRate": self.max_rate,
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "won": self.won,
+            "lost": self.lost,
+            "overBudget": self.over_budget,
+        }
@@ -0,0 +1,47 @@
+import threading
+from collections import deque
+
+# Rolling distribution of recent Ollama call latencies.
+#
+# Keeps the last `size` successful call times and answers percentile
+# queries over them. The sorted view is rebuilt after every `size // 16` new
+# samples rather than on each query, so a lookup on the request path costs
+# an index, not a sort. Until `min_samples` calls have been seen there is no
+# distribution to speak of and percentile() returns None.
+
+class LatencyWindow:
+    """Percentiles over the most recent call times, in seconds"""
+
+    def __init__(self, size=512, min_samples=20):
+        self.size = size
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._sorted = []
+        self._stale = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self._stale += 1
+
+    def percentile(self, p):
+        """The p-th percentile (0-100) of recent call times, or None if too few"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            if self._stale >= max(1, self.size // 16) or not self._sorted:
+                self._sorted = sorted(self._samples)
+                self._stale = 0
+            ordered = self._sorted
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def stats(self):
+        return {
+            "samples": len(self._samples),
+            **{f"p{p}Ms": round(value * 1000, 3) if value is not None else None
+               for p in (50, 95, 99) for value in [self.percentile(p)]},
+        }
@@ -0,0 +1,178 @@
+import threading
+import time
+
+import requests
+
+# A pool of Ollama endpoints (base URLs of separate Ollama processes).
+#
+# Each call goes to the admitted endpoint with the fewest outstanding
+# requests; ties go to the lower recent latency. An endpoint is ejected after
+# `eject_failures` consecutive failed calls, or at once when it refuses
+# connections. A health-check thread, started on the first ejection, probes
+# ejected endpoints every `check_interval` seconds and readmits those that
+# answer. If every endpoint is ejected, calls are spread over all of them
+# again rather than refused, and the circuit breaker takes over from there.
+#
+# With `cold_after` set (Ollama's keep-alive), an instance that has not
+# answered for that long has probably unloaded the model. A call is only
+# routed to it when no warm instance is admitted; otherwise it goes to a warm
+# one and `on_cold` is called, once, to warm the cold instance up.
+
+HEALTH_PATH = "/api/version"
+HEALTH_TIMEOUT = 2.0
+LATENCY_WEIGHT = 0.2    # Weight of the newest call in the moving average
+
+
+class Endpoint:
+    __slots__ = ("url", "outstanding", "failures", "ejected", "ejections", "calls", "latency", "last_used",
+                 "warming", "cold_loads")
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected = False
+        self.ejections = 0
+        self.calls = 0
+        self.latency = None      # moving average of call seconds
+        self.last_used = None    # monotonic time of the last successful call
+        self.warming = False     # a warm-up call is on its way
+        self.cold_loads = 0
+
+    def stats(self):
+        return {
+            "outstanding": self.outstanding,
+            "ejected": self.ejected,
+            "ejections": self.ejections,
+            "calls": self.calls,
+            "latencyMs": round(self.latency * 1000, 3) if self.latency is not None else None,
+            "idleSeconds": round(time.monotonic() - self.last_used, 3) if self.last_used is not None else None,
+            "coldLoads": self.cold_loads,
+        }
+
+
+class OllamaPool:
+    """Least-outstanding-requests routing over Ollama endpoints, with ejection"""
+
+    def __init__(self, urls, eject_failures=2, check_interval=5.0, on_change=None, cold_after=None, on_cold=None):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.eject_failures = eject_failures
+        self.check_interval = check_interval
+        self.on_change = on_change         # called with (endpoint, admitted)
+        self.cold_after = cold_after
+        self.on_cold = on_cold             # called with an endpoint to warm up
+        self._lock = threading.Lock()
+        self._checker = None
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def admitted(self):
+        return [endpoint for endpoint in self.endpoints if not endpoint.ejected]
+
+    def idle(self, seconds):
+        """Admitted endpoints without a successful call in the last `seconds`"""
+        now = time.monotonic()
+        return [e for e in self.admitted() if e.last_used is None or now - e.last_used >= seconds]
+
+    def _cold(self, endpoint, now):
+        return self.cold_after is not None and (endpoint.last_used is None or now - endpoint.last_used > self.cold_after)
+
+    def warm(self):
+        """Admitted endpoints that have probably still got the model loaded"""
+        now = time.monotonic()
+        return [endpoint for endpoint in self.admitted() if not self._cold(endpoint, now)]
+
+    def acquire(self, exclude=()):
+        """Pick an endpoint for one call and count it as outstanding, or None"""
+        warm_up = None
+        with self._lock:
+            candidates = [e for e in self.endpoints if not e.ejected and e not in exclude]
+            if not candidates and not exclude:
+                candidates = self.endpoints
+            if not candidates:
+                return None
+            least_loaded = lambda e: (e.outstanding, e.latency or 0.0)
+            endpoint = min(candidates, key=least_loaded)
+            now = time.monotonic()
+            if self._cold(endpoint, now):
+                warm = [e for e in candidates if not self._cold(e, now)]
+                if warm:
+                    if not endpoint.warming:
+                        endpoint.warming = True
+                        warm_up = endpoint
+                    endpoint = min(warm, key=least_loaded)
+            endpoint.outstanding += 1
+            endpoint.calls += 1
+        if warm_up is not None and self.on_cold is not None:
+            self.on_cold(warm_up)
+        return endpoint
+
+    def release(self, endpoint, seconds, ok, refused=False):
+        """Finish a call; a failure counts towards ejection, a refusal ejects at once
+
+        `ok` is None for a call the caller gave up on, which says nothing
+        about the endpoint.
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if ok is None:
+                return
+            if ok:
+                endpoint.failures = 0
+                endpoint.last_used = time.monotonic()
+                endpoint.latency = seconds if endpoint.latency is None else (
+                    endpoint.latency + LATENCY_WEIGHT * (seconds - endpoint.latency))
+                return
+            endpoint.failures += 1
+            eject = (refused or endpoint.failures >= self.eject_failures) and not endpoint.ejected
+            if eject:
+                endpoint.ejected = True
+                endpoint.ejections += 1
+        if eject:
+            self._changed(endpoint, False)
+            self._start_checker()
+
+    def warmed(self, endpoint, ok):
+        """Record a warm-up call, made outside acquire() and release()"""
+        with self._lock:
+            endpoint.warming = False
+            if ok:
+                endpoint.last_used = time.monotonic()
+
+    def _changed(self, endpoint, admitted):
+        if self.on_change is not None:
+            self.on_change(endpoint, admitted)
+
+    def _start_checker(self):
+        with self._lock:
+            if self._checker is not None:
+                return
+            self._checker = threading.Thread(target=self._check_ejected, daemon=True)
+            self._checker.start()
+
+    def check(self, endpoint):
+        """True if the endpoint answers its health check"""
+        try:
+            return requests.get(endpoint.url + HEALTH_PATH, timeout=HEALTH_TIMEOUT).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def _check_ejected(self):
+        """Probe ejected endpoints until all are readmitted"""
+        while True:
+            time.sleep(self.check_interval)
+            with self._lock:
+                ejected = [endpoint for endpoint in self.endpoints if endpoint.ejected]
+                if not ejected:
+                    self._checker = None
+                    return
+            for endpoint in ejected:
+                if self.check(endpoint):
+                    with self._lock:
+                        endpoint.ejected = False
+                        endpoint.failures = 0
+                    self._changed(endpoint, True)
+
+    def stats(self):
+        return {endpoint.url: endpoint.stats() for endpoint in self.endpoints}
@@ -0,0 +1,29 @@
+# Keeping the embedding model loaded in Ollama, and spotting when it was not.
+#
+# Ollama unloads a model once it has been idle for its keep-alive (5 minutes
+# by default). The next call then waits for the model to load, which takes
+# seconds rather than milliseconds. The services counter this in three ways:
+#
+#   - every embedding call passes `keep_alive`, so Ollama keeps the model for
+#     as long as the service asks (OLLAMA_KEEP_ALIVE)
+#   - an instance idle for OLLAMA_KEEP_WARM_IDLE seconds gets a one-word
+#     embedding call, a keep-warm ping, which also renews the keep-alive
+#   - the pool routes live calls away from an instance idle longer than the
+#     keep-alive while a warm one is admitted, and pings the cold one
+#
+# A model can still be evicted, e.g. when another model needs the memory.
+# Such a load shows in the call's latency: it is at least
+# COLD_LOAD_MIN_SECONDS and COLD_LOAD_FACTOR times the typical call. These
+# calls are counted as cold loads and kept out of the latency window, so one
+# slow load does not stretch timeouts and hedge delays.
+
+COLD_LOAD_FACTOR = 10
+COLD_LOAD_MIN_SECONDS = 1.0
+
+
+def is_cold_load(seconds, latencies):
+    """True if a call took as long as loading the model, given recent call times"""
+    typical = latencies.percentile(50)
+    if typical is None:
+        return seconds >= COLD_LOAD_MIN_SECONDS
+    return seconds >= max(COLD_LOAD_MIN_SECONDS, COLD_LOAD_FACTOR * typical)
@@ -0,0 +1,77 @@
+import random
+import threading
+
+# Per-attempt timeouts and retries for Ollama calls, driven by observed latency.
+#
+# No fixed timeout suits both a warm Ollama answering in 20 ms and a cold
+# model load that takes seconds. AdaptiveTimeout gives each attempt a
+# multiple of the observed p99 (from a LatencyWindow), held between `floor`
+# and `ceiling`. Until enough calls have been seen, the ceiling applies, so
+# a first call that loads the model has time to finish.
+#
+# RetryBudget caps retries at a fraction of traffic across all requests.
+# Each first attempt earns `ratio` of a retry, up to `burst`, and each retry
+# spends one. An Ollama that fails every call then sees at most (1 + ratio)
+# times the traffic, not one call per attempt allowed. The wait before a
+# retry is drawn at random below an exponentially growing cap ("full
+# jitter"), so callers that failed together do not retry together.
+
+
+class AdaptiveTimeout:
+    """Per-attempt timeout from a latency percentile, with a floor and a ceiling"""
+
+    def __init__(self, latencies, percentile=99, multiplier=3.0, floor=1.0, ceiling=30.0):
+        self.latencies = latencies
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.floor = floor
+        self.ceiling = ceiling
+
+    def timeout(self):
+        observed = self.latencies.percentile(self.percentile)
+        if observed is None:
+            return self.ceiling
+        return min(self.ceiling, max(self.floor, observed * self.multiplier))
+
+
+class RetryBudget:
+    """Token bucket that limits retries to a fraction of first attempts"""
+
+    def __init__(self, ratio=0.1, burst=10):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = float(burst)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.denied = 0
+
+    def record_call(self):
+        """Count a first attempt, earning `ratio` of a retry"""
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def take(self):
+        """Spend budget on one retry; False if there is none left"""
+        with self._lock:
+            if self._tokens < 1:
+                self.denied += 1
+                return False
+            self._tokens -= 1
+            self.retries += 1
+            return True
+
+    def stats(self):
+        return {
+            "ratio": self.ratio,
+            "tokens": round(self._tokens, 3),
+            "calls": self.calls,
+            "retries": self.retries,
+            "denied": self.denied,
+        }
+
+
+def backoff(retry, base, cap):
+    """Seconds to wait before retry number `retry` (1 for the first)"""
+    return random.uniform(0, min(cap, base * 2 ** (retry - 1)))
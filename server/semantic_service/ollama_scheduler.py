@@ -0,0 +1,195 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Scheduling of Ollama calls by priority class.
+#
+# Every call to Ollama takes one of `max_in_flight` slots, a cap set to what
+# Ollama serves in parallel (OLLAMA_NUM_PARALLEL), so excess calls queue here
+# instead of inside Ollama where nothing can reorder them. Three classes
+# queue separately and a freed slot goes to the oldest waiter of the first
+# non-empty class:
+#
+#   interactive  embeddings a live request is waiting for
+#   warmup       preloading the question bank
+#   background   the embedding worker and other maintenance
+#
+# Warmup and background never take the last free slot, so an interactive
+# call finds one without waiting on bulk work. Background calls are also
+# limited to `background_slots` at once and paced to `background_rate` calls
+# per second. Bulk work is preempted between calls: it is split into small
+# batches (PREEMPTIBLE_BATCH) that queue one by one, so interactive calls
+# overtake it at every batch boundary.
+#
+# The class of the calls a thread or task makes is a ContextVar: run bulk
+# work inside running_as(WARMUP) or running_as(BACKGROUND).
+
+INTERACTIVE = "interactive"
+WARMUP = "warmup"
+BACKGROUND = "background"
+CLASSES = (INTERACTIVE, WARMUP, BACKGROUND)
+
+PREEMPTIBLE_BATCH = 8   # Texts per Ollama call for warmup and background work
+
+work_class = contextvars.ContextVar("ollama_work_class", default=INTERACTIVE)
+
+
+@contextmanager
+def running_as(work):
+    """Make the enclosed block's Ollama calls part of a priority class"""
+    token = work_class.set(work)
+    try:
+        yield
+    finally:
+        work_class.reset(token)
+
+
+class _Waiter:
+    __slots__ = ("work", "wake", "granted")
+
+    def __init__(self, work, wake):
+        self.work = work
+        self.wake = wake
+        self.granted = False
+
+
+class OllamaScheduler:
+    """Global cap on Ollama calls with priority classes"""
+
+    def __init__(self, max_in_flight=4, background_slots=None, background_rate=None):
+        self.max_in_flight = max(1, max_in_flight)
+        reserved = 1 if self.max_in_flight > 1 else 0
+        self.limits = {
+            INTERACTIVE: self.max_in_flight,
+            WARMUP: self.max_in_flight - reserved,
+            BACKGROUND: min(self.max_in_flight - reserved,
+                            background_slots or max(1, self.max_in_flight // 2)),
+        }
+        self.background_rate = background_rate
+        self.in_flight = {work: 0 for work in CLASSES}
+        self.calls = {work: 0 for work in CLASSES}
+        self._lock = threading.Lock()
+        self._waiters = {work: deque() for work in CLASSES}
+        # Token bucket pacing background calls
+        self._tokens = float(self.limits[BACKGROUND])
+        self._refilled = time.monotonic()
+
+    def queued(self, work=None):
+        if work is None:
+            return sum(len(waiters) for waiters in self._waiters.values())
+        return len(self._waiters[work])
+
+    def _can_start(self, work):
+        if sum(self.in_flight.values()) >= self.max_in_flight or self.in_flight[work] >= self.limits[work]:
+            return False
+        if work != INTERACTIVE and sum(self.in_flight.values()) >= self.limits[work]:
+            return False
+        return True
+
+    def _try_enter(self, work, wake):
+        """Take a slot now, or queue a waiter; returns the waiter or None"""
+        with self._lock:
+            ahead = any(self._waiters[other] for other in CLASSES[:CLASSES.index(work) + 1])
+            if not ahead and self._can_start(work):
+                self.in_flight[work] += 1
+                self.calls[work] += 1
+                return None
+            waiter = _Waiter(work, wake)
+            self._waiters[work].append(waiter)
+            return waiter
+
+    def _give_up(self, waiter):
+        """Leave the queue after a timeout; returns True if a slot arrived meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters[waiter.work].remove(waiter)
+        # Lower classes may have been held back by this waiter
+        self._dispatch()
+        return False
+
+    def _dispatch(self):
+        """Grant free slots to waiters, highest class first"""
+        granted = []
+        with self._lock:
+            for work in CLASSES:
+                waiters = self._waiters[work]
+                while waiters and self._can_start(work):
+                    waiter = waiters.popleft()
+                    waiter.granted = True
+                    self.in_flight[work] += 1
+                    self.calls[work] += 1
+                    granted.append(waiter)
+                if waiters:
+                    break
+        for waiter in granted:
+            waiter.wake()
+
+    def _pace(self):
+        """Seconds to wait before the next background call may start"""
+        if not self.background_rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            burst = self.limits[BACKGROUND]
+            self._tokens = min(burst, self._tokens + (now - self._refilled) * self.background_rate)
+            self._refilled = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.background_rate
+
+    def acquire(self, work=None, timeout=None):
+        """Wait for a slot; returns (acquired, seconds waited)"""
+        work = work or work_class.get()
+        start = time.perf_counter()
+        if work == BACKGROUND:
+            time.sleep(self._pace())
+        event = threading.Event()
+        waiter = self._try_enter(work, event.set)
+        if waiter is None:
+            return True, time.perf_counter() - start
+        acquired = event.wait(timeout) or self._give_up(waiter)
+        return acquired, time.perf_counter() - start
+
+    async def acquire_async(self, work=None, timeout=None):
+        """acquire() for asyncio tasks"""
+        work = work or work_class.get()
+        start = time.perf_counter()
+        if work == BACKGROUND:
+            await asyncio.sleep(self._pace())
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        waiter = self._try_enter(work, wake)
+        if waiter is None:
+            return True, time.perf_counter() - start
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True, time.perf_counter() - start
+        except asyncio.TimeoutError:
+            return self._give_up(waiter), time.perf_counter() - start
+        except asyncio.CancelledError:
+            # Caller went away; pass on a slot we may already have been given
+            if self._give_up(waiter):
+                self.release(work)
+            raise
+
+    def release(self, work):
+        with self._lock:
+            self.in_flight[work] -= 1
+        self._dispatch()
+
+    def stats(self):
+        return {
+            "maxInFlight": self.max_in_flight,
+            "inFlight": dict(self.in_flight),
+            "queued": {work: self.queued(work) for work in CLASSES},
+            "calls": dict(self.calls),
+            "limits": dict(self.limits),
+            "backgroundRate": self.background_rate,
+        }
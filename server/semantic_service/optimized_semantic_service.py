@@ -1,32 +1,182 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
+from werkzeug.serving import WSGIRequestHandler
 import numpy as np
 import requests
+import concurrent.futures
+import contextvars
 import json
 import os
 import time
 from functools import lru_cache
 import threading
 import queue
+import random
 import re
 
+from admission import NORMAL, PRIORITY, AdmissionController
+from conversation_store import SessionState, create_state_backend
+from lexical_tier import LexicalTier
+from message_chunks import ChunkedMessage, pool_scores, split_message
+from near_duplicate import NearDuplicateIndex
+from ollama_circuit import CircuitBreaker
+from ollama_hedging import HedgePolicy
+from ollama_latency import LatencyWindow
+from ollama_retry import AdaptiveTimeout, RetryBudget, backoff
+from ollama_pool import OllamaPool
+from ollama_residency import is_cold_load
+from ollama_scheduler import (BACKGROUND, CLASSES, INTERACTIVE, PREEMPTIBLE_BATCH, WARMUP, OllamaScheduler,
+                              running_as, work_class)
+from question_bank import QuestionBank
+from request_deadline import DEADLINE_HEADER, bounded, expired, parse_budget, request_deadline
+from serialization import decode_body, embedding_from_json, embeddings_from_json, encode_body
+from service_logging import (TRACE_HEADER, collect_fields, configure_logging, logger, note, request_log,
+                             trace_headers)
+import service_metrics as metrics
+from service_metrics import stage, time_request
+from vector_index import build_index, normalize_rows
+
+try:
+    from shared_embedding_cache import SharedEmbeddingCache
+except ImportError:  # fcntl is not available on Windows
+    SharedEmbeddingCache = None
+
 app = Flask(__name__)
 
-# Ollama API endpoint
-OLLAMA_API_URL = "http://localhost:11434/api/embeddings"
+# Ollama instances (comma-separated base URLs) and API paths (single prompt and batched input)
+OLLAMA_URLS = [url.strip() for url in os.environ.get("OLLAMA_URLS", "http://localhost:11434").split(",")
+               if url.strip()]
+OLLAMA_API_PATH = "/api/embeddings"
+OLLAMA_EMBED_PATH = "/api/embed"
 OLLAMA_MODEL = "nomic-embed-text"  # You can also use other models like "llama2" or "mistral"
 
 # Configuration
 EMBEDDING_CACHE_SIZE = 1000  # Number of embeddings to cache
 EMBEDDING_BATCH_SIZE = 5     # Number of texts to batch together
-EMBEDDING_TIMEOUT = 30       # Timeout in seconds for embedding requests
-EMBEDDING_RETRY_COUNT = 3    # Number of retries for failed requests
-EMBEDDING_RETRY_DELAY = 1    # Delay between retries in seconds
+EMBEDDING_TIMEOUT = 30       # Longest timeout in seconds for an embedding request attempt
+EMBEDDING_TIMEOUT_FLOOR = float(os.environ.get("EMBEDDING_TIMEOUT_FLOOR", 1))  # Shortest attempt timeout in seconds
+EMBEDDING_RETRY_COUNT = 3    # Number of attempts per embedding at most
+EMBEDDING_RETRY_DELAY = 0.25 # Base of the jittered backoff between retries in seconds
+EMBEDDING_RETRY_MAX_DELAY = 2  # Longest backoff between retries in seconds
 PRELOAD_QUESTIONS = True     # Whether to preload question embeddings on startup
+VECTOR_INDEX_BACKEND = os.environ.get("VECTOR_INDEX_BACKEND", "auto")  # "flat", "ivf" or "auto"
+MAX_BATCH_ITEMS = 500        # Maximum number of items accepted by /map-response/batch
+SHARED_EMBEDDING_CACHE_SLOTS = int(os.environ.get("SHARED_EMBEDDING_CACHE_SLOTS", 16384))  # 0 disables
+EMBEDDING_DIM = 768          # nomic-embed-text size; only this size goes in the shared cache
+SHARED_CACHE_WAIT = 10       # Seconds to wait for another worker's in-flight embedding
+CONVERSATION_TTL = int(os.environ.get("CONVERSATION_TTL", 3600))            # Idle seconds before a pending question is dropped
+MAX_CONVERSATIONS = int(os.environ.get("MAX_CONVERSATIONS", 100000))       # Tracked conversations before LRU eviction
+STATE_BACKEND_URL = os.environ.get("STATE_BACKEND_URL")                    # e.g. redis://localhost:6379/0; in memory if unset
+STATE_JOURNAL_DIR = os.environ.get("STATE_JOURNAL_DIR")                    # Journal in-memory state here to survive restarts
+STATE_PURGE_INTERVAL = float(os.environ.get("STATE_PURGE_INTERVAL", 60))   # Seconds between sweeps of expired in-memory state (0 disables)
+OLLAMA_CIRCUIT_FAILURES = int(os.environ.get("OLLAMA_CIRCUIT_FAILURES", 5))   # Consecutive Ollama failures that open the circuit
+OLLAMA_CIRCUIT_RESET = float(os.environ.get("OLLAMA_CIRCUIT_RESET", 30))     # Seconds before an open circuit lets a trial call through
+READINESS_CHECK_INTERVAL = 1.0  # Seconds /readyz reuses a state backend check
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 8))     # Requests mapped at once per process
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 32))            # Requests waiting for a slot
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 5))   # Seconds a request may wait for a slot
+DEGRADED_MODE = os.environ.get("DEGRADED_MODE", "1") != "0"                    # Answer shed requests without Ollama
+OLLAMA_MAX_IN_FLIGHT = int(os.environ.get("OLLAMA_MAX_IN_FLIGHT", 4 * len(OLLAMA_URLS)))  # Ollama calls at once per process; OLLAMA_NUM_PARALLEL per instance
+OLLAMA_BACKGROUND_SLOTS = int(os.environ.get("OLLAMA_BACKGROUND_SLOTS", 0))    # Background calls at once (0: half the cap)
+OLLAMA_BACKGROUND_RATE = float(os.environ.get("OLLAMA_BACKGROUND_RATE", 20))   # Background calls per second (0: unpaced)
+OLLAMA_EJECT_FAILURES = int(os.environ.get("OLLAMA_EJECT_FAILURES", 2))        # Consecutive failures that eject an Ollama instance
+OLLAMA_HEALTH_INTERVAL = float(os.environ.get("OLLAMA_HEALTH_INTERVAL", 5))    # Seconds between health checks of ejected instances
+OLLAMA_KEEP_ALIVE = int(os.environ.get("OLLAMA_KEEP_ALIVE", 1800))             # Seconds Ollama keeps the model loaded after a call (-1: for ever)
+OLLAMA_KEEP_WARM_IDLE = float(os.environ.get("OLLAMA_KEEP_WARM_IDLE", 240))    # Ping an instance idle this many seconds (0: never)
+OLLAMA_RETRY_RATIO = float(os.environ.get("OLLAMA_RETRY_RATIO", 0.1))          # Retries per first attempt at most, across requests
+OLLAMA_HEDGING = os.environ.get("OLLAMA_HEDGING", "0") != "0"                   # Hedge live embedding calls that run long
+OLLAMA_HEDGE_PERCENTILE = float(os.environ.get("OLLAMA_HEDGE_PERCENTILE", 95))  # Latency percentile after which a call is hedged
+OLLAMA_HEDGE_MAX_RATE = float(os.environ.get("OLLAMA_HEDGE_MAX_RATE", 0.05))    # Hedges per embedding call at most
+NEAR_DUPLICATE_ENTRIES = int(os.environ.get("NEAR_DUPLICATE_ENTRIES", 10000))     # Messages whose embeddings near-duplicates reuse (0: none)
+NEAR_DUPLICATE_DISTANCE = float(os.environ.get("NEAR_DUPLICATE_DISTANCE", 0.15))  # Largest Jaccard distance of character trigrams for reuse
+NEAR_DUPLICATE_AUDIT_RATE = float(os.environ.get("NEAR_DUPLICATE_AUDIT_RATE", 0.05))  # Share of reuses re-embedded to measure agreement
+CHUNK_MIN_WORDS = int(os.environ.get("CHUNK_MIN_WORDS", 40))      # Messages this long are mapped chunk by chunk (0: never)
+CHUNK_WINDOW_WORDS = int(os.environ.get("CHUNK_WINDOW_WORDS", 24))  # Longest chunk; longer sentences are cut into windows
+CHUNK_POOLING = os.environ.get("CHUNK_POOLING", "max")            # How chunk scores combine: "max" or "attention"
+EMBEDDING_ARTIFACT_PATH = os.environ.get(  # Precomputed question/option embeddings loaded at startup
+    "EMBEDDING_ARTIFACT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "question_embeddings.npz"))
 
 # In-memory cache for embeddings
 embedding_cache = {}
 embedding_cache_lock = threading.Lock()
 
+# Cache shared by all worker processes, created by create_app() before fork
+shared_embedding_cache = None
+
+LOCAL_CACHE_HIT = metrics.EMBEDDING_CACHE.labels("local", "hit")
+LOCAL_CACHE_MISS = metrics.EMBEDDING_CACHE.labels("local", "miss")
+SHARED_CACHE_HIT = metrics.EMBEDDING_CACHE.labels("shared", "hit")
+SHARED_CACHE_MISS = metrics.EMBEDDING_CACHE.labels("shared", "miss")
+metrics.CACHE_ENTRIES.labels("local").set_function(lambda: len(embedding_cache))
+metrics.CACHE_ENTRIES.labels("shared").set_function(
+    lambda: shared_embedding_cache.stats()['entries'] if shared_embedding_cache is not None else None)
+
+# Skips Ollama calls while Ollama is failing; see ollama_circuit.py
+ollama_circuit = CircuitBreaker(OLLAMA_CIRCUIT_FAILURES, OLLAMA_CIRCUIT_RESET)
+
+# Limits concurrent mapping; see admission.py
+admission = AdmissionController(ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT)
+metrics.ADMISSION_IN_FLIGHT.set_function(lambda: admission.in_flight)
+for lane in (PRIORITY, NORMAL):
+    metrics.ADMISSION_QUEUED.labels(lane).set_function(lambda lane=lane: admission.queued(lane))
+
+# Orders Ollama calls by priority class under a global cap; see ollama_scheduler.py
+ollama_scheduler = OllamaScheduler(OLLAMA_MAX_IN_FLIGHT, OLLAMA_BACKGROUND_SLOTS or None,
+                                   OLLAMA_BACKGROUND_RATE or None)
+for work in CLASSES:
+    metrics.OLLAMA_IN_FLIGHT.labels(work).set_function(lambda work=work: ollama_scheduler.in_flight[work])
+    metrics.OLLAMA_QUEUED.labels(work).set_function(lambda work=work: ollama_scheduler.queued(work))
+
+# Spreads Ollama calls over the instances in OLLAMA_URLS; see ollama_pool.py
+def ollama_endpoint_changed(endpoint, admitted):
+    if admitted:
+        logger.info("Ollama instance %s passed its health check and is back in the pool", endpoint.url)
+    else:
+        logger.warning("Ollama instance %s ejected from the pool", endpoint.url)
+        metrics.OLLAMA_EJECTIONS.labels(endpoint.url).inc()
+
+def warm_up_in_background(endpoint):
+    threading.Thread(target=ping_ollama, args=(endpoint,), daemon=True).start()
+
+ollama_pool = OllamaPool(OLLAMA_URLS, OLLAMA_EJECT_FAILURES, OLLAMA_HEALTH_INTERVAL, ollama_endpoint_changed,
+                         cold_after=OLLAMA_KEEP_ALIVE if OLLAMA_KEEP_ALIVE > 0 else None,
+                         on_cold=warm_up_in_background)
+for endpoint in ollama_pool.endpoints:
+    metrics.OLLAMA_INSTANCE_UP.labels(endpoint.url).set_function(lambda endpoint=endpoint: int(not endpoint.ejected))
+    metrics.OLLAMA_INSTANCE_OUTSTANDING.labels(endpoint.url).set_function(
+        lambda endpoint=endpoint: endpoint.outstanding)
+
+# Recent latency of successful Ollama calls per API path; see ollama_latency.py
+ollama_latency = {path: LatencyWindow() for path in (OLLAMA_API_PATH, OLLAMA_EMBED_PATH)}
+
+# Live embedding calls slower than the observed percentile get a second call; see ollama_hedging.py
+ollama_hedging = HedgePolicy(ollama_latency[OLLAMA_API_PATH], OLLAMA_HEDGE_PERCENTILE,
+                             OLLAMA_HEDGE_MAX_RATE) if OLLAMA_HEDGING else None
+hedge_executor = concurrent.futures.ThreadPoolExecutor(2 * OLLAMA_MAX_IN_FLIGHT, thread_name_prefix="ollama-hedge")
+
+# Embedding attempts time out at a multiple of the observed p99, and retries
+# come out of a budget shared by all requests; see ollama_retry.py
+embedding_timeout = AdaptiveTimeout(ollama_latency[OLLAMA_API_PATH], floor=EMBEDDING_TIMEOUT_FLOOR,
+                                    ceiling=EMBEDDING_TIMEOUT)
+ollama_retry_budget = RetryBudget(OLLAMA_RETRY_RATIO)
+metrics.OLLAMA_ATTEMPT_TIMEOUT.set_function(embedding_timeout.timeout)
+
+# Set while a shed request is answered in degraded mode: embeddings then come
+# from the caches or the lexical tier, never from Ollama
+degraded_request = contextvars.ContextVar("degraded_request", default=False)
+lexical_tier = None
+
+# Messages close to one already embedded reuse its embedding, and a sample of
+# reuses is re-embedded in the background to check them; see near_duplicate.py
+near_duplicates = NearDuplicateIndex(NEAR_DUPLICATE_ENTRIES, NEAR_DUPLICATE_DISTANCE) if NEAR_DUPLICATE_ENTRIES > 0 else None
+near_duplicate_audits = queue.Queue(maxsize=100)
+NEAR_DUPLICATE_HIT = metrics.EMBEDDING_CACHE.labels("near_duplicate", "hit")
+NEAR_DUPLICATE_MISS = metrics.EMBEDDING_CACHE.labels("near_duplicate", "miss")
+
+# Progress of loading the question and option embeddings, for /readyz and /status
+warmup_progress = {"state": "pending", "source": None, "done": 0, "total": 0, "seconds": None}
+started_at = time.time()
+
 # Worker queue for background embedding generation
 embedding_queue = queue.Queue()
 embedding_results = {}
@@ -89,6 +239,10 @@ questions_data = {
     ]
 }
 
+# Optional alternative phrasings for questions, keyed by question text. Each
+# variant is indexed as an extra vector that maps back to its question.
+question_variants = {}
+
 # Define options for each assessment type
 options_data = {
     "PHQ-9": ["Not at all", "Several days", "More than half the days", "Nearly every day"],
@@ -120,8 +274,9 @@ options_data = {
 # Default options if category-specific options aren't available
 default_options = ["Not at all", "Several days", "More than half the days", "Nearly every day"]
 
-# Track the last mapped question for each conversation
-conversation_state = {}
+# Compiled question index, rebuilt whenever the embedding dimension changes
+question_index = None
+question_index_lock = threading.Lock()
 
 # LRU cache for frequently used embeddings
 @lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
@@ -134,34 +289,91 @@ def get_cached_embedding(text):
 # Function to get embeddings from Ollama with caching
 def get_ollama_embedding(text):
     # Check if we already have this embedding cached
-    cache_key = text.strip().lower()
+    with stage("normalization"):
+        cache_key = text.strip().lower()
     
-    # Try to get from LRU cache first (fastest)
-    cached_result = get_cached_embedding(cache_key)
+    with stage("cache_lookup"):
+        # Try to get from LRU cache first (fastest)
+        cached_result = get_cached_embedding(cache_key)
+        if cached_result is None:
+            # Then check our manual cache (for items that might be evicted from LRU)
+            with embedding_cache_lock:
+                cached_result = embedding_cache.get(cache_key)
+        LOCAL_CACHE_HIT.inc() if cached_result is not None else LOCAL_CACHE_MISS.inc()
     if cached_result is not None:
         return cached_result
     
-    # Then check our manual cache (for items that might be evicted from LRU)
-    with embedding_cache_lock:
-        if cache_key in embedding_cache:
-            return embedding_cache[cache_key]
+    if degraded_request.get():
+        return degraded_embedding(text, cache_key)
+    if expired():
+        note(deadlineExceeded=True)
+        return degraded_embedding(text, cache_key)
+    
+    # Then the cache shared with other workers, whose exact match beats a near
+    # duplicate. If another worker is already embedding this text, wait for its
+    # result instead of calling Ollama too.
+    if shared_embedding_cache is not None:
+        with stage("cache_lookup"):
+            embedding = shared_embedding_cache.get(cache_key, count_miss=False)
+        if embedding is not None:
+            SHARED_CACHE_HIT.inc()
+            return embedding
+    
+    reused = find_near_duplicate(text)
+    if reused is not None:
+        return reused
+    
+    if shared_embedding_cache is not None:
+        with stage("cache_lookup"):
+            claimed, embedding = shared_embedding_cache.claim(cache_key)
+        if embedding is None and not claimed:
+            with stage("cache_wait"):
+                embedding = shared_embedding_cache.wait(cache_key, bounded(SHARED_CACHE_WAIT))
+        SHARED_CACHE_HIT.inc() if embedding is not None else SHARED_CACHE_MISS.inc()
+        if embedding is not None:
+            return embedding
     
     # If not cached, generate the embedding
     try:
+        short_circuited = out_of_time = out_of_retries = False
         for attempt in range(EMBEDDING_RETRY_COUNT):
+            if expired():
+                out_of_time = True
+                break
+            if not ollama_circuit.allow():
+                short_circuited = True
+                break
+            if attempt:
+                if not ollama_retry_budget.take():
+                    out_of_retries = True
+                    break
+                metrics.OLLAMA_RETRIES.inc()
+                time.sleep(bounded(backoff(attempt, EMBEDDING_RETRY_DELAY, EMBEDDING_RETRY_MAX_DELAY)))
+                if expired():
+                    out_of_time = True
+                    break
+            else:
+                ollama_retry_budget.record_call()
+            # With every instance idle past its keep-alive, allow for a model load
+            attempt_timeout = embedding_timeout.timeout() if ollama_pool.warm() else EMBEDDING_TIMEOUT
+            call_timeout = bounded(attempt_timeout)
             try:
-                response = requests.post(
-                    OLLAMA_API_URL,
-                    json={"model": OLLAMA_MODEL, "prompt": text},
-                    timeout=EMBEDDING_TIMEOUT
-                )
+                response = post_to_ollama(OLLAMA_API_PATH, {"model": OLLAMA_MODEL, "prompt": text,
+                                                            "keep_alive": OLLAMA_KEEP_ALIVE}, call_timeout)
+                if response is None:
+                    # No scheduler slot freed up in time
+                    out_of_time = True
+                    break
+                metrics.OLLAMA_REQUESTS.labels("embeddings", str(response.status_code)).inc()
                 
                 if response.status_code == 200:
-                    embedding = np.array(response.json()["embedding"])
+                    ollama_circuit.record_success()
+                    embedding = embedding_from_json(response.content)
                     
                     # Cache the result
-                    with embedding_cache_lock:
-                        embedding_cache[cache_key] = embedding
+                    cache_embedding(cache_key, embedding)
+                    if near_duplicates is not None:
+                        near_duplicates.add(text, embedding)
                     
                     # Also store in LRU cache
                     get_cached_embedding.cache_clear()  # Clear to avoid memory issues
@@ -169,23 +381,213 @@ def get_ollama_embedding(text):
                     
                     return embedding
                 else:
-                    print(f"Error from Ollama API (attempt {attempt+1}/{EMBEDDING_RETRY_COUNT}): {response.status_code}")
-                    print(response.text)
-                    if attempt < EMBEDDING_RETRY_COUNT - 1:
-                        time.sleep(EMBEDDING_RETRY_DELAY)
+                    ollama_circuit.record_failure()
+                    logger.warning("Error from Ollama API (attempt %d/%d): %s %s", attempt + 1,
+                                   EMBEDDING_RETRY_COUNT, response.status_code, response.text[:200])
             except requests.exceptions.RequestException as e:
-                print(f"Request exception (attempt {attempt+1}/{EMBEDDING_RETRY_COUNT}): {e}")
-                if attempt < EMBEDDING_RETRY_COUNT - 1:
-                    time.sleep(EMBEDDING_RETRY_DELAY)
+                metrics.OLLAMA_REQUESTS.labels("embeddings", "exception").inc()
+                # A timeout cut short by the request's deadline says nothing about Ollama
+                if not (isinstance(e, requests.exceptions.Timeout) and call_timeout < attempt_timeout):
+                    ollama_circuit.record_failure()
+                logger.warning("Request exception (attempt %d/%d, timeout %.3fs): %s", attempt + 1,
+                               EMBEDDING_RETRY_COUNT, call_timeout, e)
+        
+        if out_of_time or expired():
+            # The caller has given up by now; answer from what needs no Ollama
+            note(deadlineExceeded=True)
+            release_embedding_claim(cache_key)
+            return degraded_embedding(text, cache_key)
         
         # If all attempts failed, fall back to simple word matching
-        print(f"All {EMBEDDING_RETRY_COUNT} attempts failed, falling back to simple embedding")
+        if short_circuited:
+            logger.debug("Ollama circuit is open, falling back to simple embedding")
+            note(ollamaCircuit="open")
+        elif out_of_retries:
+            logger.warning("Ollama retry budget spent, falling back to simple embedding")
+            note(retryBudget="spent")
+            metrics.OLLAMA_RETRIES_DENIED.inc()
+        else:
+            logger.error("All %d attempts failed, falling back to simple embedding", EMBEDDING_RETRY_COUNT)
+        note(embeddingFallback=True)
+        metrics.EMBEDDING_FALLBACKS.inc()
+        release_embedding_claim(cache_key)
         return simple_text_embedding(text)
     except Exception as e:
-        print(f"Exception in get_ollama_embedding: {e}")
+        logger.exception("Exception in get_ollama_embedding: %s", e)
+        note(embeddingFallback=True)
+        metrics.EMBEDDING_FALLBACKS.inc()
+        release_embedding_claim(cache_key)
         # Return a simple embedding as last resort
         return simple_text_embedding(text)
 
+# Every Ollama call goes through the scheduler, then the instance pool
+def post_to_ollama(path, payload, timeout):
+    """POST to an Ollama instance in a scheduler slot of the caller's priority class
+
+    An interactive call's wait for a slot counts against `timeout`, and None
+    is returned if no slot frees up within it. Warmup and background calls
+    wait as long as it takes. Live single-text embeddings are hedged when
+    OLLAMA_HEDGING is on.
+    """
+    work = work_class.get()
+    with stage("ollama_queue"):
+        acquired, waited = ollama_scheduler.acquire(work, timeout if work == INTERACTIVE else None)
+    metrics.OLLAMA_QUEUE_WAIT.labels(work).observe(waited)
+    if not acquired:
+        note(ollamaQueueTimeout=True)
+        return None
+    if work == INTERACTIVE:
+        timeout = max(timeout - waited, 0.001)
+    start = time.perf_counter()
+    try:
+        with stage("ollama"):
+            if ollama_hedging is not None and work == INTERACTIVE and path == OLLAMA_API_PATH:
+                return hedged_send(path, payload, timeout)
+            return send_to_ollama(path, payload, timeout)
+    finally:
+        ollama_scheduler.release(work)
+        metrics.OLLAMA_CALL_SECONDS.labels(work).observe(time.perf_counter() - start)
+
+def send_to_ollama(path, payload, timeout, avoid=(), used=None):
+    """POST to the least loaded Ollama instance; a refused call moves on to the next at once
+
+    `avoid` lists instances to pass over while another one is admitted, and
+    `used` collects the instances the call went to.
+    """
+    start = time.perf_counter()
+    tried = []
+    refused = requests.exceptions.ConnectionError("no Ollama instance available")
+    while True:
+        endpoint = ollama_pool.acquire(exclude=[*avoid, *tried]) if avoid else None
+        if endpoint is None:
+            endpoint = ollama_pool.acquire(exclude=tried)
+        if endpoint is None:
+            raise refused
+        if used is not None:
+            used.append(endpoint)
+        call_start = time.perf_counter()
+        try:
+            response = requests.post(endpoint.url + path, json=payload, headers=trace_headers(),
+                                     timeout=max(timeout - (call_start - start), 0.001))
+        except requests.exceptions.ConnectionError as e:
+            ollama_pool.release(endpoint, time.perf_counter() - call_start, ok=False, refused=True)
+            tried.append(endpoint)
+            refused = e
+            continue
+        except requests.exceptions.RequestException as e:
+            # A timeout cut short by the request's deadline says nothing about the instance
+            cut_short = isinstance(e, requests.exceptions.Timeout) and expired()
+            ollama_pool.release(endpoint, time.perf_counter() - call_start, ok=None if cut_short else False)
+            raise
+        seconds = time.perf_counter() - call_start
+        ollama_pool.release(endpoint, seconds, ok=response.status_code < 500)
+        metrics.OLLAMA_INSTANCE_SECONDS.labels(endpoint.url).observe(seconds)
+        if response.status_code == 200:
+            if path == OLLAMA_API_PATH and is_cold_load(seconds, ollama_latency[path]):
+                # Kept out of the latency window, which describes a loaded model
+                record_cold_load(endpoint, seconds, "request")
+                note(coldLoadSeconds=round(seconds, 3))
+            else:
+                ollama_latency[path].record(seconds)
+        return response
+
+def record_cold_load(endpoint, seconds, caller):
+    """Count a call that waited for Ollama to load the model; see ollama_residency.py"""
+    endpoint.cold_loads += 1
+    metrics.OLLAMA_COLD_LOADS.labels(endpoint.url, caller).inc()
+    metrics.OLLAMA_COLD_LOAD_SECONDS.labels(endpoint.url).observe(seconds)
+    logger.warning("Ollama instance %s took %.2fs, like a cold model load (%s call)", endpoint.url, seconds, caller)
+
+def ping_ollama(endpoint):
+    """Keep-warm ping: embed one word on an instance so it keeps the model loaded"""
+    start = time.perf_counter()
+    try:
+        response = requests.post(endpoint.url + OLLAMA_API_PATH,
+                                 json={"model": OLLAMA_MODEL, "prompt": "ping", "keep_alive": OLLAMA_KEEP_ALIVE},
+                                 timeout=EMBEDDING_TIMEOUT)
+        ok = response.status_code == 200
+    except requests.exceptions.RequestException:
+        ok = False
+    seconds = time.perf_counter() - start
+    ollama_pool.warmed(endpoint, ok)
+    metrics.OLLAMA_KEEP_WARM_PINGS.labels(endpoint.url, "ok" if ok else "failed").inc()
+    if ok and is_cold_load(seconds, ollama_latency[OLLAMA_API_PATH]):
+        record_cold_load(endpoint, seconds, "keep_warm")
+    return ok
+
+def hedged_send(path, payload, timeout):
+    """send_to_ollama(), with a second call if the first runs past the hedge delay
+
+    The second call prefers another instance, takes a free interactive slot
+    or none at all, and must fit the hedge budget. The first answer wins.
+    requests cannot abort a call in progress, so the loser finishes in the
+    background and gives its slot back when it does.
+    """
+    delay = ollama_hedging.delay()
+    if delay is None or delay >= timeout:
+        return send_to_ollama(path, payload, timeout)
+    used = []
+    primary = hedge_executor.submit(contextvars.copy_context().run, send_to_ollama, path, payload, timeout, (), used)
+    done, _ = concurrent.futures.wait([primary], delay)
+    if done:
+        return primary.result()
+    if not ollama_scheduler.acquire(INTERACTIVE, timeout=0)[0]:
+        metrics.OLLAMA_HEDGES.labels("no_slot").inc()
+        return primary.result()
+    if not ollama_hedging.take():
+        ollama_scheduler.release(INTERACTIVE)
+        metrics.OLLAMA_HEDGES.labels("over_budget").inc()
+        return primary.result()
+    note(hedged=True)
+    hedge = hedge_executor.submit(contextvars.copy_context().run, send_to_ollama, path, payload,
+                                  timeout - delay, list(used))
+    winner = None
+    pending = {primary, hedge}
+    while pending and winner is None:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        winner = next((future for future in (primary, hedge) if future in done and future.exception() is None), None)
+    loser = hedge if winner is primary else primary
+    loser.add_done_callback(lambda _: ollama_scheduler.release(INTERACTIVE))
+    if winner is None:
+        # Both failed; report the first call's error
+        return primary.result()
+    ollama_hedging.settle(winner is hedge)
+    metrics.OLLAMA_HEDGES.labels("won" if winner is hedge else "lost").inc()
+    return winner.result()
+
+# Look an embedding up in the process-local cache, then the shared cache
+def find_cached_embedding(cache_key):
+    """Return a cached embedding without calling Ollama, or None"""
+    with embedding_cache_lock:
+        embedding = embedding_cache.get(cache_key)
+    if embedding is not None:
+        LOCAL_CACHE_HIT.inc()
+        return embedding
+    LOCAL_CACHE_MISS.inc()
+    if shared_embedding_cache is not None:
+        embedding = shared_embedding_cache.get(cache_key)
+        SHARED_CACHE_HIT.inc() if embedding is not None else SHARED_CACHE_MISS.inc()
+    return embedding
+
+def embedding_cached(cache_key):
+    """Whether an embedding is cached locally or in the shared cache; counts no lookup"""
+    with embedding_cache_lock:
+        if cache_key in embedding_cache:
+            return True
+    return shared_embedding_cache is not None and cache_key in shared_embedding_cache
+
+def cache_embedding(cache_key, embedding):
+    """Store an embedding in the shared cache, or locally if it cannot go there"""
+    if shared_embedding_cache is not None and shared_embedding_cache.put(cache_key, embedding):
+        return
+    with embedding_cache_lock:
+        embedding_cache[cache_key] = embedding
+
+def release_embedding_claim(cache_key):
+    """Let other workers retry a text this worker failed to embed"""
+    if shared_embedding_cache is not None:
+        shared_embedding_cache.release(cache_key)
+
 # Function to process embeddings in batches
 def process_embeddings_batch(texts_batch):
     """Process a batch of texts to get embeddings"""
@@ -195,38 +597,38 @@ def process_embeddings_batch(texts_batch):
     uncached_texts = []
     uncached_indices = []
     
-    for i, text in enumerate(texts_batch):
-        cache_key = text.strip().lower()
-        
-        # Check LRU cache
-        cached_result = get_cached_embedding(cache_key)
-        if cached_result is not None:
-            results[i] = cached_result
-            continue
+    with stage("cache_lookup"):
+        for i, text in enumerate(texts_batch):
+            cache_key = text.strip().lower()
             
-        # Check manual cache
-        with embedding_cache_lock:
-            if cache_key in embedding_cache:
-                results[i] = embedding_cache[cache_key]
+            # Check LRU cache
+            cached_result = get_cached_embedding(cache_key)
+            if cached_result is not None:
+                results[i] = cached_result
                 continue
-        
-        # If not in cache, add to list for batch processing
-        uncached_texts.append(text)
-        uncached_indices.append(i)
+                
+            # Check manual and shared caches
+            cached_embedding = find_cached_embedding(cache_key)
+            if cached_embedding is not None:
+                results[i] = cached_embedding
+                continue
+            
+            # If not in cache, add to list for batch processing
+            uncached_texts.append(text)
+            uncached_indices.append(i)
     
     # If all texts were cached, return results
     if not uncached_texts:
         return results
     
-    # Process uncached texts
+    # Process uncached texts in a single batched Ollama call
     try:
-        # Currently Ollama doesn't support true batching, so we process sequentially
-        # This can be updated if Ollama adds batch support in the future
-        for batch_idx, text in zip(uncached_indices, uncached_texts):
-            embedding = get_ollama_embedding(text)
-            results[batch_idx] = embedding
+        batch_embeddings = request_ollama_embeddings(uncached_texts)
+        for batch_idx, embedding in zip(uncached_indices, batch_embeddings):
+            if embedding is not None:
+                results[batch_idx] = embedding
     except Exception as e:
-        print(f"Error in batch processing: {e}")
+        logger.exception("Error in batch processing: %s", e)
         # Fall back to simple embeddings for any remaining texts
         for batch_idx, text in zip(uncached_indices, uncached_texts):
             if batch_idx not in results:
@@ -234,6 +636,108 @@ def process_embeddings_batch(texts_batch):
     
     return results
 
+# Embed several texts with one call to Ollama's batched /api/embed endpoint
+def request_ollama_embeddings(texts):
+    """Get embeddings for a list of texts in one request, caching the results"""
+    if degraded_request.get() or expired() or not ollama_circuit.allow():
+        return [get_ollama_embedding(text) for text in texts]
+    if work_class.get() != INTERACTIVE and len(texts) > PREEMPTIBLE_BATCH:
+        # Bulk work queues for Ollama batch by batch, so interactive calls overtake it
+        return [embedding for i in range(0, len(texts), PREEMPTIBLE_BATCH)
+                for embedding in request_ollama_embeddings(texts[i:i + PREEMPTIBLE_BATCH])]
+    call_timeout = bounded(EMBEDDING_TIMEOUT)
+    try:
+        response = post_to_ollama(OLLAMA_EMBED_PATH, {"model": OLLAMA_MODEL, "input": texts,
+                                                     "keep_alive": OLLAMA_KEEP_ALIVE}, call_timeout)
+        if response is None:
+            return [get_ollama_embedding(text) for text in texts]
+        metrics.OLLAMA_REQUESTS.labels("embed", str(response.status_code)).inc()
+        # Older Ollama versions answer 404 here; only server errors count against it
+        if response.status_code >= 500:
+            ollama_circuit.record_failure()
+        else:
+            ollama_circuit.record_success()
+        if response.status_code == 200:
+            embeddings = list(embeddings_from_json(response.content))
+            if len(embeddings) == len(texts):
+                for text, embedding in zip(texts, embeddings):
+                    cache_embedding(text.strip().lower(), embedding)
+                return embeddings
+        logger.warning("Batch embedding request failed (%s), embedding texts one at a time", response.status_code)
+    except requests.exceptions.RequestException as e:
+        metrics.OLLAMA_REQUESTS.labels("embed", "exception").inc()
+        if not (isinstance(e, requests.exceptions.Timeout) and call_timeout < EMBEDDING_TIMEOUT):
+            ollama_circuit.record_failure()
+        logger.warning("Batch embedding request exception: %s, embedding texts one at a time", e)
+
+    # Older Ollama versions only have the single-prompt endpoint
+    return [get_ollama_embedding(text) for text in texts]
+
+# Reuse the embedding of a message that differs only trivially
+def find_near_duplicate(text):
+    """Embedding of a near-duplicate of a message, or None; samples reuses for audit"""
+    if near_duplicates is None:
+        return None
+    with stage("cache_lookup"):
+        match = near_duplicates.find(text)
+    if match is None:
+        NEAR_DUPLICATE_MISS.inc()
+        return None
+    NEAR_DUPLICATE_HIT.inc()
+    embedding, distance = match
+    note(nearDuplicate=round(distance, 3))
+    if random.random() < NEAR_DUPLICATE_AUDIT_RATE:
+        try:
+            near_duplicate_audits.put_nowait((text, embedding))
+        except queue.Full:
+            pass
+    return embedding
+
+def audit_near_duplicate(text, reused):
+    """Embed a message whose embedding was reused, and record how the two compare"""
+    if not ollama_circuit.allow():
+        return
+    response = post_to_ollama(OLLAMA_EMBED_PATH, {"model": OLLAMA_MODEL, "input": [text],
+                                                 "keep_alive": OLLAMA_KEEP_ALIVE}, EMBEDDING_TIMEOUT)
+    if response is None or response.status_code != 200:
+        return
+    true_embedding = embeddings_from_json(response.content)[0]
+    # Exact repeats get the true embedding from now on
+    cache_embedding(text.strip().lower(), true_embedding)
+    near_duplicates.add(text, true_embedding)
+    matches = search_questions(np.stack([reused, true_embedding])) if len(reused) == len(true_embedding) else None
+    agreed = matches is not None and matches[0][2] == matches[1][2]
+    near_duplicates.record_audit(cosine_similarity(reused, true_embedding), agreed)
+    metrics.NEAR_DUPLICATE_AUDITS.labels("agreed" if agreed else "disagreed").inc()
+
+# Embeddings for degraded mode, which never calls Ollama
+def degraded_embedding(text, cache_key):
+    """Shared-cache or near-duplicate embedding, or lexical stand-in for a text, or None"""
+    if shared_embedding_cache is not None:
+        embedding = shared_embedding_cache.get(cache_key)
+        if embedding is not None:
+            return embedding
+    reused = find_near_duplicate(text)
+    if reused is not None:
+        return reused
+    tier = lexical_tier
+    embedding = tier.embed(text) if tier is not None else None
+    note(degraded="lexical" if embedding is not None else "unavailable")
+    return embedding
+
+def build_lexical_tier():
+    """Build the lexical tier from the cached embeddings of the bank texts"""
+    global lexical_tier
+    index = question_index
+    texts, vectors = [], []
+    for text in preload_texts():
+        embedding = find_cached_embedding(text.strip().lower())
+        if embedding is not None and index is not None and len(embedding) == index.dim:
+            texts.append(text)
+            vectors.append(embedding)
+    lexical_tier = LexicalTier(texts, vectors) if texts else None
+    return lexical_tier
+
 # Simple fallback function for when Ollama is not available
 def simple_text_embedding(text):
     """Create a simple embedding based on word presence"""
@@ -265,7 +769,8 @@ def simple_text_embedding(text):
 # Background worker for pre-generating embeddings
 def embedding_worker():
     """Background worker to pre-generate embeddings"""
-    print("Starting embedding worker thread")
+    logger.info("Starting embedding worker thread")
+    work_class.set(BACKGROUND)
     while True:
         try:
             # Get batch of texts to process
@@ -287,7 +792,7 @@ def embedding_worker():
                 continue
             
             # Process batch
-            print(f"Processing batch of {len(batch)} embeddings")
+            logger.debug("Processing batch of %d embeddings", len(batch))
             batch_results = process_embeddings_batch(batch)
             
             # Store results
@@ -301,41 +806,142 @@ def embedding_worker():
                 embedding_queue.task_done()
                 
         except Exception as e:
-            print(f"Error in embedding worker: {e}")
+            logger.exception("Error in embedding worker: %s", e)
             time.sleep(1)  # Avoid tight loop in case of repeated errors
 
-# Preload question embeddings
-def preload_question_embeddings():
-    """Preload embeddings for all questions and common options"""
-    print("Preloading question and option embeddings...")
-    
-    # Collect all texts to preload
-    texts_to_preload = []
+# Checks sampled near-duplicate reuses against the true embeddings
+def near_duplicate_audit_worker():
+    """Re-embed sampled messages whose embeddings were reused"""
+    logger.info("Starting near-duplicate audit thread")
+    work_class.set(BACKGROUND)
+    while True:
+        text, reused = near_duplicate_audits.get()
+        try:
+            audit_near_duplicate(text, reused)
+        except Exception as e:
+            logger.warning("Near-duplicate audit failed: %s", e)
+
+# Keeps the model loaded on Ollama instances without traffic
+def keep_warm_worker():
+    """Ping Ollama instances that have been idle for OLLAMA_KEEP_WARM_IDLE seconds"""
+    logger.info("Starting keep-warm thread")
+    while True:
+        time.sleep(min(OLLAMA_KEEP_WARM_IDLE / 4, 30))
+        try:
+            for endpoint in ollama_pool.idle(OLLAMA_KEEP_WARM_IDLE):
+                ping_ollama(endpoint)
+        except Exception as e:
+            logger.exception("Error in keep-warm thread: %s", e)
+
+def state_purge_worker():
+    """Sweep expired conversations every STATE_PURGE_INTERVAL seconds
+
+    Expired entries are otherwise only dropped when touched, so idle
+    conversations, and restored ones never asked about again, would hold
+    memory until evicted.
+    """
+    logger.info("Starting state purge thread")
+    while True:
+        time.sleep(STATE_PURGE_INTERVAL)
+        try:
+            conversation_state.purge_expired()
+        except Exception as e:
+            logger.exception("Error in state purge thread: %s", e)
+
+# Texts whose embeddings are preloaded and stored in the embedding artifact
+def preload_texts():
+    """Return all questions, question variants and common options"""
+    texts = []
     
     # Add all questions
     for category, questions in questions_data.items():
         for question in questions:
-            texts_to_preload.append(question)
+            texts.append(question)
+            texts.extend(question_variants.get(question, []))
     
     # Add common options
     for options in options_data.values():
         if isinstance(options, list):
-            texts_to_preload.extend(options)
+            texts.extend(options)
+    
+    return texts
+
+# Preload question embeddings
+def preload_question_embeddings():
+    """Preload embeddings for all questions and common options"""
+    with running_as(WARMUP):
+        _preload_question_embeddings()
+
+def _preload_question_embeddings():
+    logger.info("Preloading question and option embeddings...")
+    texts_to_preload = preload_texts()
+    start = time.perf_counter()
+    warmup_progress.update(state="running", source="ollama", done=0, total=len(texts_to_preload))
     
     # Process in batches
     batch_size = 10
     for i in range(0, len(texts_to_preload), batch_size):
         batch = texts_to_preload[i:i+batch_size]
-        print(f"Preloading batch {i//batch_size + 1}/{(len(texts_to_preload) + batch_size - 1)//batch_size}")
+        logger.debug("Preloading batch %d/%d", i // batch_size + 1, (len(texts_to_preload) + batch_size - 1) // batch_size)
         
-        # Process batch
-        batch_dict = {idx: text for idx, text in enumerate(batch)}
+        # Process batch; the scheduler keeps it from crowding out live requests
         process_embeddings_batch(batch)
-        
-        # Small delay to avoid overloading Ollama
-        time.sleep(0.5)
+        warmup_progress["done"] += len(batch)
     
-    print(f"Preloaded {len(texts_to_preload)} embeddings")
+    logger.info("Preloaded %d embeddings", len(texts_to_preload))
+    compile_question_index()
+    warmup_progress.update(state="complete" if question_index is not None else "failed",
+                           seconds=round(time.perf_counter() - start, 3))
+
+# Build the vector index that map_to_question searches
+def compile_question_index():
+    """Embed every question (and its variants) and build the question index"""
+    global question_index
+
+    labels = []
+    texts = []
+    for category, questions in questions_data.items():
+        for idx, question in enumerate(questions):
+            question_id = question_bank.question_id(category, question)
+            for text in [question] + question_variants.get(question, []):
+                labels.append((category, question, question_id))
+                texts.append(text)
+
+    embeddings = process_embeddings_batch(texts)
+    vectors = [embeddings.get(i) for i in range(len(texts))]
+    if any(v is None for v in vectors) or len({len(v) for v in vectors}) != 1:
+        logger.error("Could not compile question index: missing or mismatched question embeddings")
+        return None
+
+    with question_index_lock:
+        question_index = build_index(np.stack(vectors), backend=VECTOR_INDEX_BACKEND, labels=labels)
+    logger.info("Compiled %s question index with %d vectors in %.1fms",
+                question_index.name, len(texts), question_index.build_seconds * 1000)
+    build_lexical_tier()
+    return question_index
+
+def get_question_index(dim):
+    """Return the compiled question index if its embedding size is `dim`, or None
+
+    The index is recompiled only when the cached question embeddings changed
+    size. A query of another size, such as a fallback embedding while Ollama
+    is down, gets None at once.
+    """
+    index = question_index
+    if index is None or (index.dim != dim and question_embeddings_resized(index)):
+        index = compile_question_index()
+    if index is None or index.dim != dim:
+        return None
+    return index
+
+def question_embeddings_resized(index):
+    """Whether the cached embedding of a bank question no longer has the index's size"""
+    cache_key = next(iter(questions_data.values()))[0].strip().lower()
+    with embedding_cache_lock:
+        embedding = embedding_cache.get(cache_key)
+    if embedding is None and shared_embedding_cache is not None:
+        embedding = shared_embedding_cache.get(cache_key)
+    return embedding is not None and len(embedding) != index.dim
 
 # Calculate cosine similarity between two embeddings
 def cosine_similarity(embedding1, embedding2):
@@ -349,69 +955,112 @@ def cosine_similarity(embedding1, embedding2):
     
     return dot_product / (norm1 * norm2)
 
+# Long messages are embedded and scored chunk by chunk; see message_chunks.py
+def chunks_of(user_message):
+    """The chunks of a message long enough to be mapped chunk by chunk, or None"""
+    if CHUNK_MIN_WORDS <= 0:
+        return None
+    return split_message(user_message, CHUNK_MIN_WORDS, CHUNK_WINDOW_WORDS)
+
+def chunked_message(chunks, vectors):
+    """A ChunkedMessage, or None unless every chunk has an embedding of one size"""
+    if any(vector is None for vector in vectors) or len({len(vector) for vector in vectors}) != 1:
+        return None
+    note(chunks=len(chunks))
+    return ChunkedMessage(chunks, vectors)
+
+def embed_message(user_message):
+    """Embedding of a user message, or a ChunkedMessage for a long one"""
+    chunks = chunks_of(user_message)
+    if chunks is not None:
+        # All chunks in one batched call, so they are embedded in parallel
+        embeddings = process_embeddings_batch(chunks)
+        message = chunked_message(chunks, [embeddings.get(i) for i in range(len(chunks))])
+        if message is not None:
+            return message
+    return get_ollama_embedding(user_message)
+
+# Score query embeddings against the compiled question index
+def search_questions(query_embeddings):
+    """Return a (category, question, question_id, score) match per query embedding
+
+    All queries must share one embedding size; they are scored together as a
+    single matrix product. Returns None if no index matches that size.
+    """
+    query_embeddings = np.atleast_2d(query_embeddings)
+    index = get_question_index(query_embeddings.shape[1])
+    if index is None:
+        return None
+
+    # Variants map back to their question label
+    with stage("similarity"):
+        scores, ids = index.search(query_embeddings, k=1)
+    return [index.labels[row[0]] + (float(score[0]),) for score, row in zip(scores, ids)]
+
+def search_question_chunks(message):
+    """Return the pooled (category, question, question_id, score) match of a
+    ChunkedMessage and the index of the chunk that drove it, or (None, None)"""
+    index = get_question_index(len(message))
+    if index is None:
+        return None, None
+
+    with stage("similarity"):
+        scores, ids = index.search(message.vectors, k=len(index))
+        # Every chunk's score for every indexed text; -1 where a chunk's search skipped it
+        dense = np.full((len(message.chunks), len(index)), -1.0, dtype=np.float32)
+        rows, columns = np.nonzero(ids >= 0)
+        dense[rows, ids[rows, columns]] = scores[rows, columns]
+        pooled, drivers = pool_scores(dense, CHUNK_POOLING)
+        best = int(np.argmax(pooled))
+    return index.labels[best] + (float(pooled[best]),), int(drivers[best])
+
 # Map user message to a question
-def map_to_question(user_message, conversation_id):
+def map_to_question(user_message, conversation_id, query_embedding=None, question_match=None):
     """Map user message to a question from one of the assessment categories using Ollama"""
-    best_match = None
-    best_score = -1
-    best_category = None
-    best_question_idx = -1
+    chunk = None
+    if question_match is None:
+        # Get embedding for user message
+        if query_embedding is None:
+            query_embedding = embed_message(user_message)
+        if query_embedding is None:
+            return {
+                "success": False,
+                "message": "Failed to get embedding from Ollama API"
+            }, 500
 
-    # Get embedding for user message
-    query_embedding = get_ollama_embedding(user_message)
-    if query_embedding is None:
-        return jsonify({
-            "success": False,
-            "message": "Failed to get embedding from Ollama API"
-        }), 500
+        if isinstance(query_embedding, ChunkedMessage):
+            question_match, chunk = search_question_chunks(query_embedding)
+            matches = [question_match] if question_match is not None else None
+        else:
+            matches = search_questions(query_embedding)
+        if matches is None:
+            return {
+                "success": False,
+                "message": "Question index is not available"
+            }, 500
+        question_match = matches[0]
 
-    # Process questions in batches for efficiency
-    for category, questions in questions_data.items():
-        # Get embeddings for all questions in this category
-        question_embeddings = {}
-        
-        # Process in batches
-        batch_size = 10
-        for i in range(0, len(questions), batch_size):
-            batch = questions[i:i+batch_size]
-            batch_results = process_embeddings_batch(batch)
-            
-            # Add to question_embeddings
-            for j, embedding in batch_results.items():
-                if i + j < len(questions):
-                    question_embeddings[i + j] = embedding
-        
-        # Compare with each question
-        for idx, question in enumerate(questions):
-            if idx not in question_embeddings:
-                continue
-                
-            # Calculate similarity
-            similarity = cosine_similarity(query_embedding, question_embeddings[idx])
-            
-            if similarity > best_score:
-                best_match = question
-                best_score = similarity
-                best_category = category
-                best_question_idx = idx
+    best_category, best_match, best_question_id, best_score = question_match
 
     # Store the state for this conversation
-    conversation_state[conversation_id] = {
-        'category': best_category,
-        'question': best_match
-    }
+    conversation_state.set(conversation_id, SessionState(best_question_id, int(time.time())))
     
-    return jsonify({
+    payload = {
         "mappingType": "question",
+        "questionId": best_question_id,
         "question": best_match,
         "category": best_category,
         "confidence": float(best_score),  # Convert numpy float to Python float
         "success": True
-    })
+    }
+    if chunk is not None:
+        note(questionChunk=chunk)
+        payload["matchedChunk"] = query_embedding.describe(chunk)
+    return payload, 200
 
-# Map user message to an option
-def map_to_option(user_message, category, question, conversation_id):
-    """Map user message to an option for the given category using Ollama"""
+# Find the options (and canonical question text) for a question
+def resolve_question_options(category, question):
+    """Return (question, options) for a category/question pair"""
     # Get the appropriate options for this category and question
     if category == "PHQ-9":
         # PHQ-9 has the same options for all questions
@@ -441,151 +1090,749 @@ def map_to_option(user_message, category, question, conversation_id):
         # Fallback to default options
         question_options = default_options
     
+    return question, question_options
+
+# Interned question and option ids; options are resolved once here
+question_bank = QuestionBank(questions_data, resolve_question_options)
+
+# Track the pending question id for each conversation
+conversation_state = create_state_backend(STATE_BACKEND_URL, max_entries=MAX_CONVERSATIONS, ttl=CONVERSATION_TTL,
+                                          journal_dir=STATE_JOURNAL_DIR, namespace=question_bank.version)
+metrics.LIVE_SESSIONS.set_function(lambda: conversation_state.stats().get('liveSessions'))
+
+# Map user message to an option
+def map_to_option(user_message, category, question, conversation_id, query_embedding=None, question_id=None):
+    """Map user message to an option for the given category using Ollama"""
+    if question_id is None:
+        question_id = question_bank.question_id(category, question)
+    if question_id is not None:
+        option_ids = question_bank.option_ids(question_id)
+        question_id = question_bank.canonical(question_id)
+        question = question_bank.question_texts[question_id]
+        question_options = [question_bank.option_texts[option_id] for option_id in option_ids]
+    else:
+        # Not in the bank: resolve by text
+        option_ids = None
+        question, question_options = resolve_question_options(category, question)
+    
     # Get embedding for user message
-    query_embedding = get_ollama_embedding(user_message)
     if query_embedding is None:
-        return jsonify({
+        query_embedding = embed_message(user_message)
+    if query_embedding is None:
+        return {
             "success": False,
             "message": "Failed to get embedding from Ollama API"
-        }), 500
+        }, 500
     
     # Process options in batch for efficiency
     option_embeddings = process_embeddings_batch(question_options)
     
     best_score = -1
     max_idx = 0
+    chunk = None
     
     # Compare with each option
-    for idx, option in enumerate(question_options):
-        if idx not in option_embeddings:
-            continue
-            
-        similarity = cosine_similarity(query_embedding, option_embeddings[idx])
-        
-        if similarity > best_score:
-            best_score = similarity
-            max_idx = idx
+    with stage("similarity"):
+        if isinstance(query_embedding, ChunkedMessage):
+            best_score, max_idx, chunk = score_option_chunks(query_embedding, option_embeddings,
+                                                             len(question_options))
+        else:
+            for idx, option in enumerate(question_options):
+                if idx not in option_embeddings:
+                    continue
+                    
+                similarity = cosine_similarity(query_embedding, option_embeddings[idx])
+                
+                if similarity > best_score:
+                    best_score = similarity
+                    max_idx = idx
     
     matched_option = question_options[max_idx]
     score = max_idx  # The index represents the severity score
     
-    return jsonify({
+    payload = {
         "mappingType": "option",
+        "questionId": question_id,
         "question": question,  # Return the exact question that was matched
         "category": category,
+        "optionId": option_ids[max_idx] if option_ids is not None else None,
         "mappedOption": matched_option,
         "score": score,
         "confidence": float(best_score),  # Convert numpy float to Python float
         "success": True
-    })
+    }
+    if chunk is not None:
+        note(optionChunk=chunk)
+        payload["matchedChunk"] = query_embedding.describe(chunk)
+    return payload, 200
+
+def score_option_chunks(message, option_embeddings, count):
+    """Return (pooled score, option index, chunk index) of the best option for a
+    ChunkedMessage, or (-1, 0, None) if no option embedding has its size"""
+    indices = [idx for idx in range(count) if idx in option_embeddings and len(option_embeddings[idx]) == len(message)]
+    if not indices:
+        return -1, 0, None
+    options = normalize_rows(np.stack([option_embeddings[idx] for idx in indices]))
+    pooled, drivers = pool_scores(normalize_rows(message.vectors) @ options.T, CHUNK_POOLING)
+    best = int(np.argmax(pooled))
+    return float(pooled[best]), indices[best], int(drivers[best])
+
+# Response fields the request did not ask for
+def trim_payload(payload, data):
+    """Apply `includeText: false` and drop `matchedChunk` unless `includeChunk: true`"""
+    include_text = data.get('includeText', True) is not False
+    if not include_text:
+        payload.pop('question', None)
+        payload.pop('mappedOption', None)
+    if data.get('includeChunk') is not True:
+        payload.pop('matchedChunk', None)
+    elif not include_text and 'matchedChunk' in payload:
+        payload['matchedChunk'] = {key: value for key, value in payload['matchedChunk'].items() if key != 'text'}
+    return payload
+
+# Map one request payload to a question or an option
+def map_message(data, query_embedding=None, question_match=None):
+    """Run question, option or auto mapping for a single message
+
+    Returns a (payload, status) tuple. `query_embedding` and `question_match`
+    can be supplied when the caller has already embedded and scored the
+    message (see /map-response/batch and async_semantic_service.py).
+    With `includeText: false` the payload carries only question and option ids.
+    With `includeChunk: true` a long message's payload names the chunk that
+    drove the match (see message_chunks.py).
+    """
+    payload, status = decide_mapping(data, query_embedding, question_match)
+    metrics.MAPPINGS.labels(payload.get('mappingType', 'error')).inc()
+    return trim_payload(payload, data), status
+
+def decide_mapping(data, query_embedding=None, question_match=None):
+    """Pick and run the mapping for a request; see map_message"""
+    user_message = data['message']
+    conversation_id = data.get('conversationId', 'default')
+    mapping_type = data.get('mappingType', 'auto')
+
+    logger.debug("Received request - message: '%s', type: '%s', conversation: '%s'",
+                 user_message, mapping_type, conversation_id)
+
+    # If we have a specific mapping type request
+    if mapping_type == 'question':
+        logger.debug("Explicitly mapping to question")
+        return map_to_question(user_message, conversation_id, query_embedding, question_match)
+    elif mapping_type == 'option':
+        # We need the category to map to options
+        category = data.get('category')
+        question = data.get('question')
+        if not category or not question:
+            logger.debug("Missing category or question for option mapping")
+            return {
+                "success": False,
+                "message": "Category and question are required for option mapping"
+            }, 400
+        logger.debug("Explicitly mapping to option for %s/%s", category, question)
+        return map_to_option(user_message, category, question, conversation_id, query_embedding)
+    else:
+        question_result, option_result, _ = decide_turn(user_message, conversation_id, query_embedding,
+                                                        question_match)
+        # Auto mode answers with the question mapping whenever one was made
+        return question_result or option_result
+
+def decide_turn(user_message, conversation_id, query_embedding=None, question_match=None):
+    """Run the auto-mode decision for one patient turn
+
+    Returns (question_result, option_result, transition). Either result is
+    None when that mapping was not needed; the transition names the decision
+    and the conversation's pending question id before and after the turn.
+    """
+    # Embed the message and the pending question's options before taking
+    # the conversation lock, so no Ollama call is made while holding it
+    if query_embedding is None:
+        query_embedding = embed_message(user_message)
+    pending_state = conversation_state.get(conversation_id)
+    if pending_state is not None:
+        process_embeddings_batch(question_bank.options(pending_state.question_id))
+
+    def finish(decision, prev_question_id, question_result=None, option_result=None):
+        note(decision=decision)
+        pending = conversation_state.get(conversation_id)
+        return question_result, option_result, {
+            "decision": decision,
+            "previousQuestionId": prev_question_id,
+            "pendingQuestionId": pending.question_id if pending is not None else None,
+        }
+
+    # Decide and update the state atomically with respect to other
+    # requests for the same conversation
+    with conversation_state.lock(conversation_id):
+        # Auto-detect if we should map to a question or an option
+        prev_state = conversation_state.get(conversation_id)
+        if prev_state is None:
+            # Otherwise map to question
+            logger.debug("No previous state, mapping to question")
+            return finish("question", None,
+                          map_to_question(user_message, conversation_id, query_embedding, question_match))
+
+        prev_question_id = prev_state.question_id
+        prev_question = question_bank.question_texts[prev_question_id]
+        prev_category = question_bank.question_categories[prev_question_id]
+        # If we have a previous question for this conversation, try to map to option
+        logger.debug("Found previous state - question: '%s', category: '%s'", prev_question, prev_category)
+
+        # First try to map to an option for the exact question
+        option_result = map_to_option(user_message, prev_category, prev_question, conversation_id,
+                                      query_embedding, question_id=prev_question_id)
+        option_data = option_result[0]
+
+        # If confidence is too low, or the option belongs to another question,
+        # abandon the question and try mapping to a question instead
+        if option_data.get('confidence', 0) < 0.6:
+            logger.debug("Option confidence too low (%s), abandoning question '%s'",
+                         option_data.get('confidence', 0), prev_question)
+            reason = "low_confidence"
+        elif option_data.get('questionId') != prev_question_id:
+            logger.debug("Question mismatch - expected '%s', got '%s'", prev_question, option_data.get('question'))
+            reason = "question_mismatch"
+        else:
+            # A confident match for the right question: clear the conversation state
+            logger.debug("Good option match, clearing conversation state")
+            conversation_state.pop(conversation_id)
+            return finish("option", prev_question_id, option_result=option_result)
+
+        note(abandonedQuestionId=prev_question_id)
+        metrics.ABANDONED_QUESTIONS.labels(reason).inc()
+        conversation_state.pop(conversation_id)
+
+        # The question result is returned even with low confidence, as the
+        # previous question has been abandoned
+        question_result = map_to_question(user_message, conversation_id, query_embedding, question_match)
+        logger.debug("Question mapping after abandoning: '%s' with confidence %s",
+                     question_result[0].get('question'), question_result[0].get('confidence', 0))
+        return finish(f"abandon_{reason}", prev_question_id, question_result, option_result)
+
+# One patient turn in a single call (/map-turn)
+def apply_pending_question(data):
+    """Make the caller's pending question, if it sent one, the conversation's state
+
+    `pendingQuestion` is {"category", "question"}, or null when no question is
+    pending. Without the field the service's own state is used.
+    """
+    if 'pendingQuestion' not in data:
+        return
+    conversation_id = data.get('conversationId', 'default')
+    pending = data['pendingQuestion']
+    question_id = None
+    if isinstance(pending, dict):
+        question_id = question_bank.question_id(pending.get('category'), pending.get('question'))
+        if question_id is None:
+            logger.warning("Pending question is not in the bank: %s/%s", pending.get('category'),
+                           pending.get('question'))
+    with conversation_state.lock(conversation_id):
+        current = conversation_state.get(conversation_id)
+        if question_id is None:
+            if current is not None:
+                conversation_state.pop(conversation_id)
+        elif current is None or current.question_id != question_id:
+            conversation_state.set(conversation_id, SessionState(question_id, int(time.time())))
+
+def map_turn(data, query_embedding=None, question_match=None):
+    """Map one patient turn with the auto-mode decision
+
+    Returns a (payload, status) tuple whose payload carries the option
+    result, the question result (made when no question was pending or the
+    pending one was abandoned) and the state transition, so the caller needs
+    one request and the message one embedding.
+    """
+    apply_pending_question(data)
+    question_result, option_result, transition = decide_turn(
+        data['message'], data.get('conversationId', 'default'), query_embedding, question_match)
+    chosen, status = question_result or option_result
+    metrics.MAPPINGS.labels(chosen.get('mappingType', 'error')).inc()
+    if status != 200:
+        return chosen, status
+
+    results = {}
+    for name, result in (("question", question_result), ("option", option_result)):
+        payload = result[0] if result is not None else None
+        if payload is not None:
+            payload = trim_payload({key: value for key, value in payload.items()
+                                    if key not in ('success', 'mappingType')}, data)
+        results[name] = payload
+    return {
+        "success": True,
+        "mappingType": chosen['mappingType'],
+        "option": results["option"],
+        "question": results["question"],
+        "transition": transition,
+    }, 200
+
+def log_result(log, status, payload):
+    """Record a response's status and mapping result in its request log line
+
+    A /map-turn payload nests its results, so the chosen one is logged.
+    """
+    chosen = payload.get(payload.get('mappingType')) if 'transition' in payload else payload
+    if not isinstance(chosen, dict):
+        chosen = payload
+    log.update(status=status, mappingType=payload.get('mappingType'),
+               questionId=chosen.get('questionId'), confidence=chosen.get('confidence'))
+
+# Per-request timing and trace headers
+def add_debug_timing(payload, data, log, timer):
+    """With `debug: true` in the request, add the stage timings to the payload"""
+    if isinstance(data, dict) and data.get('debug') is True:
+        payload = dict(payload, timing=dict(timer.as_dict(), traceId=log['traceId']))
+    return payload
+
+def timing_headers(log, timer):
+    """Server-Timing breakdown (with the auto-mode decision) and the trace id"""
+    server_timing = timer.server_timing()
+    if log.get('decision'):
+        server_timing += f', decision;desc="{log["decision"]}"'
+    return {"Server-Timing": server_timing, TRACE_HEADER: log['traceId']}
+
+# Admission control and degraded mode
+def admission_lane(data):
+    """Option mapping on a conversation with a pending question goes first"""
+    if not isinstance(data, dict):
+        return NORMAL
+    mapping_type = data.get('mappingType', 'auto')
+    if mapping_type == 'option' or data.get('pendingQuestion'):
+        return PRIORITY
+    if mapping_type != 'question' and conversation_state.get(data.get('conversationId', 'default')) is not None:
+        return PRIORITY
+    return NORMAL
+
+def record_admission(lane, admitted, waited, reason):
+    metrics.ADMISSION_WAIT.labels(lane).observe(waited)
+    if waited:
+        note(queueWaitMs=round(waited * 1000, 3))
+    if not admitted:
+        metrics.ADMISSION_SHED.labels(lane, reason).inc()
+        note(shed=reason, lane=lane)
+
+def deadline_exceeded_response():
+    return {
+        "success": False,
+        "message": "Request deadline exceeded"
+    }, 504, {}
+
+def overloaded_response():
+    """503 for a shed request, with a Retry-After estimate"""
+    return {
+        "success": False,
+        "message": "Service is overloaded, retry later"
+    }, 503, {"Retry-After": str(admission.retry_after())}
+
+def map_degraded(data, mapper=map_message):
+    """Map a shed request from cached and lexical embeddings only"""
+    token = degraded_request.set(True)
+    try:
+        payload, status = mapper(data)
+    finally:
+        degraded_request.reset(token)
+    if status == 200:
+        payload = dict(payload, degraded=True)
+        metrics.DEGRADED_RESPONSES.inc()
+    return payload, status
+
+def map_admitted(data, mapper=map_message):
+    """Run a mapper (map_message or map_turn) under admission control
+
+    Returns (payload, status, headers).
+    """
+    lane = admission_lane(data)
+    admitted, waited, reason = admission.acquire(lane, bounded(admission.queue_timeout))
+    record_admission(lane, admitted, waited, reason)
+    if admitted:
+        start = time.perf_counter()
+        try:
+            payload, status = mapper(data)
+        finally:
+            admission.release(time.perf_counter() - start)
+        if status == 500 and expired():
+            return deadline_exceeded_response()
+        return payload, status, {}
+    if DEGRADED_MODE:
+        payload, status = map_degraded(data, mapper)
+        if status != 500:
+            return payload, status, {}
+    return overloaded_response()
+
+def encoded_response(payload):
+    """Response with the payload as JSON, or as MessagePack if the client prefers it"""
+    body, content_type = encode_body(payload, request.headers.get("Accept"))
+    response = Response(body, content_type=content_type)
+    response.vary.add("Accept")
+    return response
 
 @app.route('/map-response', methods=['POST'])
 def map_response():
+    return serve_mapping('/map-response', map_message)
+
+@app.route('/map-turn', methods=['POST'])
+def map_turn_endpoint():
+    """One patient turn: option result, fallback question result and state transition"""
+    return serve_mapping('/map-turn', map_turn)
+
+def bad_request(message):
+    return {"success": False, "message": message}, 400
+
+def decode_request(body, content_type, single=True):
+    """Decode a mapping request body; returns (data, None) or (data, (payload, 400))
+
+    A single mapping (/map-response, /map-turn) must be an object with a
+    'message' string; the items of a batch are checked by map_batch.
+    """
     try:
-        data = request.json
-        user_message = data['message']
-        conversation_id = data.get('conversationId', 'default')
-        mapping_type = data.get('mappingType', 'auto')
-        
-        print(f"DEBUG: Received request - message: '{user_message}', type: '{mapping_type}', conversation: '{conversation_id}'")
-        
-        # If we have a specific mapping type request
-        if mapping_type == 'question':
-            print(f"DEBUG: Explicitly mapping to question")
-            return map_to_question(user_message, conversation_id)
-        elif mapping_type == 'option':
-            # We need the category to map to options
-            category = data.get('category')
-            question = data.get('question')
-            if not category or not question:
-                print(f"DEBUG: Missing category or question for option mapping")
-                return jsonify({
+        with stage("serialization"):
+            data = decode_body(body, content_type)
+    except ValueError as e:
+        return None, bad_request(f"Request body could not be decoded: {str(e) or type(e).__name__}")
+    if single and not (isinstance(data, dict) and isinstance(data.get('message'), str)):
+        return data, bad_request("Request body must be an object with a 'message' string")
+    return data, None
+
+def serve_mapping(route, mapper):
+    with request_log(route, request.headers.get(TRACE_HEADER)) as log, time_request() as timer:
+        headers = {}
+        data, error = decode_request(request.get_data(), request.content_type)
+        if error is not None:
+            payload, status = error
+        else:
+            try:
+                with request_deadline(parse_budget(request.headers.get(DEADLINE_HEADER), data)):
+                    payload, status, headers = map_admitted(data, mapper)
+            except Exception as e:
+                logger.exception("Error in %s: %s", route, e)
+                payload, status = {
                     "success": False,
-                    "message": "Category and question are required for option mapping"
-                }), 400
-            print(f"DEBUG: Explicitly mapping to option for {category}/{question}")
-            return map_to_option(user_message, category, question, conversation_id)
+                    "message": f"Error processing request: {str(e)}"
+                }, 500
+        log_result(log, status, payload)
+        payload = add_debug_timing(payload, data, log, timer)
+        with stage("serialization"):
+            response = encoded_response(payload)
+        return response, status, dict(headers, **timing_headers(log, timer))
+
+@app.route('/map-response/batch', methods=['POST'])
+def map_response_batch():
+    """Map many messages in one request; results are returned in item order"""
+    with request_log('/map-response/batch', request.headers.get(TRACE_HEADER)) as log, time_request() as timer:
+        headers = {}
+        data, error = decode_request(request.get_data(), request.content_type, single=False)
+        if error is not None:
+            payload, status = error
         else:
-            # Auto-detect if we should map to a question or an option
-            if conversation_id in conversation_state:
-                # If we have a previous question for this conversation, try to map to option
-                prev_state = conversation_state[conversation_id]
-                print(f"DEBUG: Found previous state - question: '{prev_state['question']}', category: '{prev_state['category']}'")
-                
-                # First try to map to an option for the exact question
-                option_result = map_to_option(user_message, prev_state['category'], prev_state['question'], conversation_id)
-                option_data = option_result.get_json()
-                
-                # If confidence is too low, try mapping to a question instead
-                if option_data.get('confidence', 0) < 0.6:
-                    print(f"DEBUG: Option confidence too low ({option_data.get('confidence', 0)}), trying question mapping")
-                    
-                    # Clear the conversation state since we're abandoning this question
-                    print(f"DEBUG: Abandoning question '{prev_state['question']}' due to low option confidence")
-                    del conversation_state[conversation_id]
-                    
-                    # Try mapping to a question
-                    question_result = map_to_question(user_message, conversation_id)
-                    question_data = question_result.get_json()
-                    
-                    # If question confidence is higher, return that instead
-                    if question_data.get('confidence', 0) >= 0.6:
-                        print(f"DEBUG: Found better question match: '{question_data.get('question')}' with confidence {question_data.get('confidence', 0)}")
-                        return question_result
-                    else:
-                        print(f"DEBUG: Question confidence also too low ({question_data.get('confidence', 0)})")
-                        # Return the question result anyway, as we've abandoned the previous question
-                        return question_result
-                
-                # Check if the option matches the question
-                if option_data.get('question') != prev_state['question']:
-                    print(f"DEBUG: Question mismatch - expected '{prev_state['question']}', got '{option_data.get('question')}'")
-                    
-                    # Clear the conversation state since we're abandoning this question
-                    print(f"DEBUG: Abandoning question '{prev_state['question']}' due to question mismatch")
-                    del conversation_state[conversation_id]
-                    
-                    # Try mapping to a question instead
-                    question_result = map_to_question(user_message, conversation_id)
-                    question_data = question_result.get_json()
-                    
-                    # If question confidence is good, return that instead
-                    if question_data.get('confidence', 0) >= 0.6:
-                        print(f"DEBUG: Found question match: '{question_data.get('question')}' with confidence {question_data.get('confidence', 0)}")
-                        return question_result
+            try:
+                with request_deadline(parse_budget(request.headers.get(DEADLINE_HEADER), data)):
+                    admitted, waited, reason = admission.acquire(NORMAL, bounded(admission.queue_timeout))
+                    record_admission(NORMAL, admitted, waited, reason)
+                    if admitted:
+                        start = time.perf_counter()
+                        try:
+                            payload, status = map_batch(data)
+                        finally:
+                            admission.release(time.perf_counter() - start)
                     else:
-                        # Return the question result anyway, as we've abandoned the previous question
-                        return question_result
-                
-                # If we have a good match, clear the conversation state
-                if (option_data.get('confidence', 0) >= 0.6 and 
-                    option_data.get('question') == prev_state['question'] and
-                    option_data.get('category') == prev_state['category']):
-                    # Clear the state if we have a confident match for the right question
-                    print(f"DEBUG: Good option match, clearing conversation state")
-                    del conversation_state[conversation_id]
-                
-                return option_result
+                        payload, status, headers = overloaded_response()
+            except Exception as e:
+                logger.exception("Error in /map-response/batch: %s", e)
+                payload, status = {
+                    "success": False,
+                    "message": f"Error processing request: {str(e)}"
+                }, 500
+        log.update(status=status, items=len(payload.get('results', [])))
+        payload = add_debug_timing(payload, data, log, timer)
+        with stage("serialization"):
+            response = encoded_response(payload)
+        return response, status, dict(headers, **timing_headers(log, timer))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    start = g.pop('request_start', None)
+    if start is not None and request.endpoint != 'metrics_endpoint':
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.REQUEST_SECONDS.labels(route).observe(time.perf_counter() - start)
+        metrics.REQUESTS.labels(route, str(response.status_code)).inc()
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics of the worker process serving this request"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# Health endpoints. They only read in-process state (the state backend check is
+# cached for READINESS_CHECK_INTERVAL), never call Ollama, and are cheap enough
+# to probe at high frequency.
+state_backend_check = {"checkedAt": 0.0, "reachable": True}
+
+def state_backend_reachable():
+    now = time.monotonic()
+    if now - state_backend_check["checkedAt"] >= READINESS_CHECK_INTERVAL:
+        state_backend_check["checkedAt"] = now
+        state_backend_check["reachable"] = conversation_state.ping()
+    return state_backend_check["reachable"]
+
+def readiness_checks():
+    """Conditions for taking traffic: a compiled index, warm caches, reachable state"""
+    return {
+        "questionIndex": question_index is not None,
+        "warm": warmup_progress["state"] == "complete" or not PRELOAD_QUESTIONS,
+        "stateBackend": state_backend_reachable(),
+    }
+
+def process_rss_bytes():
+    """Resident memory of this process, or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def service_status():
+    """Snapshot of this worker's state for /status"""
+    checks = readiness_checks()
+    index = question_index
+    with embedding_cache_lock:
+        local_entries = len(embedding_cache)
+        local_bytes = sum(embedding.nbytes for embedding in embedding_cache.values())
+    lru = get_cached_embedding.cache_info()
+    return {
+        "ready": all(checks.values()),
+        "checks": checks,
+        "pid": os.getpid(),
+        "uptimeSeconds": round(time.time() - started_at, 3),
+        "questionBank": {
+            "version": question_bank.version,
+            "questions": len(question_bank),
+            "options": len(question_bank.option_texts),
+        },
+        "questionIndex": {
+            "backend": index.name,
+            "vectors": len(index),
+            "dim": index.dim,
+        } if index is not None else None,
+        "warmup": dict(warmup_progress),
+        "ollama": {"model": OLLAMA_MODEL, "circuit": ollama_circuit.stats(), "instances": ollama_pool.stats(),
+                   "latency": {path: window.stats() for path, window in ollama_latency.items()},
+                   "hedging": ollama_hedging.stats() if ollama_hedging is not None else None,
+                   "attemptTimeoutSeconds": round(embedding_timeout.timeout(), 3),
+                   "retryBudget": ollama_retry_budget.stats(),
+                   "keepAlive": OLLAMA_KEEP_ALIVE, "keepWarmIdle": OLLAMA_KEEP_WARM_IDLE},
+        "caches": {
+            "nearDuplicate": near_duplicates.stats() if near_duplicates is not None else None,
+            "local": {"entries": local_entries, "bytes": local_bytes},
+            "lru": {"entries": lru.currsize, "maxEntries": lru.maxsize},
+            "shared": shared_embedding_cache.stats() if shared_embedding_cache is not None else None,
+        },
+        "memory": {"rssBytes": process_rss_bytes()},
+        "queues": {"embedding": embedding_queue.qsize(), "admission": admission.stats(),
+                   "ollama": ollama_scheduler.stats()},
+        "degradedMode": {"enabled": DEGRADED_MODE, "lexicalTexts": len(lexical_tier) if lexical_tier else 0},
+        "conversationState": conversation_state.stats(),
+    }
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and answering"""
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 once this worker can map messages at full quality"""
+    checks = readiness_checks()
+    ready = all(checks.values())
+    return jsonify({"ready": ready, "checks": checks}), 200 if ready else 503
+
+@app.route('/status', methods=['GET'])
+def status():
+    return jsonify(service_status()), 200
+
+def map_batch(data):
+    """Map the items of a batch request; returns a (payload, status) tuple"""
+    try:
+        items = data.get('items') if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            return {
+                "success": False,
+                "message": "Request body must be a list of items or an object with an 'items' list"
+            }, 400
+        if len(items) > MAX_BATCH_ITEMS:
+            return {
+                "success": False,
+                "message": f"At most {MAX_BATCH_ITEMS} items are allowed per batch"
+            }, 400
+
+        valid = [i for i, item in enumerate(items)
+                 if isinstance(item, dict) and isinstance(item.get('message'), str)]
+        valid_set = set(valid)
+
+        # Embed every distinct uncached message, and the chunks of long ones,
+        # in one batched pass
+        texts = list(dict.fromkeys(items[i]['message'] for i in valid))
+        chunked = {}
+        batch_texts = []
+        for text in texts:
+            chunks = chunks_of(text)
+            if chunks is None:
+                batch_texts.append(text)
             else:
-                # Otherwise map to question
-                print(f"DEBUG: No previous state, mapping to question")
-                return map_to_question(user_message, conversation_id)
+                chunked[text] = chunks
+        batch_texts += [chunk for chunks in chunked.values() for chunk in chunks]
+        batch_embeddings = process_embeddings_batch(batch_texts)
+        by_text = {text: batch_embeddings.get(j) for j, text in enumerate(batch_texts)}
+        embeddings = {text: by_text.get(text) for text in texts if text not in chunked}
+        for text, chunks in chunked.items():
+            embeddings[text] = chunked_message(chunks, [by_text.get(chunk) for chunk in chunks])
+
+        # Score all messages against the question index as one matrix product
+        # per embedding size (fallback embeddings are smaller than Ollama's)
+        question_matches = {}
+        by_dim = {}
+        for i in valid:
+            embedding = embeddings.get(items[i]['message'])
+            # Chunked messages are scored chunk by chunk in map_to_question
+            if embedding is not None and not isinstance(embedding, ChunkedMessage):
+                by_dim.setdefault(len(embedding), []).append(i)
+        for item_indices in by_dim.values():
+            matches = search_questions(np.stack([embeddings[items[i]['message']] for i in item_indices]))
+            if matches is not None:
+                question_matches.update(zip(item_indices, matches))
+
+        # Apply the mappings in order so conversation state evolves as it would
+        # for the equivalent sequence of single requests
+        results = []
+        decisions = {}
+        for i, item in enumerate(items):
+            if i not in valid_set:
+                results.append({"success": False, "message": "Each item needs a 'message' string"})
+                continue
+            try:
+                with collect_fields() as fields:
+                    payload, status = map_message(item, embeddings.get(item['message']), question_matches.get(i))
+                decision = fields.get('decision', payload.get('mappingType'))
+                decisions[decision] = decisions.get(decision, 0) + 1
+                results.append(payload)
+            except Exception as e:
+                results.append({"success": False, "message": f"Error processing item: {str(e)}"})
+
+        note(decisions=decisions)
+        return {
+            "success": True,
+            "results": results
+        }, 200
     except Exception as e:
-        print(f"Error in map_response: {e}")
-        return jsonify({
+        logger.exception("Error in map_response_batch: %s", e)
+        return {
             "success": False,
             "message": f"Error processing request: {str(e)}"
-        }), 500
+        }, 500
+
+# Save the embeddings of all preloaded texts so later starts skip warmup
+def save_embedding_artifact(path=EMBEDDING_ARTIFACT_PATH):
+    """Write cached Ollama embeddings for questions and options to an .npz file"""
+    texts = []
+    vectors = []
+    for text in preload_texts():
+        embedding = find_cached_embedding(text.strip().lower())
+        if embedding is not None:
+            texts.append(text)
+            vectors.append(embedding)
+    if not vectors or len({len(v) for v in vectors}) != 1:
+        logger.warning("Not saving embedding artifact: no consistent cached embeddings")
+        return False
+
+    np.savez(path, model=OLLAMA_MODEL, texts=np.array(texts), vectors=np.stack(vectors).astype(np.float32))
+    logger.info("Saved %d embeddings to %s", len(texts), path)
+    return True
+
+def load_embedding_artifact(path=EMBEDDING_ARTIFACT_PATH):
+    """Load embeddings saved by save_embedding_artifact into the embedding cache"""
+    if not os.path.exists(path):
+        return 0
+    try:
+        with np.load(path) as artifact:
+            if str(artifact["model"]) != OLLAMA_MODEL:
+                logger.warning("Ignoring embedding artifact for model %s", artifact['model'])
+                return 0
+            texts = artifact["texts"]
+            vectors = artifact["vectors"]
+    except Exception as e:
+        logger.warning("Could not load embedding artifact %s: %s", path, e)
+        return 0
+
+    with embedding_cache_lock:
+        for text, vector in zip(texts, vectors):
+            embedding_cache[str(text).strip().lower()] = vector
+    logger.info("Loaded %d embeddings from %s", len(texts), path)
+    return len(texts)
+
+# Service lifecycle
+#
+# create_app() creates state that every worker can share (shared embedding
+# cache, embedding artifact and compiled question index). Under a pre-fork server it runs once in the master,
+# so workers inherit those pages copy-on-write. start_background_workers() must
+# run in each process that serves requests, after any fork, because threads do
+# not survive fork. See gunicorn.conf.py.
+background_workers_pid = None
+
+def create_app(preload=True):
+    """Load shared embedding state and return the Flask app
+
+    With `preload` the question embeddings are fetched from Ollama now if the
+    artifact did not provide them, and the artifact is refreshed.
+    """
+    global shared_embedding_cache
+    configure_logging()
+    if SharedEmbeddingCache is not None and SHARED_EMBEDDING_CACHE_SLOTS and shared_embedding_cache is None:
+        shared_embedding_cache = SharedEmbeddingCache(SHARED_EMBEDDING_CACHE_SLOTS, EMBEDDING_DIM)
+
+    load_embedding_artifact()
+    if question_index is None and all(
+            find_cached_embedding(text.strip().lower()) is not None for text in preload_texts()):
+        compile_question_index()
+        if question_index is not None:
+            total = len(preload_texts())
+            warmup_progress.update(state="complete", source="artifact", done=total, total=total, seconds=0.0)
+
+    if preload and PRELOAD_QUESTIONS and question_index is None:
+        preload_question_embeddings()
+        if question_index is not None:
+            save_embedding_artifact()
+    return app
+
+def start_background_workers():
+    """Start this process's background workers (and preload if still needed)"""
+    global background_workers_pid
+    if background_workers_pid == os.getpid():
+        return
+    background_workers_pid = os.getpid()
+    configure_logging()
+
+    embedding_thread = threading.Thread(target=embedding_worker, daemon=True)
+    embedding_thread.start()
 
-# Start background worker thread
-embedding_thread = threading.Thread(target=embedding_worker, daemon=True)
-embedding_thread.start()
+    if OLLAMA_KEEP_WARM_IDLE > 0:
+        threading.Thread(target=keep_warm_worker, daemon=True).start()
+    if near_duplicates is not None and NEAR_DUPLICATE_AUDIT_RATE > 0:
+        threading.Thread(target=near_duplicate_audit_worker, daemon=True).start()
+    if STATE_PURGE_INTERVAL > 0 and hasattr(conversation_state, 'purge_expired'):
+        threading.Thread(target=state_purge_worker, daemon=True).start()
 
-# Preload embeddings if enabled
-if PRELOAD_QUESTIONS:
-    preload_thread = threading.Thread(target=preload_question_embeddings, daemon=True)
-    preload_thread.start()
+    # Preload embeddings if enabled and create_app did not already do it
+    if PRELOAD_QUESTIONS and question_index is None:
+        preload_thread = threading.Thread(target=preload_question_embeddings, daemon=True)
+        preload_thread.start()
 
 if __name__ == '__main__':
-    print("Starting optimized semantic service...")
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    configure_logging()
+    logger.info("Starting optimized semantic service...")
+    create_app(preload=False)
+    start_background_workers()
+    # HTTP/1.1 lets callers keep their connection open between requests
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    socket_path = os.environ.get("SEMANTIC_SERVICE_SOCKET")
+    app.run(host=f"unix://{socket_path}" if socket_path else '0.0.0.0', port=5000)
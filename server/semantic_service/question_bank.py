@@ -0,0 +1,77 @@
+import hashlib
+import json
+
+# Integer identities for the assessment bank.
+#
+# Questions and options are interned once, when the service starts: question
+# ids number (category, question) pairs in bank order and option ids number
+# the distinct option texts. Each question id maps to the tuple of its option
+# ids, resolved up front, so the request path compares and stores small ints
+# instead of question strings. `version` fingerprints the bank; ids are only
+# meaningful within one version.
+
+
+class QuestionBank:
+    """Interned question and option ids for a questions_data bank"""
+
+    def __init__(self, questions_data, resolve_options):
+        self.question_texts = []       # question id -> question text
+        self.question_categories = []  # question id -> category
+        self.option_texts = []         # option id -> option text
+        self._question_ids = {}
+        self._option_ids = {}
+        self._options = []             # question id -> option ids
+        self._canonical = []           # question id -> id of the question its options belong to
+
+        for category, questions in questions_data.items():
+            for question in questions:
+                self._intern_question(category, question)
+        # Resolving options can name a question that is not in questions_data
+        # (a close match in the options table); it is interned and resolved too
+        question_id = 0
+        while question_id < len(self.question_texts):
+            category = self.question_categories[question_id]
+            canonical, options = resolve_options(category, self.question_texts[question_id])
+            self._canonical[question_id] = self._intern_question(category, canonical)
+            self._options[question_id] = tuple(self._intern_option(option) for option in options)
+            question_id += 1
+
+        fingerprint = json.dumps([self.question_categories, self.question_texts, self.option_texts,
+                                  self._options, self._canonical])
+        self.version = hashlib.blake2b(fingerprint.encode("utf-8"), digest_size=6).hexdigest()
+
+    def _intern_question(self, category, question):
+        key = (category, question)
+        question_id = self._question_ids.get(key)
+        if question_id is None:
+            question_id = self._question_ids[key] = len(self.question_texts)
+            self.question_texts.append(question)
+            self.question_categories.append(category)
+            self._options.append(None)
+            self._canonical.append(None)
+        return question_id
+
+    def _intern_option(self, option):
+        option_id = self._option_ids.get(option)
+        if option_id is None:
+            option_id = self._option_ids[option] = len(self.option_texts)
+            self.option_texts.append(option)
+        return option_id
+
+    def __len__(self):
+        return len(self.question_texts)
+
+    def question_id(self, category, question):
+        """Return the id of a question, or None if it is not in the bank"""
+        return self._question_ids.get((category, question))
+
+    def canonical(self, question_id):
+        """Id of the question whose options `question_id` is answered with"""
+        return self._canonical[question_id]
+
+    def option_ids(self, question_id):
+        return self._options[question_id]
+
+    def options(self, question_id):
+        """Option texts of a question, in score order"""
+        return [self.option_texts[option_id] for option_id in self._options[question_id]]
@@ -0,0 +1,265 @@
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+from conversation_store import StateBackend, encode_state, decode_state
+from service_logging import logger
+
+# Conversation state in a Redis-protocol (RESP2) server.
+#
+# Speaks the wire protocol directly over a small per-process connection pool,
+# so it needs no client library and works with Redis, Valkey, KeyDB or any
+# stand-in that implements GET/SET/DEL/EXPIRE/MGET. Every operation is sent as
+# one pipeline: all commands are written in a single send and their replies
+# read back in order. Values are encoded with encode_state().
+#
+# lock() must keep two turns of one conversation from deciding at once even
+# when different nodes handle them, so it takes a lock key in the server:
+# SET NX PX with a random token, polled until it is free. It is released by a
+# script that deletes the key only if it still holds our token, so a lock
+# that expired and was taken by another node is never released by us. The
+# expiry frees the lock of a node that died holding it. If the server cannot
+# be reached, the turn goes ahead under the in-process lock alone, as
+# state operations then degrade to "no state" anyway.
+
+LOCK_TTL_MS = 5000           # A held lock expires after this long
+LOCK_WAIT_SECONDS = 2.0      # Give up waiting for another node's lock after this long
+RELEASE_SCRIPT = (b"if redis.call('GET', KEYS[1]) == ARGV[1] then "
+                  b"return redis.call('DEL', KEYS[1]) else return 0 end")
+
+
+class RespError(Exception):
+    """Error reply from the server"""
+
+
+def encode_command(args):
+    """Encode one command as a RESP array of bulk strings"""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+class RespConnection:
+    """A single connection that executes pipelines of commands"""
+
+    def __init__(self, address, family, timeout, db):
+        self.pid = os.getpid()
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        if db:
+            self.execute([("SELECT", db)])
+
+    def execute(self, commands):
+        """Send all commands at once and return their replies in order"""
+        self.sock.sendall(b"".join(encode_command(c) for c in commands))
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by state backend")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        if kind == b"-":
+            return RespError(payload.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply from state backend: {line!r}")
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConversationLock:
+    """Re-entrant lock on one conversation, held across processes and nodes"""
+
+    def __init__(self, backend, conversation_id):
+        self.backend = backend
+        self.key = backend._key(conversation_id) + b":lock"
+        self.local = backend._locks[hash(conversation_id) % len(backend._locks)]
+
+    def __enter__(self):
+        self.local.acquire()
+        held = self.backend._held_locks()
+        depth, token = held.get(self.key, (0, None))
+        if depth == 0:
+            token = self._acquire()
+        held[self.key] = (depth + 1, token)
+        return self
+
+    def __exit__(self, *exc_info):
+        held = self.backend._held_locks()
+        depth, token = held.pop(self.key)
+        if depth > 1:
+            held[self.key] = (depth - 1, token)
+        elif token is not None:
+            self.backend._safe_pipeline([("EVAL", RELEASE_SCRIPT, 1, self.key, token)])
+        self.local.release()
+
+    def _acquire(self):
+        """Take the lock key; return its token, or None to go ahead without it"""
+        token = uuid.uuid4().hex.encode()
+        deadline = time.monotonic() + LOCK_WAIT_SECONDS
+        delay = 0.002
+        while True:
+            replies = self.backend._safe_pipeline([("SET", self.key, token, "NX", "PX", LOCK_TTL_MS)])
+            if replies is None:
+                return None
+            if replies[0] is not None:
+                return token
+            if time.monotonic() >= deadline:
+                self.backend.lock_timeouts += 1
+                logger.warning("Timed out waiting for conversation lock %s", self.key.decode("utf-8", "replace"))
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+
+class RedisStateBackend(StateBackend):
+    """Conversation state in Redis with a TTL refreshed on every access"""
+
+    remote = True
+
+    def __init__(self, url, ttl=3600, prefix="semantic:conversation:", pool_size=8, timeout=1.0):
+        parsed = urlparse(url)
+        if parsed.scheme == "unix":
+            self.address, self.family = parsed.path, socket.AF_UNIX
+            self.db = 0
+        else:
+            self.address = (parsed.hostname or "localhost", parsed.port or 6379)
+            self.family = socket.AF_INET
+            self.db = int(parsed.path.lstrip("/") or 0)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._locks = [threading.RLock() for _ in range(16)]
+        self._held = threading.local()
+        self.errors = 0
+        self.lock_timeouts = 0
+
+    def _key(self, conversation_id):
+        return (self.prefix + conversation_id).encode("utf-8")
+
+    def _held_locks(self):
+        """{lock key: (depth, token)} of the conversation locks this thread holds"""
+        held = getattr(self._held, "locks", None)
+        if held is None:
+            held = self._held.locks = {}
+        return held
+
+    def _connection(self):
+        while True:
+            try:
+                connection = self._pool.get_nowait()
+            except queue.Empty:
+                return RespConnection(self.address, self.family, self.timeout, self.db)
+            # Sockets inherited across fork must not be shared with the parent
+            if connection.pid == os.getpid():
+                return connection
+
+    def pipeline(self, commands):
+        """Execute commands as one pipeline, retrying once on a stale connection"""
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                replies = connection.execute(commands)
+            except OSError:
+                connection.close()
+                if attempt == 1:
+                    raise
+                continue
+            except RespError:
+                self._release(connection)
+                raise
+            self._release(connection)
+            return replies
+
+    def _release(self, connection):
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _safe_pipeline(self, commands):
+        try:
+            return self.pipeline(commands)
+        except (OSError, RespError) as e:
+            # Losing state only degrades auto mode to question mapping
+            self.errors += 1
+            logger.warning("State backend error: %s", e)
+            return None
+
+    def get(self, conversation_id, default=None):
+        key = self._key(conversation_id)
+        replies = self._safe_pipeline([("GET", key), ("EXPIRE", key, self.ttl)])
+        if not replies or replies[0] is None:
+            return default
+        return decode_state(replies[0])
+
+    def get_many(self, conversation_ids):
+        conversation_ids = list(dict.fromkeys(conversation_ids))
+        if not conversation_ids:
+            return {}
+        keys = [self._key(c) for c in conversation_ids]
+        replies = self._safe_pipeline([("MGET", *keys)] + [("EXPIRE", key, self.ttl) for key in keys])
+        if not replies:
+            return {}
+        return {c: decode_state(v) for c, v in zip(conversation_ids, replies[0]) if v is not None}
+
+    def set(self, conversation_id, state):
+        self._safe_pipeline([("SET", self._key(conversation_id), encode_state(state), "EX", self.ttl)])
+
+    def pop(self, conversation_id, default=None):
+        key = self._key(conversation_id)
+        replies = self._safe_pipeline([("GET", key), ("DEL", key)])
+        if not replies or replies[0] is None:
+            return default
+        return decode_state(replies[0])
+
+    def lock(self, conversation_id):
+        return ConversationLock(self, conversation_id)
+
+    def ping(self):
+        """Return True if the server answers"""
+        replies = self._safe_pipeline([("PING",)])
+        return bool(replies) and replies[0] == b"PONG"
+
+    def stats(self):
+        return {
+            "backend": "redis",
+            "ttlSeconds": self.ttl,
+            "errors": self.errors,
+            "lockTimeouts": self.lock_timeouts,
+        }
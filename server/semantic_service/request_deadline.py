@@ -0,0 +1,72 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+# End-to-end request deadlines.
+#
+# A caller can give a request a time budget, in milliseconds from when the
+# request arrives: the X-Deadline-Ms header or a deadlineMs body field (the
+# smaller wins if both are sent). The deadline is kept in a ContextVar while
+# the request is handled. Everything that waits bounds its wait with
+# bounded(): the admission queue, waits on another worker's embedding,
+# Ollama calls and retry sleeps. Once less than MIN_CALL_SECONDS is left, no
+# new Ollama call is started and the request falls back to cached and
+# lexical embeddings, or fails with 504.
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+DEADLINE_FIELD = "deadlineMs"
+MIN_CALL_SECONDS = 0.005     # Not worth starting an Ollama call with less time left
+
+# time.monotonic() by which the current request must be answered
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+def parse_budget(header_value=None, data=None):
+    """Return the request's budget in seconds, or None if it did not set one"""
+    budgets = []
+    for value in (header_value, data.get(DEADLINE_FIELD) if isinstance(data, dict) else None):
+        try:
+            milliseconds = float(value)
+        except (TypeError, ValueError):
+            continue
+        if milliseconds == milliseconds and milliseconds >= 0:   # drop NaN
+            budgets.append(milliseconds / 1000)
+    return min(budgets) if budgets else None
+
+
+@contextmanager
+def request_deadline(budget):
+    """Apply a budget (seconds, or None for no deadline) to the enclosed block"""
+    token = current_deadline.set(time.monotonic() + budget if budget is not None else None)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+@contextmanager
+def no_deadline():
+    """Run work that outlives any one request (e.g. a shared fetch) without a deadline"""
+    token = current_deadline.set(None)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def time_left():
+    """Seconds until the current deadline (possibly negative), or None"""
+    deadline = current_deadline.get()
+    return deadline - time.monotonic() if deadline is not None else None
+
+
+def bounded(timeout):
+    """`timeout` capped by the time left, never negative"""
+    left = time_left()
+    return timeout if left is None else max(0.0, min(timeout, left))
+
+
+def expired():
+    """True once too little time is left to start another call"""
+    left = time_left()
+    return left is not None and left < MIN_CALL_SECONDS
@@ -8,6 +8,8 @@ from functools import lru_cache
 import threading
 import queue
 
+from service_logging import configure_logging, logger, request_log
+
 app = Flask(__name__)
 
 # Ollama API endpoint
@@ -76,20 +78,19 @@ def get_ollama_embedding(text):
                     
                     return embedding
                 else:
-                    print(f"Error from Ollama API (attempt {attempt+1}/{EMBEDDING_RETRY_COUNT}): {response.status_code}")
-                    print(response.text)
+                    logger.warning("Error from Ollama API (attempt %s/%s): %s", attempt+1, EMBEDDING_RETRY_COUNT, response.status_code)
                     if attempt < EMBEDDING_RETRY_COUNT - 1:
                         time.sleep(EMBEDDING_RETRY_DELAY)
             except requests.exceptions.RequestException as e:
-                print(f"Request exception (attempt {attempt+1}/{EMBEDDING_RETRY_COUNT}): {e}")
+                logger.warning("Request exception (attempt %s/%s): %s", attempt+1, EMBEDDING_RETRY_COUNT, e)
                 if attempt < EMBEDDING_RETRY_COUNT - 1:
                     time.sleep(EMBEDDING_RETRY_DELAY)
         
         # If all attempts failed, fall back to simple word matching
-        print(f"All {EMBEDDING_RETRY_COUNT} attempts failed, falling back to simple embedding")
+        logger.error("All %s attempts failed, falling back to simple embedding", EMBEDDING_RETRY_COUNT)
         return simple_text_embedding(text)
     except Exception as e:
-        print(f"Exception in get_ollama_embedding: {e}")
+        logger.exception("Exception in get_ollama_embedding: %s", e)
         # Return a simple embedding as last resort
         return simple_text_embedding(text)
 
@@ -434,6 +435,12 @@ conversation_state = {}
 
 @app.route('/map-response', methods=['POST'])
 def map_response():
+    with request_log('/map-response') as log:
+        response = handle_map_response()
+        log['status'] = response[1] if isinstance(response, tuple) else response.status_code
+        return response
+
+def handle_map_response():
     try:
         data = request.json
         user_message = data['message']
@@ -465,10 +472,10 @@ def map_response():
                 
                 # If confidence is too low, try mapping to a question instead
                 if option_data.get('confidence', 0) < 0.6:
-                    print(f"DEBUG: Option confidence too low ({option_data.get('confidence', 0)}), trying question mapping")
+                    logger.debug("Option confidence too low (%s), trying question mapping", option_data.get('confidence', 0))
                     
                     # Clear the conversation state since we're abandoning this question
-                    print(f"DEBUG: Abandoning question '{prev_state['question']}' due to low option confidence")
+                    logger.debug("Abandoning question '%s' due to low option confidence", prev_state['question'])
                     del conversation_state[conversation_id]
                     
                     # Try mapping to a question
@@ -477,19 +484,19 @@ def map_response():
                     
                     # If question confidence is higher, return that instead
                     if question_data.get('confidence', 0) >= 0.6:
-                        print(f"DEBUG: Found better question match: '{question_data.get('question')}' with confidence {question_data.get('confidence', 0)}")
+                        logger.debug("Found better question match: '%s' with confidence %s", question_data.get('question'), question_data.get('confidence', 0))
                         return question_result
                     else:
-                        print(f"DEBUG: Question confidence also too low ({question_data.get('confidence', 0)})")
+                        logger.debug("Question confidence also too low (%s)", question_data.get('confidence', 0))
                         # Return the question result anyway, as we've abandoned the previous question
                         return question_result
                 
                 # Check if the option matches the question
                 if option_data.get('question') != prev_state['question']:
-                    print(f"DEBUG: Question mismatch - expected '{prev_state['question']}', got '{option_data.get('question')}'")
+                    logger.debug("Question mismatch - expected '%s', got '%s'", prev_state['question'], option_data.get('question'))
                     
                     # Clear the conversation state since we're abandoning this question
-                    print(f"DEBUG: Abandoning question '{prev_state['question']}' due to question mismatch")
+                    logger.debug("Abandoning question '%s' due to question mismatch", prev_state['question'])
                     del conversation_state[conversation_id]
                     
                     # Try mapping to a question instead
@@ -498,7 +505,7 @@ def map_response():
                     
                     # If question confidence is good, return that instead
                     if question_data.get('confidence', 0) >= 0.6:
-                        print(f"DEBUG: Found question match: '{question_data.get('question')}' with confidence {question_data.get('confidence', 0)}")
+                        logger.debug("Found question match: '%s' with confidence %s", question_data.get('question'), question_data.get('confidence', 0))
                         return question_result
                     else:
                         # Return the question result anyway, as we've abandoned the previous question
@@ -509,7 +516,7 @@ def map_response():
                     option_data.get('question') == prev_state['question'] and
                     option_data.get('category') == prev_state['category']):
                     # Clear the state if we have a confident match for the right question
-                    print(f"DEBUG: Good option match, clearing conversation state")
+                    logger.debug("Good option match, clearing conversation state")
                     del conversation_state[conversation_id]
                 
                 return option_result
@@ -517,7 +524,7 @@ def map_response():
                 # Otherwise map to question
                 return map_to_question(user_message, conversation_id)
     except Exception as e:
-        print(f"Error in map_response: {e}")
+        logger.exception("Error in map_response: %s", e)
         return jsonify({
             "success": False,
             "message": f"Error processing request: {str(e)}"
@@ -636,5 +643,11 @@ def map_to_option(user_message, category, question, conversation_id):
         "success": True
     })
 
+# App factory used by WSGI servers (see gunicorn.conf.py)
+def create_app():
+    """Return the Flask app; this service has no shared state to preload"""
+    configure_logging()
+    return app
+
 if __name__ == '__main__':
-    app.run(port=5000)
+    create_app().run(port=5000)
@@ -0,0 +1,107 @@
+import json
+
+import numpy as np
+
+# Request and response bodies, and Ollama embedding payloads.
+#
+# JSON goes through orjson when it is installed (several times faster than the
+# json module, and it serializes NumPy values as-is). A client may instead
+# send and receive MessagePack: a request body with Content-Type
+# application/msgpack is decoded as such, and a response is encoded as
+# MessagePack when the Accept header prefers it. Both codecs are optional;
+# without msgpack every body is JSON.
+#
+# Ollama only answers in JSON. Its embedding arrays are decoded with orjson
+# and converted to float32 in one C-level pass, the dtype the question index
+# and the shared cache store, so no float64 copy is made per embedding.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+MSGPACK_TYPES = (MSGPACK_TYPE, "application/x-msgpack", "application/vnd.msgpack")
+
+
+def _plain(value):
+    """Python equivalent of a NumPy value, for the codecs that need one"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def dumps_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=_plain, separators=(",", ":")).encode("utf-8")
+
+
+def loads_json(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def media_type(content_type):
+    """The bare media type of a Content-Type header, lower-cased"""
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+def prefers_msgpack(accept):
+    """True if the Accept header ranks MessagePack above JSON"""
+    if msgpack is None or not accept:
+        return False
+    msgpack_q = json_q = 0.0
+    for media_range in accept.split(","):
+        kind, _, params = media_range.partition(";")
+        kind = kind.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if kind in MSGPACK_TYPES:
+            msgpack_q = max(msgpack_q, q)
+        elif kind in (JSON_TYPE, "application/*", "*/*"):
+            json_q = max(json_q, q)
+    return msgpack_q > 0 and msgpack_q > json_q
+
+
+def decode_body(body, content_type):
+    """Decode a request body; an empty body decodes to None"""
+    if not body:
+        return None
+    if media_type(content_type) in MSGPACK_TYPES:
+        if msgpack is None:
+            raise ValueError("MessagePack bodies need the msgpack package")
+        return msgpack.unpackb(body)
+    return loads_json(body)
+
+
+def encode_body(payload, accept=None):
+    """Encode a response payload; returns (body bytes, content type)"""
+    if prefers_msgpack(accept):
+        return msgpack.packb(payload, default=_plain), MSGPACK_TYPE
+    return dumps_json(payload), JSON_TYPE
+
+
+def embedding_from_json(body):
+    """float32 vector of an Ollama /api/embeddings response body"""
+    return np.asarray(loads_json(body)["embedding"], dtype=np.float32)
+
+
+def embeddings_from_json(body):
+    """float32 vectors (one row per input) of an Ollama /api/embed response body"""
+    return np.asarray(loads_json(body)["embeddings"], dtype=np.float32)
@@ -0,0 +1,177 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+
+# Structured logging for the semantic services.
+#
+# Records go through a QueueHandler to a listener thread that formats them as
+# one JSON object per line, so a request thread only pays for building the
+# record and a queue put. Each request is summarised in a single "request"
+# record: request_log() collects fields for the duration of the request and
+# code deeper in the call stack adds to it with note(). Successful requests
+# are sampled with LOG_SAMPLE_RATE; errors and slow requests are always kept.
+#
+# Detail that used to be printed on every request is logged at DEBUG with
+# lazy %-style arguments, so at the default INFO level it costs a level check.
+#
+# Every request has a trace id: the caller's X-Request-ID if it sent one,
+# otherwise a generated one. It is added to every record logged while the
+# request is handled and forwarded to Ollama with trace_headers().
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 1.0))     # Share of successful requests logged
+LOG_SLOW_REQUEST_MS = float(os.environ.get("LOG_SLOW_REQUEST_MS", 1000))  # Always log slower requests
+LOG_QUEUE_SIZE = 10000       # Records are dropped rather than block when the queue is full
+TRACE_HEADER = "X-Request-ID"
+MAX_TRACE_ID_LENGTH = 128
+
+logger = logging.getLogger("semantic_service")
+
+# Fields of the request currently being handled on this thread/task
+current_request = contextvars.ContextVar("current_request", default=None)
+# Trace id of the request currently being handled
+current_trace_id = contextvars.ContextVar("current_trace_id", default=None)
+
+_configured_pid = None
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object, merging its `fields`"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        trace_id = getattr(record, "traceId", None)
+        if trace_id is not None:
+            entry["traceId"] = trace_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread"""
+
+    def prepare(self, record):
+        # Runs in the thread that logged, where its request's trace id is set
+        record.traceId = current_trace_id.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def configure_logging(level=LOG_LEVEL, stream=None):
+    """Install the queue handler and start this process's listener thread
+
+    Safe to call repeatedly; after a fork the child gets its own queue and
+    listener, since the parent's thread does not survive the fork.
+    """
+    global _configured_pid, _listener
+    if _configured_pid == os.getpid():
+        return logger
+    _configured_pid = os.getpid()
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    logger.setLevel(level)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    return logger
+
+
+def flush_logging():
+    """Drain queued records (for tests and shutdown)"""
+    global _configured_pid
+    if _listener is not None and _configured_pid == os.getpid():
+        _listener.stop()
+        _configured_pid = None
+        configure_logging(logger.level)
+
+
+def make_trace_id(incoming=None):
+    """Use the caller's trace id if it is a sane header value, else a new one"""
+    if incoming and len(incoming) <= MAX_TRACE_ID_LENGTH and incoming.isascii() and incoming.isprintable():
+        return incoming
+    return os.urandom(8).hex()
+
+
+def trace_headers():
+    """Headers that carry the current trace id to downstream calls"""
+    trace_id = current_trace_id.get()
+    return {TRACE_HEADER: trace_id} if trace_id is not None else None
+
+
+def note(**fields):
+    """Add fields to the current request's record"""
+    request = current_request.get()
+    if request is not None:
+        request.update(fields)
+
+
+@contextmanager
+def collect_fields():
+    """Gather note() fields into a fresh dict without emitting a record
+
+    Used for the items of a batch request, which share one request record.
+    """
+    fields = {}
+    token = current_request.set(fields)
+    try:
+        yield fields
+    finally:
+        current_request.reset(token)
+
+
+@contextmanager
+def request_log(route, trace_id=None, **fields):
+    """Collect fields for one request and emit them as one record at the end
+
+    The caller sets fields["status"]; an exception escaping the block is
+    recorded as status 500. `trace_id` is the caller's trace id, if any;
+    the request's trace id is available as fields["traceId"].
+    """
+    request = dict(fields, route=route, traceId=make_trace_id(trace_id))
+    token = current_request.set(request)
+    trace_token = current_trace_id.set(request["traceId"])
+    start = time.perf_counter()
+    try:
+        yield request
+    except Exception:
+        request.setdefault("status", 500)
+        raise
+    finally:
+        current_request.reset(token)
+        duration_ms = (time.perf_counter() - start) * 1000
+        status = request.get("status", 200)
+        if (status >= 500 or duration_ms >= LOG_SLOW_REQUEST_MS
+                or LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE):
+            request["durationMs"] = round(duration_ms, 3)
+            level = logging.ERROR if status >= 500 else logging.INFO
+            if logger.isEnabledFor(level):
+                logger.log(level, "request", extra={"fields": request})
+        current_trace_id.reset(trace_token)
@@ -0,0 +1,322 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from threading import get_ident
+
+# Minimal Prometheus metrics for the semantic services.
+#
+# Counters, gauges and histograms with labels, rendered in the Prometheus text
+# exposition format by render(). Label children are created once and cached.
+# Counters and histograms keep one shard of values per thread, keyed by thread
+# id, so recording is a dict lookup and an add with no lock; only that thread
+# writes its shard and render() sums them. Thread ids are reused once a thread
+# exits, so the shards stay bounded by the number of live threads. Metrics are per process;
+# with several workers each scrape of /metrics reports the worker that served
+# it (semantic_process_id tells them apart).
+#
+# stage() times one step of a request into semantic_stage_duration_seconds,
+# and into the request's own timings while time_request() is active; those
+# become its Server-Timing header (time_request.server_timing()).
+
+# Seconds; spans cache hits (microseconds) to slow Ollama calls
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        """Return the child for these label values, creating it once"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("shards",)
+
+    def __init__(self):
+        self.shards = {}  # thread id -> [value]
+
+    def inc(self, amount=1):
+        shard = self.shards.get(get_ident())
+        if shard is None:
+            shard = self.shards[get_ident()] = [0.0]
+        shard[0] += amount
+
+    @property
+    def value(self):
+        return sum(shard[0] for shard in list(self.shards.values()))
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{format_labels(labelnames, values)} {self.value:g}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Read the value from `function` at scrape time"""
+        self.function = function
+
+    def render(self, name, labelnames, values):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                return []
+            if value is None:
+                return []
+        return [f"{name}{format_labels(labelnames, values)} {value:g}"]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "shards")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.shards = {}  # thread id -> [count per bucket..., +Inf count, sum]
+
+    def observe(self, value):
+        shard = self.shards.get(get_ident())
+        if shard is None:
+            shard = self.shards[get_ident()] = [0] * (len(self.buckets) + 1) + [0.0]
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def render(self, name, labelnames, values):
+        totals = [0] * (len(self.buckets) + 2)
+        for shard in list(self.shards.values()):
+            for i, value in enumerate(list(shard)):
+                totals[i] += value
+        counts, total = totals[:-1], totals[-1]
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f"{name}_bucket{format_labels(labelnames, values, [('le', le)])} {cumulative}")
+        label_text = format_labels(labelnames, values)
+        lines.append(f"{name}_sum{label_text} {total:g}")
+        lines.append(f"{name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+def render():
+    """Return every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Metrics shared by the services
+REQUEST_SECONDS = Histogram("semantic_request_duration_seconds", "Time to handle a request",
+                            ["route"])
+REQUESTS = Counter("semantic_requests_total", "Requests handled", ["route", "status"])
+STAGE_SECONDS = Histogram("semantic_stage_duration_seconds", "Time spent in each stage of a request",
+                          ["stage"])
+EMBEDDING_CACHE = Counter("semantic_embedding_cache_lookups_total", "Embedding cache lookups",
+                          ["tier", "result"])
+OLLAMA_REQUESTS = Counter("semantic_ollama_requests_total", "Calls to the Ollama API",
+                          ["endpoint", "outcome"])
+OLLAMA_RETRIES = Counter("semantic_ollama_retries_total", "Ollama calls retried after a failure")
+OLLAMA_RETRIES_DENIED = Counter("semantic_ollama_retries_denied_total",
+                                "Ollama retries skipped because the retry budget was spent")
+OLLAMA_ATTEMPT_TIMEOUT = Gauge("semantic_ollama_attempt_timeout_seconds",
+                               "Current per-attempt timeout of embedding calls")
+EMBEDDING_FALLBACKS = Counter("semantic_embedding_fallbacks_total",
+                              "Embeddings computed by the lexical fallback after Ollama failed")
+MAPPINGS = Counter("semantic_mappings_total", "Mapping results", ["mapping_type"])
+ABANDONED_QUESTIONS = Counter("semantic_abandoned_questions_total",
+                              "Pending questions abandoned by auto mode", ["reason"])
+LIVE_SESSIONS = Gauge("semantic_live_sessions", "Conversations with a pending question")
+CACHE_ENTRIES = Gauge("semantic_embedding_cache_entries", "Embeddings held per cache tier", ["tier"])
+ADMISSION_WAIT = Histogram("semantic_admission_wait_seconds", "Time requests waited for admission",
+                           ["lane"])
+ADMISSION_SHED = Counter("semantic_admission_shed_total", "Requests not admitted", ["lane", "reason"])
+DEGRADED_RESPONSES = Counter("semantic_degraded_responses_total",
+                             "Shed requests answered from cached and lexical embeddings")
+ADMISSION_IN_FLIGHT = Gauge("semantic_admission_in_flight", "Requests being mapped")
+ADMISSION_QUEUED = Gauge("semantic_admission_queued", "Requests waiting for admission", ["lane"])
+OLLAMA_QUEUE_WAIT = Histogram("semantic_ollama_queue_wait_seconds", "Time Ollama calls waited for a slot",
+                              ["work_class"])
+OLLAMA_CALL_SECONDS = Histogram("semantic_ollama_call_duration_seconds", "Time Ollama calls held a slot",
+                                ["work_class"])
+OLLAMA_IN_FLIGHT = Gauge("semantic_ollama_in_flight", "Ollama calls in progress", ["work_class"])
+OLLAMA_QUEUED = Gauge("semantic_ollama_queued", "Ollama calls waiting for a slot", ["work_class"])
+OLLAMA_INSTANCE_SECONDS = Histogram("semantic_ollama_instance_duration_seconds",
+                                    "Latency of answered calls per Ollama instance", ["instance"])
+OLLAMA_INSTANCE_OUTSTANDING = Gauge("semantic_ollama_instance_outstanding",
+                                    "Calls in progress per Ollama instance", ["instance"])
+OLLAMA_INSTANCE_UP = Gauge("semantic_ollama_instance_up", "1 while an Ollama instance is in the pool",
+                           ["instance"])
+OLLAMA_EJECTIONS = Counter("semantic_ollama_ejections_total", "Ollama instances ejected from the pool",
+                           ["instance"])
+OLLAMA_HEDGES = Counter("semantic_ollama_hedges_total", "Embedding calls past the hedge delay, by outcome",
+                        ["outcome"])
+OLLAMA_COLD_LOADS = Counter("semantic_ollama_cold_loads_total",
+                            "Ollama calls that waited for a model load, by instance and caller",
+                            ["instance", "caller"])
+OLLAMA_COLD_LOAD_SECONDS = Histogram("semantic_ollama_cold_load_seconds", "Duration of calls that waited for a model load",
+                                     ["instance"])
+OLLAMA_KEEP_WARM_PINGS = Counter("semantic_ollama_keep_warm_pings_total", "Keep-warm pings to idle Ollama instances",
+                                 ["instance", "outcome"])
+NEAR_DUPLICATE_AUDITS = Counter("semantic_near_duplicate_audits_total",
+                                "Reused near-duplicate embeddings checked against the true one, by outcome",
+                                ["outcome"])
+PROCESS_ID = Gauge("semantic_process_id", "PID of the worker process serving this scrape")
+PROCESS_ID.set_function(os.getpid)
+
+
+# {stage: [seconds, count]} of the request being handled, see time_request()
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+_stage_children = {}
+
+
+class stage:
+    """Time a block into semantic_stage_duration_seconds{stage=...}"""
+
+    __slots__ = ("name", "histogram", "start")
+
+    def __init__(self, name):
+        histogram = _stage_children.get(name)
+        if histogram is None:
+            histogram = _stage_children[name] = STAGE_SECONDS.labels(name)
+        self.name = name
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        timings = request_timings.get()
+        if timings is not None:
+            timing = timings.get(self.name)
+            if timing is None:
+                timings[self.name] = [elapsed, 1]
+            else:
+                timing[0] += elapsed
+                timing[1] += 1
+        histogram = self.histogram
+        shard = histogram.shards.get(get_ident())
+        if shard is None:
+            return histogram.observe(elapsed)
+        shard[bisect.bisect_left(histogram.buckets, elapsed)] += 1
+        shard[-1] += elapsed
+
+
+class time_request:
+    """Collect the stage times of one request; `timings` maps stage -> [seconds, count]"""
+
+    __slots__ = ("timings", "start", "token")
+
+    def __enter__(self):
+        self.timings = {}
+        self.token = request_timings.set(self.timings)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        request_timings.reset(self.token)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def as_dict(self):
+        """Milliseconds per stage plus the total so far, for debug responses"""
+        stages = {name: {"ms": round(seconds * 1000, 3), "count": count}
+                  for name, (seconds, count) in self.timings.items()}
+        return {"stages": stages, "totalMs": round(self.elapsed() * 1000, 3)}
+
+    def server_timing(self):
+        """Server-Timing header value: one metric per stage, then the total"""
+        entries = []
+        for name, (seconds, count) in self.timings.items():
+            entry = f"{name};dur={seconds * 1000:.3f}"
+            if count > 1:
+                entry += f';desc="{count} calls"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.elapsed() * 1000:.3f}")
+        return ", ".join(entries)
@@ -0,0 +1,269 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+
+# Embedding cache shared by all worker processes of a pre-forked service.
+#
+# The cache lives in one shared memory mapping created before fork:
+#
+#   keys     (capacity, 2) uint64   128-bit blake2b digest of the cache key
+#   seqs     (capacity,)   uint64   per-slot sequence number (odd while writing)
+#   states   (capacity,)   uint8    EMPTY / PENDING / READY
+#   claimed  (capacity,)   float64  time a PENDING slot was claimed
+#   vectors  (capacity, dim) float32
+#
+# Slots are found by open addressing with linear probing. Reads take no locks:
+# a reader copies the vector and retries if the slot's sequence number changed
+# while it was reading. Writers serialise per slot with an fcntl byte-range lock
+# on the backing file (released by the kernel if a worker dies) plus a striped
+# thread lock, because fcntl locks do not exclude threads of the same process.
+#
+# A worker that misses claims the slot as PENDING before calling Ollama, so
+# concurrent workers wait for its result instead of embedding the text again.
+
+EMPTY = 0
+PENDING = 1
+READY = 2
+
+MAX_PROBE = 32               # Slots inspected before giving up / evicting
+PENDING_STALE_SECONDS = 60   # A PENDING claim older than this can be taken over
+THREAD_LOCK_STRIPES = 64
+
+
+def key_digest(cache_key):
+    """Return the two uint64 words identifying a cache key"""
+    digest = hashlib.blake2b(cache_key.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+
+
+class SharedEmbeddingCache:
+    """Fixed-capacity embedding cache in memory shared across forked processes"""
+
+    def __init__(self, capacity, dim):
+        self.capacity = 1 << max(1, int(capacity - 1).bit_length())  # Power of two for masking
+        self.mask = self.capacity - 1
+        self.dim = dim
+
+        sizes = [
+            ("keys", np.uint64, (self.capacity, 2)),
+            ("seqs", np.uint64, (self.capacity,)),
+            ("claimed", np.float64, (self.capacity,)),
+            ("states", np.uint8, (self.capacity,)),
+            ("vectors", np.float32, (self.capacity, dim)),
+        ]
+        total = 0
+        layout = []
+        for name, dtype, shape in sizes:
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            layout.append((name, dtype, shape, total))
+            total += (nbytes + 63) // 64 * 64  # Keep every array cache-line aligned
+
+        # An unlinked file in /dev/shm (when available) gives us both a shared
+        # mapping and a file descriptor for byte-range locks; both are inherited
+        # by forked workers
+        shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        self._file = tempfile.TemporaryFile(prefix="embedding-cache-", dir=shm_dir)
+        self._file.truncate(total)
+        self._fd = self._file.fileno()
+        self._map = mmap.mmap(self._fd, total, mmap.MAP_SHARED)
+        for name, dtype, shape, offset in layout:
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=self._map, offset=offset))
+
+        self._thread_locks = [threading.Lock() for _ in range(THREAD_LOCK_STRIPES)]
+        # Per-process counters
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def _probe(self, hi):
+        start = hi & self.mask
+        for step in range(MAX_PROBE):
+            yield (start + step) & self.mask
+
+    def _lock(self, slot):
+        thread_lock = self._thread_locks[slot % THREAD_LOCK_STRIPES]
+        thread_lock.acquire()
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, slot)
+        return thread_lock
+
+    def _unlock(self, slot, thread_lock):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, slot)
+        thread_lock.release()
+
+    def _find(self, hi, lo):
+        """Return (slot, state) for the key, or (None, EMPTY) if absent"""
+        for slot in self._probe(hi):
+            state = self.states[slot]
+            if state == EMPTY:
+                return None, EMPTY
+            if self.keys[slot, 0] == hi and self.keys[slot, 1] == lo:
+                return slot, state
+        return None, EMPTY
+
+    def _read(self, slot, hi, lo):
+        """Seqlock read of a READY slot; returns a private copy or None"""
+        for _ in range(8):
+            seq = int(self.seqs[slot])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            if self.states[slot] != READY or self.keys[slot, 0] != hi or self.keys[slot, 1] != lo:
+                return None
+            vector = self.vectors[slot].copy()
+            if int(self.seqs[slot]) == seq:
+                return vector
+        return None
+
+    def __contains__(self, cache_key):
+        """Whether the key is cached (not only claimed); counts no lookup"""
+        return self._find(*key_digest(cache_key))[1] == READY
+
+    def get(self, cache_key, count_miss=True):
+        """Return the cached embedding for `cache_key`, or None
+
+        Pass count_miss=False when a miss is followed by claim(), which
+        counts it.
+        """
+        hi, lo = key_digest(cache_key)
+        slot, state = self._find(hi, lo)
+        vector = self._read(slot, hi, lo) if state == READY else None
+        if vector is not None:
+            self.hits += 1
+        elif count_miss:
+            self.misses += 1
+        return vector
+
+    def claim(self, cache_key):
+        """Reserve the key for this process to compute
+
+        Returns (True, None) if the caller should compute and put() the
+        embedding, (False, vector) if it is already cached and (False, None)
+        if another worker is computing it right now.
+        """
+        claimed, vector = self._reserve(*key_digest(cache_key))
+        if claimed:
+            self.misses += 1
+        elif vector is not None:
+            self.hits += 1
+        return claimed, vector
+
+    def _reserve(self, hi, lo):
+        victim = None
+        for slot in self._probe(hi):
+            thread_lock = self._lock(slot)
+            try:
+                state = self.states[slot]
+                same_key = self.keys[slot, 0] == hi and self.keys[slot, 1] == lo
+                if state == EMPTY or (same_key and state == PENDING
+                                      and time.time() - self.claimed[slot] > PENDING_STALE_SECONDS):
+                    self._write_header(slot, hi, lo, PENDING)
+                    return True, None
+                if same_key:
+                    if state == READY:
+                        return False, self._read(slot, hi, lo)
+                    return False, None
+                if victim is None and state == READY:
+                    victim = slot
+            finally:
+                self._unlock(slot, thread_lock)
+
+        # Probe window is full: evict the first ready entry we passed
+        if victim is not None:
+            thread_lock = self._lock(victim)
+            try:
+                if self.states[victim] == READY:
+                    self._write_header(victim, hi, lo, PENDING)
+                    return True, None
+            finally:
+                self._unlock(victim, thread_lock)
+        return False, None
+
+    def _write_header(self, slot, hi, lo, state):
+        self.seqs[slot] += 1
+        self.keys[slot, 0] = hi
+        self.keys[slot, 1] = lo
+        self.claimed[slot] = time.time()
+        self.states[slot] = state
+        self.seqs[slot] += 1
+
+    def put(self, cache_key, vector):
+        """Store an embedding; returns False if it cannot be stored"""
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.shape != (self.dim,):
+            self.release(cache_key)
+            return False
+
+        hi, lo = key_digest(cache_key)
+        slot, state = self._find(hi, lo)
+        if slot is None:
+            claimed, _ = self._reserve(hi, lo)
+            if not claimed:
+                return False
+            slot, state = self._find(hi, lo)
+            if slot is None:
+                return False
+
+        thread_lock = self._lock(slot)
+        try:
+            if self.keys[slot, 0] != hi or self.keys[slot, 1] != lo:
+                return False
+            self.seqs[slot] += 1
+            self.vectors[slot] = vector
+            self.states[slot] = READY
+            self.seqs[slot] += 1
+        finally:
+            self._unlock(slot, thread_lock)
+        return True
+
+    def release(self, cache_key):
+        """Give up a PENDING claim (e.g. the Ollama call failed)"""
+        hi, lo = key_digest(cache_key)
+        slot, state = self._find(hi, lo)
+        if slot is None or state != PENDING:
+            return
+        thread_lock = self._lock(slot)
+        try:
+            if self.states[slot] == PENDING and self.keys[slot, 0] == hi and self.keys[slot, 1] == lo:
+                # Backdate the claim so the next caller takes it over at once
+                # (the slot cannot go back to EMPTY without breaking probe chains)
+                self.claimed[slot] = 0.0
+        finally:
+            self._unlock(slot, thread_lock)
+
+    def wait(self, cache_key, timeout):
+        """Poll for an embedding another worker is computing"""
+        self.waits += 1
+        deadline = time.monotonic() + timeout
+        hi, lo = key_digest(cache_key)
+        delay = 0.002
+        while time.monotonic() < deadline:
+            slot, state = self._find(hi, lo)
+            if state == READY:
+                vector = self._read(slot, hi, lo)
+                if vector is not None:
+                    self.hits += 1
+                    return vector
+            elif state != PENDING or time.time() - self.claimed[slot] > PENDING_STALE_SECONDS:
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        self.misses += 1
+        return None
+
+    def stats(self):
+        """Return shared occupancy and this process's hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "capacity": self.capacity,
+            "entries": int(np.count_nonzero(self.states == READY)),
+            "bytes": len(self._map),
+            "hits": self.hits,
+            "misses": self.misses,
+            "waits": self.waits,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+        }
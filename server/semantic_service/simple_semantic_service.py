@@ -2,6 +2,8 @@ from flask import Flask, request, jsonify
 import random
 import re
 
+from service_logging import configure_logging, logger, request_log
+
 app = Flask(__name__)
 
 # Predefined questions and options from PHQ-9, BDI, HDRS
@@ -323,36 +325,44 @@ keywords = {
 
 @app.route('/map-response', methods=['POST'])
 def map_response():
+    with request_log('/map-response') as log:
+        response = handle_map_response()
+        log['status'] = response[1] if isinstance(response, tuple) else response.status_code
+        return response
+
+def handle_map_response():
     try:
         data = request.json
         user_message = data['message']
         conversation_id = data.get('conversationId', 'default')
         mapping_type = data.get('mappingType', 'auto')
         
-        print(f"DEBUG: Received request - message: '{user_message}', type: '{mapping_type}', conversation: '{conversation_id}'")
+        logger.debug("Received request - message: '%s', type: '%s', conversation: '%s'",
+                     user_message, mapping_type, conversation_id)
         
         # If we have a specific mapping type request
         if mapping_type == 'question':
-            print(f"DEBUG: Explicitly mapping to question")
+            logger.debug("Explicitly mapping to question")
             return map_to_question(user_message, conversation_id)
         elif mapping_type == 'option':
             # We need the category to map to options
             category = data.get('category')
             question = data.get('question')
             if not category or not question:
-                print(f"DEBUG: Missing category or question for option mapping")
+                logger.debug("Missing category or question for option mapping")
                 return jsonify({
                     "success": False,
                     "message": "Category and question are required for option mapping"
                 }), 400
-            print(f"DEBUG: Explicitly mapping to option for {category}/{question}")
+            logger.debug("Explicitly mapping to option for %s/%s", category, question)
             return map_to_option(user_message, category, question, conversation_id)
         else:
             # Auto-detect if we should map to a question or an option
             if conversation_id in conversation_state:
                 # If we have a previous question for this conversation, try to map to option
                 prev_state = conversation_state[conversation_id]
-                print(f"DEBUG: Found previous state - question: '{prev_state['question']}', category: '{prev_state['category']}'")
+                logger.debug("Found previous state - question: '%s', category: '%s'",
+                             prev_state['question'], prev_state['category'])
                 
                 # First try to map to an option for the exact question
                 option_result = map_to_option(user_message, prev_state['category'], prev_state['question'], conversation_id)
@@ -360,10 +370,10 @@ def map_response():
                 
                 # If confidence is too low, try mapping to a question instead
                 if option_data.get('confidence', 0) < 0.45:
-                    print(f"DEBUG: Option confidence too low ({option_data.get('confidence', 0)}), trying question mapping")
+                    logger.debug("Option confidence too low (%s), trying question mapping", option_data.get('confidence', 0))
                     
                     # Clear the conversation state since we're abandoning this question
-                    print(f"DEBUG: Abandoning question '{prev_state['question']}' due to low option confidence")
+                    logger.debug("Abandoning question '%s' due to low option confidence", prev_state['question'])
                     del conversation_state[conversation_id]
                     
                     # Try mapping to a question
@@ -372,19 +382,21 @@ def map_response():
                     
                     # If question confidence is higher, return that instead
                     if question_data.get('confidence', 0) >= 0.45:
-                        print(f"DEBUG: Found better question match: '{question_data.get('question')}' with confidence {question_data.get('confidence', 0)}")
+                        logger.debug("Found better question match: '%s' with confidence %s",
+                                     question_data.get('question'), question_data.get('confidence', 0))
                         return question_result
                     else:
-                        print(f"DEBUG: Question confidence also too low ({question_data.get('confidence', 0)})")
+                        logger.debug("Question confidence also too low (%s)", question_data.get('confidence', 0))
                         # Return the question result anyway, as we've abandoned the previous question
                         return question_result
                 
                 # Check if the option matches the question
                 if option_data.get('question') != prev_state['question']:
-                    print(f"DEBUG: Question mismatch - expected '{prev_state['question']}', got '{option_data.get('question')}'")
+                    logger.debug("Question mismatch - expected '%s', got '%s'",
+                                 prev_state['question'], option_data.get('question'))
                     
                     # Clear the conversation state since we're abandoning this question
-                    print(f"DEBUG: Abandoning question '{prev_state['question']}' due to question mismatch")
+                    logger.debug("Abandoning question '%s' due to question mismatch", prev_state['question'])
                     del conversation_state[conversation_id]
                     
                     # Try mapping to a question instead
@@ -393,7 +405,8 @@ def map_response():
                     
                     # If question confidence is good, return that instead
                     if question_data.get('confidence', 0) >= 0.45:
-                        print(f"DEBUG: Found question match: '{question_data.get('question')}' with confidence {question_data.get('confidence', 0)}")
+                        logger.debug("Found question match: '%s' with confidence %s",
+                                     question_data.get('question'), question_data.get('confidence', 0))
                         return question_result
                     else:
                         # Return the question result anyway, as we've abandoned the previous question
@@ -404,16 +417,16 @@ def map_response():
                     option_data.get('question') == prev_state['question'] and
                     option_data.get('category') == prev_state['category']):
                     # Clear the state if we have a confident match for the right question
-                    print(f"DEBUG: Good option match, clearing conversation state")
+                    logger.debug("Good option match, clearing conversation state")
                     del conversation_state[conversation_id]
                 
                 return option_result
             else:
                 # Otherwise map to question
-                print(f"DEBUG: No previous state, mapping to question")
+                logger.debug("No previous state, mapping to question")
                 return map_to_question(user_message, conversation_id)
     except Exception as e:
-        print(f"Error in map_response: {e}")
+        logger.exception("Error in map_response: %s", e)
         return jsonify({
             "success": False,
             "message": f"Error processing request: {str(e)}"
@@ -474,13 +487,13 @@ def map_to_option(user_message, category, question, conversation_id):
     """Map user message to an option using simple pattern matching"""
     user_message = user_message.lower()
     
-    print(f"DEBUG: Mapping option for question: '{question}' in category: '{category}'")
+    logger.debug("Mapping option for question: '%s' in category: '%s'", question, category)
     
     # Get the appropriate options for this category and question
     if category == "PHQ-9":
         # PHQ-9 has the same options for all questions
         question_options = options_data.get(category, default_options)
-        print(f"DEBUG: Using PHQ-9 standard options")
+        logger.debug("Using PHQ-9 standard options")
     elif category in ["BDI", "HDRS"]:
         # BDI and HDRS have different options for each question
         category_options = options_data.get(category, {})
@@ -488,16 +501,16 @@ def map_to_option(user_message, category, question, conversation_id):
         # Try to get options for this specific question with exact match
         if question in category_options:
             question_options = category_options[question]
-            print(f"DEBUG: Found exact match for question '{question}'")
+            logger.debug("Found exact match for question '%s'", question)
         else:
             # If not found, try to find the closest match
-            print(f"DEBUG: No exact match for '{question}', searching for closest match")
+            logger.debug("No exact match for '%s', searching for closest match", question)
             best_match = None
             best_score = 0
             
             for q in category_options:
                 # Print all available questions for debugging
-                print(f"DEBUG: Comparing with question: '{q}'")
+                logger.debug("Comparing with question: '%s'", q)
                 
                 # Calculate word overlap similarity
                 q_words = set(q.lower().split())
@@ -507,27 +520,27 @@ def map_to_option(user_message, category, question, conversation_id):
                 # Calculate Jaccard similarity
                 if len(q_words.union(question_words)) > 0:
                     similarity = len(common_words) / len(q_words.union(question_words))
-                    print(f"DEBUG: Similarity with '{q}': {similarity:.4f}")
+                    logger.debug("Similarity with '%s': %.4f", q, similarity)
                     
                     if similarity > best_score:
                         best_score = similarity
                         best_match = q
             
             if best_match and best_score > 0.3:  # Require at least 30% similarity
-                print(f"DEBUG: Best match found: '{best_match}' with score {best_score:.4f}")
+                logger.debug("Best match found: '%s' with score %.4f", best_match, best_score)
                 question_options = category_options[best_match]
                 # Update the question to the matched one for consistency
                 question = best_match
             else:
-                print(f"DEBUG: No good match found for question '{question}', using default options")
+                logger.debug("No good match found for question '%s', using default options", question)
                 question_options = default_options
     else:
         # Fallback to default options
         question_options = default_options
-        print(f"DEBUG: Unknown category '{category}', using default options")
+        logger.debug("Unknown category '%s', using default options", category)
     
     # Print the options we're using
-    print(f"DEBUG: Using options: {question_options}")
+    logger.debug("Using options: %s", question_options)
     
     # Look for direct mentions of the options
     best_match_idx = -1
@@ -598,8 +611,15 @@ def map_to_option(user_message, category, question, conversation_id):
         "success": True
     })
 
+# App factory used by WSGI servers (see gunicorn.conf.py)
+def create_app():
+    """Return the Flask app; this service has no shared state to preload"""
+    configure_logging()
+    return app
+
 if __name__ == '__main__':
-    print("Starting simple semantic service (no Ollama required)...")
-    print("This service uses basic keyword matching instead of embeddings.")
-    print("Running on http://localhost:5000")
-    app.run(port=5000)
\ No newline at end of file
+    configure_logging()
+    logger.info("Starting simple semantic service (no Ollama required)...")
+    logger.info("This service uses basic keyword matching instead of embeddings.")
+    logger.info("Running on http://localhost:5000")
+    create_app().run(port=5000)
\ No newline at end of file
@@ -0,0 +1,361 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import numpy as np
+
+from conversation_store import ConversationStateStore, encode_state, decode_state
+
+# Write-ahead journal and snapshot for the in-memory conversation state.
+#
+# Every set() and pop() appends one small binary record to `journal` with a
+# single write() on an O_APPEND descriptor, so records from several worker
+# processes interleave whole. Records hold the wall-clock expiry rather than
+# the monotonic one so they stay meaningful across restarts:
+#
+#   op (B)  expires (I, unix seconds)  key length (H)  value length (H)  key  value
+#
+# When the journal grows past a size limit, one process rotates it to
+# `journal.1` under an exclusive lock and merges `snapshot` + `journal.1` into
+# a new snapshot in a background thread. The snapshot is columnar:
+#
+#   header (magic, sessions, key width, state width)
+#   keys S<key width>[sessions], sorted  expires uint32[sessions]
+#   encoded states V<state width>[sessions]
+#
+# Recovery maps these columns straight into NumPy arrays as a "restored" tier,
+# looked up by binary search on the sorted keys, and parses only the short
+# journal tail record by record. A restored session moves into the regular store on first access, so
+# boot time does not depend on per-session Python work.
+#
+# Replaying a journal that has already been merged is harmless because records
+# are absolute sets and deletes.
+#
+# The store's TTL slides on every read, so a read journals the new expiry as a
+# fresh set once it has moved more than REFRESH_FRACTION of the TTL past the
+# journaled one; a restored session may expire that much early, but a busy
+# conversation costs a write per few minutes rather than one per read. LRU
+# evictions are journaled as deletes so evicted sessions stay gone after a
+# restart, and purge_expired() should run periodically to sweep both tiers.
+#
+# Writers hold a shared flock on `journal.lock` while appending; rotation holds
+# it exclusively. A generation counter in the mapped lock file tells writers
+# of other processes to reopen the journal after a rotation.
+
+OP_SET = 1
+OP_DEL = 2
+RECORD_HEADER = struct.Struct("<BIHH")
+SNAPSHOT_MAGIC = b"CSNAP003"
+SNAPSHOT_HEADER = struct.Struct("<8sQQQ")
+COMPACT_BYTES = 2 * 1024 * 1024   # Journal size that triggers a snapshot (bounds replay time)
+REFRESH_FRACTION = 0.1            # Journal a read's new expiry once it moved this much of the TTL
+
+
+def find_rows(keys, conversation_ids):
+    """Rows of the sorted snapshot `keys` holding the given ids"""
+    wanted = np.array([c.encode("utf-8") for c in conversation_ids], dtype=bytes)
+    rows = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    return rows[keys[rows] == wanted]
+
+
+class StateJournal:
+    """Append-only journal plus compacted snapshot in one directory"""
+
+    def __init__(self, directory, compact_bytes=COMPACT_BYTES):
+        self.directory = directory
+        self.compact_bytes = compact_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.journal_path = os.path.join(directory, "journal")
+        self.rotated_path = os.path.join(directory, "journal.1")
+        self.snapshot_path = os.path.join(directory, "snapshot")
+        self.lock_path = os.path.join(directory, "journal.lock")
+        self._pid = None
+        self._open_lock = threading.Lock()
+        # flock() does not exclude threads sharing a descriptor, so appends and
+        # rotation within this process also take a thread lock
+        self._write_lock = threading.Lock()
+        self._compacting = threading.Lock()
+        self.records = 0
+        self.compactions = 0
+        self.last_recovery_seconds = None
+
+    def _open(self):
+        # flock() belongs to the open file description, so each process opens
+        # its own descriptors instead of using ones inherited across fork
+        with self._open_lock:
+            if self._pid == os.getpid():
+                return
+            self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(self._lock_fd).st_size < 8:
+                os.ftruncate(self._lock_fd, 8)
+            self._generation = np.ndarray((1,), dtype=np.uint64,
+                                          buffer=mmap.mmap(self._lock_fd, 8, mmap.MAP_SHARED))
+            self._open_journal()
+            self._pid = os.getpid()
+
+    def _open_journal(self):
+        self._journal_fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self._journal_generation = int(self._generation[0])
+
+    def append(self, op, conversation_id, expires, value=b""):
+        key = conversation_id.encode("utf-8")
+        if "\0" in conversation_id or len(key) > 0xFFFF or len(value) > 0xFFFF:
+            return  # Not representable; the entry just won't survive a restart
+        record = RECORD_HEADER.pack(op, int(expires), len(key), len(value)) + key + value
+        if self._pid != os.getpid():
+            self._open()
+        with self._write_lock:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_SH)
+            try:
+                if self._journal_generation != self._generation[0]:
+                    os.close(self._journal_fd)
+                    self._open_journal()
+                os.write(self._journal_fd, record)
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            self.records += 1
+            check = self.records % 1024 == 0
+        if check:
+            self.maybe_compact()
+
+    def maybe_compact(self):
+        """Start a background snapshot if the journal has grown large"""
+        self._open()
+        try:
+            size = os.fstat(self._journal_fd).st_size
+        except OSError:
+            return
+        if size >= self.compact_bytes and not self._compacting.locked():
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        """Rotate the journal and merge it into a new snapshot"""
+        with self._compacting:
+            self._open()
+            compact_fd = os.open(self.lock_path + ".compact", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                # Only one process compacts at a time
+                fcntl.flock(compact_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(compact_fd)
+                return
+            try:
+                if not os.path.exists(self.rotated_path):
+                    with self._write_lock:
+                        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+                        try:
+                            os.rename(self.journal_path, self.rotated_path)
+                            self._generation[0] += 1
+                            os.close(self._journal_fd)
+                            self._open_journal()
+                        finally:
+                            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                self.merge(self.read_snapshot(), self.replay(self.rotated_path))
+                os.unlink(self.rotated_path)
+                self.compactions += 1
+            finally:
+                fcntl.flock(compact_fd, fcntl.LOCK_UN)
+                os.close(compact_fd)
+
+    def read_snapshot(self):
+        """Return (keys, expires, states) columns of the snapshot"""
+        empty = (np.zeros(0, "S1"), np.zeros(0, np.uint32), np.zeros(0, "V1"))
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return empty
+        magic, count, key_width, state_width = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or count == 0:
+            return empty
+        offset = SNAPSHOT_HEADER.size
+        keys = np.frombuffer(data, dtype=f"S{key_width}", count=count, offset=offset)
+        offset += key_width * count
+        expires = np.frombuffer(data, dtype=np.uint32, count=count, offset=offset)
+        offset += 4 * count
+        states = np.frombuffer(data, dtype=f"V{state_width}", count=count, offset=offset)
+        return keys, expires, states
+
+    def merge(self, snapshot, records):
+        """Write a new snapshot from the old one plus journal records"""
+        keys, expires, states = snapshot
+        alive = expires > time.time()
+        if records and len(keys):
+            alive[find_rows(keys, list(records))] = False
+        now = time.time()
+        added = [(key.encode("utf-8"), record_expires, value)
+                 for key, (record_expires, value) in records.items()
+                 if value is not None and record_expires > now]
+        if added:
+            new_keys, new_expires, new_states = zip(*added)
+            width = max(states.dtype.itemsize if len(states) else 0, max(map(len, new_states)))
+            keys = np.concatenate([keys[alive], np.array(new_keys, dtype=bytes)])
+            expires = np.concatenate([expires[alive], np.array(new_expires, dtype=np.uint32)])
+            states = np.concatenate([states[alive].astype(f"V{width}"),
+                                     np.array(new_states, dtype=f"V{width}")])
+        else:
+            keys, expires, states = keys[alive], expires[alive], states[alive]
+        self.write_snapshot(keys, expires, states)
+
+    def write_snapshot(self, keys, expires, states):
+        """Atomically replace the snapshot, sorting rows by key"""
+        keys = np.asarray(keys, dtype=bytes)
+        order = np.argsort(keys, kind="stable")
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(keys), keys.dtype.itemsize, states.dtype.itemsize))
+            f.write(keys[order].tobytes())
+            f.write(np.asarray(expires, dtype=np.uint32)[order].tobytes())
+            f.write(states[order].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+    @staticmethod
+    def replay(path, records=None):
+        """Return {conversation_id: (expires, encoded state or None)} of one journal"""
+        records = {} if records is None else records
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return records
+        offset, end, header = 0, len(data), RECORD_HEADER.size
+        while offset + header <= end:
+            op, expires, key_length, value_length = RECORD_HEADER.unpack_from(data, offset)
+            offset += header
+            if offset + key_length + value_length > end:
+                break  # Torn final record from a crash mid-write
+            key = data[offset:offset + key_length].decode("utf-8")
+            offset += key_length
+            # Re-insert so the dict stays in write order
+            records.pop(key, None)
+            records[key] = (expires, data[offset:offset + value_length] if op == OP_SET else None)
+            offset += value_length
+        return records
+
+    def recover(self):
+        """Return the snapshot columns and the journal records written after it"""
+        start = time.perf_counter()
+        snapshot = self.read_snapshot()
+        records = self.replay(self.journal_path, self.replay(self.rotated_path))
+        self.last_recovery_seconds = time.perf_counter() - start
+        return snapshot, records
+
+
+class JournaledStateStore(ConversationStateStore):
+    """In-memory conversation state that survives restarts via a journal"""
+
+    def __init__(self, directory, max_entries=100000, ttl=3600, shards=16, compact_bytes=COMPACT_BYTES):
+        super().__init__(max_entries=max_entries, ttl=ttl, shards=shards)
+        self.journal = StateJournal(directory, compact_bytes=compact_bytes)
+        self._restored_lock = threading.Lock()
+        # conversation id -> wall-clock expiry last journaled for it
+        self._journaled = {}
+        self.refreshes = 0
+        self.recover()
+
+    def recover(self):
+        """Load state from disk; returns the number of sessions restored"""
+        start = time.perf_counter()
+        (keys, expires, states), records = self.journal.recover()
+        wall = time.time()
+        self._restored_keys = keys
+        self._restored_expires = expires
+        self._restored_states = states
+        self._restored_live = expires > wall
+        if records and len(keys):
+            self._restored_live[find_rows(keys, list(records))] = False
+        # Journal records newer than the snapshot, still encoded
+        self._restored_tail = {conversation_id: entry for conversation_id, entry in records.items()
+                               if entry[1] is not None and entry[0] > wall}
+        self._restored_count = int(np.count_nonzero(self._restored_live)) + len(self._restored_tail)
+        self.journal.last_recovery_seconds = time.perf_counter() - start
+        return len(self)
+
+    def _take_restored(self, conversation_id):
+        """Move a restored session into the regular store"""
+        with self._restored_lock:
+            entry = self._restored_tail.pop(conversation_id, None)
+            if entry is not None:
+                self._restored_count -= 1
+        if entry is not None:
+            expires, value = entry
+        else:
+            keys = self._restored_keys
+            key = conversation_id.encode("utf-8")
+            row = int(np.searchsorted(keys, key))
+            with self._restored_lock:
+                if row == len(keys) or keys[row] != key or not self._restored_live[row]:
+                    return
+                self._restored_live[row] = False
+                self._restored_count -= 1
+            expires, value = self._restored_expires[row], self._restored_states[row].tobytes()
+        if expires > time.time():
+            self._journaled[conversation_id] = int(expires)
+            ConversationStateStore.set(self, conversation_id, decode_state(value))
+
+    def get(self, conversation_id, default=None):
+        if self._restored_count:
+            self._take_restored(conversation_id)
+        state = super().get(conversation_id, None)
+        if state is None:
+            return default
+        # The read slid the expiry; journal it once it is well past the journaled one
+        expires = time.time() + self.ttl
+        if expires - self._journaled.get(conversation_id, 0) > self.ttl * REFRESH_FRACTION:
+            self._journaled[conversation_id] = expires
+            self.journal.append(OP_SET, conversation_id, expires, encode_state(state))
+            self.refreshes += 1
+        return state
+
+    def set(self, conversation_id, state):
+        if self._restored_count:
+            self._take_restored(conversation_id)
+        super().set(conversation_id, state)
+        expires = time.time() + self.ttl
+        self._journaled[conversation_id] = expires
+        self.journal.append(OP_SET, conversation_id, expires, encode_state(state))
+
+    def pop(self, conversation_id, default=None):
+        if self._restored_count:
+            self._take_restored(conversation_id)
+        state = super().pop(conversation_id, default)
+        self._journaled.pop(conversation_id, None)
+        # Also journaled for entries already evicted here, so they stay gone
+        self.journal.append(OP_DEL, conversation_id, 0)
+        return state
+
+    def _evicted(self, conversation_id):
+        self._journaled.pop(conversation_id, None)
+        self.journal.append(OP_DEL, conversation_id, 0)
+
+    def __len__(self):
+        return super().__len__() + self._restored_count
+
+    def purge_expired(self):
+        now = time.time()
+        with self._restored_lock:
+            self._restored_live &= self._restored_expires > now
+            self._restored_tail = {conversation_id: entry for conversation_id, entry
+                                   in list(self._restored_tail.items()) if entry[0] > now}
+            self._restored_count = int(np.count_nonzero(self._restored_live)) + len(self._restored_tail)
+        # A session outlives its journaled expiry by at most the refresh slack
+        horizon = now - self.ttl * REFRESH_FRACTION
+        self._journaled = {conversation_id: expires for conversation_id, expires
+                           in list(self._journaled.items()) if expires > horizon}
+        return super().purge_expired()
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            "backend": "journal",
+            "restoredPending": self._restored_count,
+            "journalRecords": self.journal.records,
+            "expiryRefreshes": self.refreshes,
+            "compactions": self.journal.compactions,
+            "recoverySeconds": self.journal.last_recovery_seconds,
+        })
+        return stats
@@ -0,0 +1,121 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from admission import NORMAL, PRIORITY, QUEUE_FULL, QUEUE_TIMEOUT, AdmissionController
+from lexical_tier import LexicalTier
+
+# Checks the admission controller and the lexical tier used by degraded mode,
+# then overloads the optimized service in process to compare latency with and
+# without admission control. The overload run needs Ollama (slow enough to
+# saturate, e.g. a busy GPU) at the service's OLLAMA_URLS.
+
+# Configuration
+OVERLOAD_CLIENTS = 64
+OVERLOAD_REQUESTS = 256
+
+def test_priority_lane():
+    controller = AdmissionController(max_in_flight=1, max_queue=8, queue_timeout=5)
+    assert controller.acquire()[0]
+    order = []
+
+    def wait(lane):
+        admitted, _, _ = controller.acquire(lane)
+        order.append(lane)
+        controller.release()
+
+    threads = [threading.Thread(target=wait, args=(lane,)) for lane in (NORMAL, NORMAL, PRIORITY)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    assert controller.queued() == 3
+    controller.release()
+    for thread in threads:
+        thread.join()
+    assert order == [PRIORITY, NORMAL, NORMAL], order
+    assert controller.in_flight == 0
+    print("priority lane: ok")
+
+def test_shedding():
+    controller = AdmissionController(max_in_flight=1, max_queue=2, queue_timeout=0.05)
+    assert controller.acquire()[0]
+    # The normal lane gets half the queue
+    waiter = threading.Thread(target=controller.acquire)
+    waiter.start()
+    time.sleep(0.01)
+    admitted, _, reason = controller.acquire(NORMAL, timeout=0)
+    assert not admitted and reason == QUEUE_FULL
+    waiter.join()
+    admitted, waited, reason = controller.acquire(PRIORITY)
+    assert not admitted and reason == QUEUE_TIMEOUT and waited >= 0.05
+    assert controller.queued() == 0
+    assert controller.retry_after() >= 1
+    controller.release()
+    assert controller.in_flight == 0
+    print("shedding: ok")
+
+def test_async_acquire():
+    controller = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=1)
+
+    async def run():
+        assert (await controller.acquire_async())[0]
+        waiter = asyncio.ensure_future(controller.acquire_async(PRIORITY))
+        await asyncio.sleep(0.01)
+        # Released from another thread, as a Flask worker would
+        threading.Thread(target=controller.release).start()
+        admitted, waited, _ = await waiter
+        assert admitted and waited > 0
+        controller.release()
+
+    asyncio.run(run())
+    assert controller.in_flight == 0
+    print("async acquire: ok")
+
+def test_lexical_tier():
+    texts = ["Not at all", "Several days", "Trouble falling or staying asleep", "Feeling tired or having little energy"]
+    vectors = np.eye(len(texts), 8)
+    tier = LexicalTier(texts, vectors)
+    assert np.argmax(tier.embed("not at all really")) == 0
+    assert np.argmax(tier.embed("I can't fall asleep at night")) == 2
+    assert np.argmax(tier.embed("so tired lately")) == 3
+    assert tier.embed("the") is None
+    print("lexical tier: ok")
+
+def run_overload_benchmark():
+    import optimized_semantic_service as service
+
+    service.create_app()
+    if service.question_index is None:
+        print("Overload benchmark skipped: no question index (is Ollama running?)")
+        return
+
+    def one(i):
+        start = time.perf_counter()
+        payload, status, _ = service.map_admitted({"message": f"overload message {i} about sleep and energy",
+                                                   "conversationId": f"overload-{i}", "mappingType": "question"})
+        return time.perf_counter() - start, status, payload.get("degraded", False)
+
+    for label, limits in [("no admission control", (OVERLOAD_REQUESTS, OVERLOAD_REQUESTS)),
+                          ("admission control", (service.ADMISSION_MAX_IN_FLIGHT, service.ADMISSION_MAX_QUEUE))]:
+        service.admission = AdmissionController(*limits, service.ADMISSION_QUEUE_TIMEOUT)
+        run = int(time.time() * 1000)
+        with ThreadPoolExecutor(OVERLOAD_CLIENTS) as pool:
+            results = list(pool.map(lambda i: one(f"{run}-{i}"), range(OVERLOAD_REQUESTS)))
+        latencies = sorted(seconds * 1000 for seconds, _, _ in results)
+        statuses = [status for _, status, _ in results]
+        print(f"{label}: p50 {statistics.median(latencies):.0f}ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.0f}ms, "
+              f"full quality {sum(1 for _, s, d in results if s == 200 and not d)}, "
+              f"degraded {sum(1 for _, _, d in results if d)}, "
+              f"503 {statuses.count(503)}, shed {sum(service.admission.shed.values())}")
+
+if __name__ == "__main__":
+    test_priority_lane()
+    test_shedding()
+    test_async_acquire()
+    test_lexical_tier()
+    run_overload_benchmark()
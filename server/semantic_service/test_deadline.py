@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+
+from request_deadline import bounded, expired, parse_budget, request_deadline, time_left
+
+# Checks deadline parsing and propagation, that the async service bounds its
+# wait for an Ollama slot by the deadline and runs a mapper that may call
+# Ollama off its event loop, then sends requests with a short budget to the
+# optimized and async services in process. The live part needs
+# Ollama at the service's OLLAMA_URLS; it is most telling when Ollama is
+# slower than the budget.
+
+# Configuration
+BUDGET_MS = 100
+
+def test_parse_budget():
+    assert parse_budget() is None
+    assert parse_budget("250") == 0.25
+    assert parse_budget(None, {"deadlineMs": 1000}) == 1.0
+    assert parse_budget("500", {"deadlineMs": 200}) == 0.2       # the smaller wins
+    assert parse_budget("soon", {"deadlineMs": "nan"}) is None
+    assert parse_budget("-5") is None
+    print("parse budget: ok")
+
+def test_request_deadline():
+    assert time_left() is None and bounded(30) == 30 and not expired()
+    with request_deadline(0.05):
+        assert 0 < time_left() <= 0.05
+        assert bounded(30) <= 0.05 and bounded(0.01) == 0.01
+        time.sleep(0.06)
+        assert expired() and bounded(30) == 0
+    assert time_left() is None
+    print("request deadline: ok")
+
+def test_async_queue_wait_bounded():
+    import async_semantic_service
+    from ollama_scheduler import INTERACTIVE, OllamaScheduler
+    service = async_semantic_service.service
+
+    saved = service.ollama_scheduler
+    service.ollama_scheduler = OllamaScheduler(max_in_flight=1)
+    # Every slot is taken, so a new call has to queue
+    assert service.ollama_scheduler.acquire(INTERACTIVE)[0]
+
+    async def check():
+        with request_deadline(0.05):
+            start = time.perf_counter()
+            response = await async_semantic_service.post_to_ollama(service.OLLAMA_API_PATH, {}, 30)
+            return response, time.perf_counter() - start
+
+    try:
+        response, waited = asyncio.run(check())
+    finally:
+        service.ollama_scheduler.release(INTERACTIVE)
+        service.ollama_scheduler = saved
+    assert response is None and waited < 0.5, waited
+    print("async queue wait bounded: ok")
+
+def test_async_mapper_off_loop():
+    import async_semantic_service
+    service = async_semantic_service.service
+
+    async def embedding(text):
+        return [1.0, 0.0]
+
+    threads = []
+    def mapper(data, query_embedding):
+        threads.append(threading.current_thread())
+        return {"success": True}, 200
+
+    category = next(iter(service.questions_data))
+    data = {"message": "sometimes", "mappingType": "option", "category": category,
+            "question": service.questions_data[category][0]}
+    saved = (async_semantic_service.get_message_embedding, async_semantic_service.get_embedding,
+             service.get_question_index, service.embedding_cached)
+    async_semantic_service.get_message_embedding = async_semantic_service.get_embedding = embedding
+    service.get_question_index = lambda dim: None
+    try:
+        # Options with cached embeddings: mapped on the event loop's thread
+        service.embedding_cached = lambda cache_key: True
+        asyncio.run(async_semantic_service.map_message(data, mapper))
+        # An option whose fetch failed would be embedded by the mapper, so it runs in a thread
+        service.embedding_cached = lambda cache_key: False
+        asyncio.run(async_semantic_service.map_message(data, mapper))
+    finally:
+        (async_semantic_service.get_message_embedding, async_semantic_service.get_embedding,
+         service.get_question_index, service.embedding_cached) = saved
+    assert threads[0] is threading.main_thread() and threads[1] is not threading.main_thread()
+    print("async mapper off loop: ok")
+
+def run_live_deadline_check():
+    import optimized_semantic_service as service
+    import async_semantic_service
+
+    service.create_app()
+    if service.question_index is None:
+        print("Live deadline check skipped: no question index (is Ollama running?)")
+        return
+    client = service.app.test_client()
+    run = int(time.time() * 1000)
+    for label, headers in [("no deadline", {}), (f"{BUDGET_MS}ms deadline", {"X-Deadline-Ms": str(BUDGET_MS)})]:
+        start = time.perf_counter()
+        response = client.post('/map-response', headers=headers, json={
+            "message": f"lately I cannot sleep and feel tired {run} {label}", "mappingType": "question"})
+        elapsed = (time.perf_counter() - start) * 1000
+        body = response.get_json()
+        print(f"sync, {label}: {response.status_code} in {elapsed:.0f}ms, "
+              f"degraded={body.get('degraded', False)}, question={body.get('question')!r}")
+
+    async def async_check():
+        async with async_semantic_service.app.test_app() as test_app:
+            client = test_app.test_client()
+            start = time.perf_counter()
+            response = await client.post('/map-response', headers={"X-Deadline-Ms": str(BUDGET_MS)}, json={
+                "message": f"my appetite changed a lot {run}", "mappingType": "question"})
+            elapsed = (time.perf_counter() - start) * 1000
+            body = await response.get_json()
+            await asyncio.sleep(0)
+            print(f"async, {BUDGET_MS}ms deadline: {response.status_code} in {elapsed:.0f}ms, "
+                  f"degraded={body.get('degraded', False)}, question={body.get('question')!r}, "
+                  f"abandoned fetches still running: {len(async_semantic_service.in_flight_embeddings)}")
+
+    asyncio.run(async_check())
+
+if __name__ == "__main__":
+    test_parse_budget()
+    test_request_deadline()
+    test_async_queue_wait_bounded()
+    test_async_mapper_off_loop()
+    run_live_deadline_check()
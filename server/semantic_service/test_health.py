@@ -0,0 +1,63 @@
+import time
+import timeit
+
+import optimized_semantic_service as service
+from ollama_circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+# Checks the Ollama circuit breaker and the /healthz, /readyz and /status
+# endpoints. None of them needs Ollama: the endpoints only read process state.
+
+# Configuration
+PROBE_SAMPLES = 2000
+
+def test_circuit_breaker():
+    circuit = CircuitBreaker(failure_threshold=3, reset_seconds=0.05)
+    for _ in range(2):
+        assert circuit.allow()
+        circuit.record_failure()
+    assert circuit.state == CLOSED
+    circuit.record_failure()
+    assert circuit.state == OPEN
+    assert not circuit.allow()
+
+    time.sleep(0.06)
+    assert circuit.state == HALF_OPEN
+    assert circuit.allow()          # the single trial call
+    assert not circuit.allow()
+    circuit.record_failure()
+    assert circuit.state == OPEN
+
+    time.sleep(0.06)
+    assert circuit.allow()
+    circuit.record_success()
+    assert circuit.state == CLOSED and circuit.allow()
+    stats = circuit.stats()
+    assert stats["opens"] == 2 and stats["shortCircuited"] == 2
+    print("circuit breaker: ok")
+
+def test_health_endpoints():
+    client = service.app.test_client()
+    assert client.get('/healthz').status_code == 200
+
+    ready = client.get('/readyz')
+    checks = ready.get_json()["checks"]
+    assert ready.status_code == (200 if all(checks.values()) else 503)
+    assert checks["stateBackend"]
+
+    status = client.get('/status').get_json()
+    assert status["questionBank"]["version"] == service.question_bank.version
+    assert status["ollama"]["circuit"]["state"] == CLOSED
+    assert status["queues"]["embedding"] == 0
+    assert status["warmup"]["state"] in ("pending", "running", "complete", "failed")
+    print(f"health endpoints: ok (ready={status['ready']}, warmup={status['warmup']['state']})")
+
+def run_probe_benchmark():
+    client = service.app.test_client()
+    for route in ['/healthz', '/readyz', '/status']:
+        seconds = timeit.timeit(lambda: client.get(route), number=PROBE_SAMPLES) / PROBE_SAMPLES
+        print(f"{route}: {seconds * 1e6:.0f}us per probe (Flask test client)")
+
+if __name__ == "__main__":
+    test_circuit_breaker()
+    test_health_endpoints()
+    run_probe_benchmark()
@@ -0,0 +1,92 @@
+import time
+
+import optimized_semantic_service as service
+
+# Checks /map-response/batch in process with the Flask test client: results
+# in item order, per-item errors among valid items, and the 400 answers to
+# malformed batches. The checks use bank questions, whose embeddings come from
+# the embedding artifact, so they need no Ollama. The benchmark then maps
+# new messages one request at a time and as one batch, and counts the calls
+# each way makes to Ollama at the service's OLLAMA_URLS.
+
+# Configuration
+BENCHMARK_MESSAGES = 200
+
+def batch_client():
+    """Test client of the app, with the question index loaded from the artifact"""
+    if service.question_index is None:
+        service.create_app(preload=False)
+    return service.app.test_client()
+
+def bank_questions():
+    return [question for questions in service.questions_data.values() for question in questions]
+
+def test_item_order():
+    client = batch_client()
+    questions = bank_questions()[:12][::-1]
+    items = [{"message": question, "mappingType": "question", "conversationId": f"batch-order-{i}"}
+             for i, question in enumerate(questions)]
+    response = client.post('/map-response/batch', json={"items": items})
+    results = response.get_json()["results"]
+    assert response.status_code == 200 and len(results) == len(items)
+    assert [result["question"] for result in results] == questions
+    print("item order: ok")
+
+def test_mixed_items():
+    client = batch_client()
+    first, second = bank_questions()[:2]
+    items = [{"message": first, "mappingType": "question", "conversationId": "batch-mixed-1"},
+             {"text": "no message field"},
+             5,
+             {"message": 42},
+             {"message": second, "mappingType": "question", "conversationId": "batch-mixed-2"}]
+    # A bare list is accepted as well as {"items": [...]}
+    response = client.post('/map-response/batch', json=items)
+    results = response.get_json()["results"]
+    assert response.status_code == 200 and len(results) == 5
+    assert results[0]["success"] and results[0]["question"] == first
+    assert all(not result["success"] for result in results[1:4])
+    assert results[4]["success"] and results[4]["question"] == second
+    print("mixed items: ok")
+
+def test_malformed_batches():
+    client = batch_client()
+    for body in ({"items": "not a list"}, {"messages": []}, 5, "text"):
+        response = client.post('/map-response/batch', json=body)
+        assert response.status_code == 400 and response.get_json()["success"] is False, body
+    too_many = [{"message": "hello"}] * (service.MAX_BATCH_ITEMS + 1)
+    response = client.post('/map-response/batch', json=too_many)
+    assert response.status_code == 400
+    # A body that does not decode is answered in JSON, with the timing and trace headers
+    response = client.post('/map-response/batch', data="not json", content_type="application/json")
+    assert response.status_code == 400 and response.get_json()["success"] is False
+    assert "Server-Timing" in response.headers and service.TRACE_HEADER in response.headers
+    print("malformed batches: ok")
+
+def ollama_calls():
+    return sum(stats["calls"] for stats in service.ollama_pool.stats().values())
+
+def run_batch_benchmark():
+    client = batch_client()
+    run = int(time.time() * 1000)
+    for label, batched in [("one request per message", False), ("one batch", True)]:
+        items = [{"message": f"I have not slept well for {run} {label} {i} nights", "mappingType": "question",
+                  "conversationId": f"batch-benchmark-{i}"} for i in range(BENCHMARK_MESSAGES)]
+        calls = ollama_calls()
+        start = time.perf_counter()
+        if batched:
+            requests = 1
+            statuses = [client.post('/map-response/batch', json={"items": items}).status_code]
+        else:
+            requests = len(items)
+            statuses = [client.post('/map-response', json=item).status_code for item in items]
+        seconds = time.perf_counter() - start
+        assert set(statuses) == {200}, statuses
+        print(f"{label}: {requests} requests, {ollama_calls() - calls} Ollama calls, "
+              f"{seconds * 1000:.0f}ms for {len(items)} messages")
+
+if __name__ == "__main__":
+    test_item_order()
+    test_mixed_items()
+    test_malformed_batches()
+    run_batch_benchmark()
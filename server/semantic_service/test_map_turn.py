@@ -0,0 +1,114 @@
+import time
+
+import optimized_semantic_service as service
+
+# Walks a conversation through /map-turn and checks it decides like auto mode
+# on /map-response, then compares a turn that abandons its question: the chat
+# controller's former two calls (option, then question) against one /map-turn
+# call. Runs the optimized service in process and needs Ollama at its
+# OLLAMA_URLS.
+
+# Configuration
+TURNS = 20
+
+def turn_client():
+    """Test client of the app, with the question index compiled"""
+    if service.question_index is None:
+        service.create_app()
+    return service.app.test_client()
+
+def turn(client, conversation_id, message, pending=None, **fields):
+    data = dict(message=message, conversationId=conversation_id, **fields)
+    if pending is not None:
+        data["pendingQuestion"] = pending or None
+    response = client.post('/map-turn', json=data)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def test_turn_flow():
+    client = turn_client()
+    conversation_id = f"turn-{time.time()}"
+    body = turn(client, conversation_id, "I have trouble falling asleep at night")
+    question = body["question"]
+    assert body["mappingType"] == "question" and body["option"] is None
+    assert body["transition"] == {"decision": "question", "previousQuestionId": None,
+                                  "pendingQuestionId": question["questionId"]}
+
+    # Answering with an option text of the pending question
+    option_text = service.question_bank.options(question["questionId"])[-1]
+    body = turn(client, conversation_id, option_text)
+    assert body["mappingType"] == "option" and body["question"] is None
+    assert body["option"]["mappedOption"] == option_text and body["option"]["confidence"] > 0.99
+    assert body["transition"]["decision"] == "option"
+    assert body["transition"]["pendingQuestionId"] is None
+
+    # The caller's pending question overrides the service's state
+    pending = {"category": question["category"], "question": question["question"]}
+    body = turn(client, conversation_id, "what treatments are there for depression", pending=pending)
+    assert body["transition"]["previousQuestionId"] == question["questionId"]
+    assert body["transition"]["decision"].startswith("abandon_")
+    assert body["option"] is not None and body["question"] is not None
+    assert body["transition"]["pendingQuestionId"] == body["question"]["questionId"]
+
+    body = turn(client, conversation_id, option_text, pending={}, includeText=False)
+    assert body["transition"]["decision"] == "question" and "question" not in body["question"]
+    print("turn flow: ok")
+
+def test_matches_auto_mode():
+    client = turn_client()
+    run = time.time()
+    for i, message in enumerate(["I feel sad all the time", "nearly every day", "I can't concentrate"]):
+        auto = client.post('/map-response', json={"message": message, "conversationId": f"auto-{run}"}).get_json()
+        body = turn(client, f"turn-{run}", message)
+        chosen = body["question"] or body["option"]
+        assert auto["mappingType"] == body["mappingType"], (auto, body)
+        assert (auto["questionId"], auto.get("optionId")) == (chosen["questionId"], chosen.get("optionId"))
+    print("matches auto mode: ok")
+
+def test_logs_chosen_result():
+    client = turn_client()
+    logged = []
+    original = service.log_result
+    service.log_result = lambda log, status, payload: (original(log, status, payload), logged.append(dict(log)))
+    try:
+        body = turn(client, f"log-{time.time()}", "I have trouble falling asleep at night")
+    finally:
+        service.log_result = original
+    assert logged[-1]["mappingType"] == "question"
+    assert logged[-1]["questionId"] == body["question"]["questionId"]
+    assert logged[-1]["confidence"] == body["question"]["confidence"]
+    print("logs chosen result: ok")
+
+def run_round_trip_comparison():
+    client = turn_client()
+    question = service.question_bank.question_texts[0]
+    category = service.question_bank.question_categories[0]
+    run = int(time.time() * 1000)
+
+    def two_calls(i):
+        message = f"what treatments are there {run} {i}"
+        option = client.post('/map-response', json={"message": message, "conversationId": f"two-{run}-{i}",
+                                                     "mappingType": "option", "category": category,
+                                                     "question": question}).get_json()
+        if option["confidence"] < 0.6:
+            client.post('/map-response', json={"message": message, "conversationId": f"two-{run}-{i}",
+                                               "mappingType": "question"})
+            return 2
+        return 1
+
+    def one_call(i):
+        turn(client, f"one-{run}-{i}", f"what treatments are there {run} {TURNS + i}",
+             pending={"category": category, "question": question})
+        return 1
+
+    for label, flow in [("option then question (two calls)", two_calls), ("/map-turn", one_call)]:
+        start = time.perf_counter()
+        calls = sum(flow(i) for i in range(TURNS))
+        elapsed = (time.perf_counter() - start) / TURNS * 1000
+        print(f"{label}: {calls / TURNS:.1f} requests and {elapsed:.1f}ms per turn")
+
+if __name__ == "__main__":
+    test_turn_flow()
+    test_matches_auto_mode()
+    test_logs_chosen_result()
+    run_round_trip_comparison()
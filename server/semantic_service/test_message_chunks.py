@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from lexical_tier import tokens
+from message_chunks import MAX_CHUNKS, ChunkedMessage, pool_scores, split_message
+
+# Checks message chunking and score pooling, then maps pasted paragraphs with
+# the optimized service, whole and chunk by chunk. Each paragraph is one
+# sentence about a symptom among everyday filler. The stand-in Ollama embeds
+# by hashed words and takes longer for longer inputs, with batched inputs
+# run in parallel, as on a GPU. The benchmark reports latency, how often the
+# symptom's question was found, and the confidence. No Ollama installation
+# is needed.
+
+# Configuration
+PARAGRAPHS = 60
+FILLER_SENTENCES = 6
+BASE_SECONDS = 0.01         # Stand-in cost of a call ...
+SECONDS_PER_WORD = 0.002    # ... plus this per word of its longest input
+SEED = 3
+
+SYMPTOMS = [
+    ("I have trouble falling asleep and keep waking up at night.",
+     {"Trouble falling or staying asleep, or sleeping too much?", "Changes in sleeping pattern"}),
+    ("I feel tired all day and have so little energy.",
+     {"Feeling tired or having little energy?", "Loss of energy"}),
+    ("My appetite is poor and I keep skipping meals.",
+     {"Poor appetite or overeating?", "Changes in appetite"}),
+    ("I have trouble concentrating, even on reading the newspaper.",
+     {"Trouble concentrating on things, such as reading the newspaper or watching television?"}),
+    ("Honestly I feel down and hopeless most of the time.",
+     {"Feeling down, depressed, or hopeless?"}),
+    ("Sometimes I think I would be better off dead.",
+     {"Thoughts that you would be better off dead, or of hurting yourself in some way?",
+      "Suicidal thoughts or wishes"}),
+]
+FILLER = [
+    "My sister came over last weekend with her two kids.",
+    "We drove out to the coast and had lunch at a small cafe.",
+    "The weather was cold and rainy the whole time.",
+    "Work has been busy because my manager moved offices.",
+    "I finally fixed the leaking tap in the kitchen.",
+    "Our dog keeps barking at the neighbours' cat.",
+    "The bus was late again on Monday morning.",
+    "My brother wants us all to go camping in August.",
+    "We painted the spare room a pale green colour.",
+    "The car needs new tyres before the winter.",
+]
+
+# Stand-in Ollama: hashed-word embeddings, slower for longer inputs
+def stand_in_embedding(text):
+    vector = np.full(768, 0.01)
+    for token in tokens(text):
+        digest = int(hashlib.md5(token.encode()).hexdigest(), 16)
+        vector[digest % 768] += 1
+        vector[(digest >> 20) % 768] += 0.5
+    return (vector / np.linalg.norm(vector)).tolist()
+
+class ChunkingOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        texts = [data["prompt"]] if "prompt" in data else data["input"]
+        time.sleep(BASE_SECONDS + SECONDS_PER_WORD * max(len(text.split()) for text in texts))
+        embeddings = [stand_in_embedding(text) for text in texts]
+        body = json.dumps({"embedding": embeddings[0]} if "prompt" in data else {"embeddings": embeddings}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def paragraphs(run):
+    """(paragraph, accepted questions, symptom sentence); numbers keep every text of a run uncached"""
+    rng = random.Random(SEED)
+    result = []
+    for n in range(PARAGRAPHS):
+        symptom, questions = SYMPTOMS[n % len(SYMPTOMS)]
+        sentences = rng.sample(FILLER, FILLER_SENTENCES)
+        position = rng.randrange(len(sentences) + 1)
+        sentences.insert(position, symptom)
+        sentences = [f"{sentence[:-1]} {run * PARAGRAPHS + n}{sentence[-1]}" for sentence in sentences]
+        result.append((" ".join(sentences), questions, sentences[position]))
+    return result
+
+def test_split_message():
+    assert split_message("I feel tired. I can't sleep.", min_words=40) is None
+    text = "I feel tired. I can't sleep!\nMy appetite is gone; I skip meals. " + " ".join(["word"] * 40)
+    chunks = split_message(text, min_words=10, window_words=24)
+    assert chunks[:4] == ["I feel tired.", "I can't sleep!", "My appetite is gone;", "I skip meals."]
+    # A 40-word sentence: windows of 24 words overlapping by 12
+    assert [len(chunk.split()) for chunk in chunks[4:]] == [24, 24, 16]
+    many = " ".join(f"Sentence number {i} is here." for i in range(40))
+    assert len(split_message(many, min_words=10)) <= MAX_CHUNKS
+    print("split message: ok")
+
+def test_pool_scores():
+    # Two chunks, three candidates
+    scores = np.array([[0.2, 0.3, 0.9],
+                       [0.8, 0.1, 0.2]])
+    pooled, drivers = pool_scores(scores, "max")
+    assert np.allclose(pooled, [0.8, 0.3, 0.9]) and list(drivers) == [1, 0, 0]
+    pooled, drivers = pool_scores(scores, "attention", temperature=0.05)
+    # The first chunk matches something better, so it carries most of the weight
+    assert int(np.argmax(pooled)) == 2 and drivers[2] == 0 and pooled[2] < 0.9
+    message = ChunkedMessage(["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    assert len(message) == 2 and message.describe(1) == {"index": 1, "count": 2, "text": "b"}
+    print("pool scores: ok")
+
+def run_chunking_benchmark():
+    import optimized_semantic_service as service
+    from ollama_pool import OllamaPool
+    from service_logging import logger
+
+    logger.setLevel(logging.CRITICAL)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChunkingOllamaHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service.ollama_pool = OllamaPool([f"http://127.0.0.1:{server.server_port}"])
+    service.near_duplicates = None
+    # The question index in the stand-in's embedding space
+    service.preload_question_embeddings()
+
+    print(f"{PARAGRAPHS} paragraphs of {statistics.mean(len(p.split()) for p, _, _ in paragraphs(0)):.0f} words")
+    for run, (label, min_words, pooling) in enumerate([("whole message", 0, "max"),
+                                                       ("chunks, max pooling", 40, "max"),
+                                                       ("chunks, attention pooling", 40, "attention")]):
+        sample = paragraphs(run)
+        service.CHUNK_MIN_WORDS = min_words
+        service.CHUNK_POOLING = pooling
+        latencies, confidences, found, driven = [], [], 0, 0
+        for n, (paragraph, questions, symptom) in enumerate(sample):
+            data = {"message": paragraph, "mappingType": "question", "conversationId": f"chunks-{label}-{n}",
+                    "includeChunk": True}
+            start = time.perf_counter()
+            payload, _ = service.map_message(data)
+            latencies.append((time.perf_counter() - start) * 1000)
+            confidences.append(payload["confidence"])
+            found += payload["question"] in questions
+            driven += payload.get("matchedChunk", {}).get("text") == symptom
+        chunk_report = f", symptom sentence reported as the driving chunk {driven}/{len(sample)}" if min_words else ""
+        print(f"{label}: p50 {statistics.median(latencies):.0f}ms, question found {found}/{len(sample)}, "
+              f"mean confidence {statistics.mean(confidences):.3f}{chunk_report}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    test_split_message()
+    test_pool_scores()
+    run_chunking_benchmark()
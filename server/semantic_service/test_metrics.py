@@ -0,0 +1,100 @@
+import threading
+import time
+import timeit
+
+import service_metrics as metrics
+from service_metrics import stage, time_request
+
+# Checks the /metrics exposition format and benchmarks the instrumentation a
+# request pays for: the request histogram and counter, one stage() per stage
+# and the cache and mapping counters of a cached auto-mode turn.
+
+# Configuration
+REQUEST_SAMPLES = 100000
+ROUNDS = 5
+
+STAGES = ["normalization", "cache_lookup", "similarity", "cache_lookup", "similarity", "serialization"]
+
+def instrumented_request():
+    start = time.perf_counter()
+    for name in STAGES:
+        with stage(name):
+            pass
+    metrics.EMBEDDING_CACHE.labels("local", "hit").inc()
+    metrics.EMBEDDING_CACHE.labels("local", "hit").inc()
+    metrics.MAPPINGS.labels("option").inc()
+    metrics.REQUEST_SECONDS.labels("/map-response").observe(time.perf_counter() - start)
+    metrics.REQUESTS.labels("/map-response", "200").inc()
+
+def timed_request():
+    with time_request() as timer:
+        instrumented_request()
+    timer.server_timing()
+
+def test_render():
+    metrics.REQUESTS.labels("/test", "200").inc(3)
+    metrics.STAGE_SECONDS.labels("test").observe(0.002)
+    metrics.STAGE_SECONDS.labels("test").observe(42.0)
+    metrics.CACHE_ENTRIES.labels("test").set_function(lambda: 7)
+    metrics.CACHE_ENTRIES.labels("broken").set_function(lambda: 1 / 0)
+    text = metrics.render()
+
+    assert '# TYPE semantic_stage_duration_seconds histogram' in text
+    assert 'semantic_requests_total{route="/test",status="200"} 3' in text
+    assert 'semantic_stage_duration_seconds_bucket{stage="test",le="0.0025"} 1' in text
+    assert 'semantic_stage_duration_seconds_bucket{stage="test",le="+Inf"} 2' in text
+    assert 'semantic_stage_duration_seconds_count{stage="test"} 2' in text
+    assert 'semantic_embedding_cache_entries{tier="test"} 7' in text
+    assert 'tier="broken"' not in text
+    assert text.endswith("\n")
+    print("render: ok")
+
+def test_thread_shards():
+    counter = metrics.REQUESTS.labels("/threads", "200")
+    histogram = metrics.STAGE_SECONDS.labels("threads")
+
+    def record():
+        for _ in range(10000):
+            counter.inc()
+            histogram.observe(0.001)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.value == 80000
+    assert 'semantic_stage_duration_seconds_count{stage="threads"} 80000' in metrics.render()
+    print("thread shards: ok")
+
+def test_server_timing():
+    with time_request() as timer:
+        for name in ["cache_lookup", "ollama", "cache_lookup"]:
+            with stage(name):
+                pass
+    header = timer.server_timing()
+    assert header.startswith('cache_lookup;dur=')
+    assert ';desc="2 calls", ollama;dur=' in header
+    assert ", total;dur=" in header
+    assert timer.as_dict()["stages"]["cache_lookup"]["count"] == 2
+    print("server timing: ok")
+
+def per_request_us(function):
+    # Best of ROUNDS, which is the least disturbed by other load on the machine
+    return min(timeit.repeat(function, number=REQUEST_SAMPLES, repeat=ROUNDS)) / REQUEST_SAMPLES * 1e6
+
+def run_overhead_benchmark():
+    baseline = per_request_us(lambda: None)
+    per_stage = per_request_us(lambda: stage("similarity").__enter__().__exit__()) - baseline
+    instrumented = per_request_us(instrumented_request) - baseline
+    timed = per_request_us(timed_request) - baseline
+    print(f"stage(): {per_stage:.2f}us")
+    print(f"Instrumentation overhead ({len(STAGES)} stages, 5 counters, 1 histogram): "
+          f"{instrumented:.2f}us per request")
+    print(f"  with Server-Timing collection and header: {timed:.2f}us per request")
+
+if __name__ == "__main__":
+    test_render()
+    test_thread_shards()
+    test_server_timing()
+    run_overhead_benchmark()
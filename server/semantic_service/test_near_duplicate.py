@@ -0,0 +1,142 @@
+import random
+import statistics
+
+import numpy as np
+
+from near_duplicate import NearDuplicateIndex, normalize
+
+# Checks message normalization and near-duplicate lookups, then measures
+# near-duplicate reuse on a sample of patient-style messages with typos,
+# dropped apostrophes, repeated words and punctuation changes: how many
+# embeddings would be reused at each distance, and how often a reused
+# embedding maps to the same question as the message's true embedding. The
+# benchmark needs Ollama at the service's OLLAMA_URLS.
+
+# Configuration
+DISTANCES = [0.0, 0.1, 0.15, 0.25]
+SEED = 7
+
+MESSAGES = [
+    "I'm so tired all the time",
+    "I can't sleep at night, I keep waking up",
+    "I have been feeling really down lately",
+    "I don't enjoy the things I used to love",
+    "I feel like a failure and I let my family down",
+    "I have trouble concentrating on my work",
+    "I haven't been eating much, I have no appetite",
+    "I worry about everything and can't relax",
+    "Sometimes I feel hopeless about the future",
+    "I get angry at my kids over small things",
+    "I feel restless and can't sit still",
+    "I think about death a lot",
+]
+
+def variants(message, rng):
+    """Trivially different ways a patient might type the same message"""
+    words = message.split()
+    long_words = [i for i, word in enumerate(words) if len(word) >= 5 and word.isalpha()]
+    i = rng.choice(long_words)
+    j = rng.randrange(1, len(words[i]) - 1)
+    typo = words[:i] + [words[i][:j - 1] + words[i][j] + words[i][j - 1] + words[i][j + 1:]] + words[i + 1:]
+    k = rng.randrange(len(words))
+    return [
+        message,
+        message.lower().replace("'", ""),
+        " ".join(words[:k + 1] + [words[k]] + words[k + 1:]),
+        " ".join(typo),
+        message.rstrip(".!") + "...",
+    ]
+
+def sample_messages():
+    rng = random.Random(SEED)
+    sample = [variant for message in MESSAGES for variant in variants(message, rng)]
+    rng.shuffle(sample)
+    return sample
+
+def test_normalize():
+    assert normalize("I'm so so tired!!") == normalize("im so tired") == "im so tired"
+    assert normalize("  I can’t   SLEEP. ") == "i cant sleep"
+    assert normalize("?!") == ""
+    print("normalize: ok")
+
+def test_find():
+    index = NearDuplicateIndex(distance=0.15)
+    index.add("I have been feeling really down lately and I don't enjoy anything", [1.0])
+    index.add("I have trouble concentrating on things", [2.0])
+    index.add("It has been going on for 3 weeks now", [3.0])
+    assert index.find("I'm so tired") is None
+    assert index.find("ive been feeling really down lately and i dont enjoy anything")[0] == [1.0]
+    embedding, distance = index.find("i have troble concentrating on things")
+    assert embedding == [2.0] and 0 < distance <= 0.15
+    # Close in characters, but not in meaning
+    assert index.find("I have been feeling really down lately and I do enjoy anything") is None
+    assert index.find("It has been going on for 5 weeks now") is None
+    assert index.stats()["reuses"] == 2 and index.stats()["lookups"] == 5
+    print("find: ok")
+
+def test_eviction():
+    index = NearDuplicateIndex(max_entries=2, distance=0.15)
+    index.add("I feel sad most days", [1.0])
+    index.add("I sleep badly every night", [2.0])
+    index.find("i feel sad most days")              # Now the most recently used
+    index.add("My appetite is gone", [3.0])
+    assert len(index) == 2
+    assert index.find("I sleep badly every night") is None
+    assert index.find("I feel sad most days!")[0] == [1.0]
+    print("eviction: ok")
+
+def test_shared_cache_first():
+    # An exact match another worker put in the shared cache wins over a near duplicate
+    import optimized_semantic_service as service
+    from shared_embedding_cache import SharedEmbeddingCache
+
+    saved = service.shared_embedding_cache, service.near_duplicates
+    service.shared_embedding_cache = SharedEmbeddingCache(64, 4)
+    service.near_duplicates = NearDuplicateIndex(distance=0.15)
+    try:
+        text = f"I can't sleep at night, I keep waking up {random.random()}"
+        service.near_duplicates.add(text + "!", [1.0, 0.0, 0.0, 0.0])
+        service.shared_embedding_cache.put(text.strip().lower(), [0.0, 1.0, 0.0, 0.0])
+        assert list(service.get_ollama_embedding(text)) == [0.0, 1.0, 0.0, 0.0]
+        assert service.near_duplicates.lookups == 0
+        stats = service.shared_embedding_cache.stats()
+        assert (stats["hits"], stats["misses"]) == (1, 0)
+    finally:
+        service.shared_embedding_cache, service.near_duplicates = saved
+    print("shared cache first: ok")
+
+def run_near_duplicate_benchmark():
+    import optimized_semantic_service as service
+
+    service.create_app()
+    if service.question_index is None:
+        print("Near-duplicate benchmark skipped: no question index (is Ollama running?)")
+        return
+
+    # The true embedding of every message, from the exact caches or Ollama
+    service.near_duplicates = None
+    sample = sample_messages()
+    true_embeddings = [np.asarray(service.get_ollama_embedding(message)) for message in sample]
+    true_questions = [match[2] for match in service.search_questions(np.stack(true_embeddings))]
+
+    for distance in DISTANCES:
+        index = NearDuplicateIndex(distance=distance)
+        agreed, cosines = 0, []
+        for message, embedding, question in zip(sample, true_embeddings, true_questions):
+            match = index.find(message)
+            if match is None:
+                index.add(message, embedding)
+                continue
+            cosines.append(service.cosine_similarity(match[0], embedding))
+            agreed += service.search_questions(match[0])[0][2] == question
+        reuses = len(cosines)
+        print(f"distance {distance:.2f}: {reuses}/{len(sample)} embeddings reused ({reuses / len(sample):.0%}), "
+              f"mapping agreement {agreed}/{reuses}, "
+              f"mean cosine {statistics.mean(cosines) if cosines else float('nan'):.3f}")
+
+if __name__ == "__main__":
+    test_normalize()
+    test_find()
+    test_eviction()
+    test_shared_cache_first()
+    run_near_duplicate_benchmark()
@@ -0,0 +1,88 @@
+import statistics
+import time
+
+from ollama_hedging import MIN_DELAY, HedgePolicy
+from ollama_latency import LatencyWindow
+
+# Checks the rolling latency window and the hedge budget, then measures live
+# embedding latency in the optimized service with and without hedging. The
+# benchmark needs Ollama instances at the service's OLLAMA_URLS, ideally two
+# of them, and is only telling when they have a latency tail (model reloads,
+# GC pauses, a busy GPU).
+
+# Configuration
+CALLS = 400
+PERCENTILE = 95
+MAX_RATE = 0.05
+
+def test_latency_window():
+    window = LatencyWindow(size=100, min_samples=10)
+    for i in range(9):
+        window.record(i / 1000)
+    assert window.percentile(95) is None
+    for i in range(9, 200):
+        window.record(i / 1000)
+    # Only the last 100 samples count: 0.100 .. 0.199
+    assert window.percentile(0) == 0.1
+    assert window.percentile(95) == 0.195
+    assert window.percentile(100) == 0.199
+    print("latency window: ok")
+
+def test_hedge_delay():
+    window = LatencyWindow(min_samples=20)
+    policy = HedgePolicy(window, percentile=95)
+    assert policy.delay() is None
+    for _ in range(100):
+        window.record(0.001)
+    assert policy.delay() == MIN_DELAY
+    for _ in range(400):
+        window.record(0.05)
+    assert policy.delay() == 0.05
+    print("hedge delay: ok")
+
+def test_hedge_budget():
+    policy = HedgePolicy(LatencyWindow(), max_rate=0.05, burst=5)
+    hedges = 0
+    for _ in range(1000):
+        policy.delay()
+        hedges += policy.take()
+    # The burst, then one hedge per 20 calls
+    assert 54 <= hedges <= 55, hedges
+    assert policy.over_budget == 1000 - hedges
+    policy.settle(True)
+    policy.settle(False)
+    assert (policy.won, policy.lost) == (1, 1)
+    print("hedge budget: ok")
+
+def run_hedging_benchmark():
+    import optimized_semantic_service as service
+
+    service.create_app()
+    if service.question_index is None:
+        print("Hedging benchmark skipped: no question index (is Ollama running?)")
+        return
+
+    for label, hedging in [("no hedging", False), ("hedging", True)]:
+        window = service.ollama_latency[service.OLLAMA_API_PATH]
+        service.ollama_hedging = HedgePolicy(window, PERCENTILE, MAX_RATE) if hedging else None
+        run = int(time.time() * 1000)
+        calls_before = sum(stats["calls"] for stats in service.ollama_pool.stats().values())
+        latencies = []
+        for i in range(CALLS):
+            start = time.perf_counter()
+            service.get_ollama_embedding(f"hedging benchmark {run} {i}")
+            latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(1)   # let abandoned losers finish
+        calls = sum(stats["calls"] for stats in service.ollama_pool.stats().values()) - calls_before
+        latencies.sort()
+        hedges = service.ollama_hedging.stats() if hedging else {"won": 0, "lost": 0}
+        print(f"{label}: p50 {statistics.median(latencies):.0f}ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.0f}ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.0f}ms, "
+              f"{calls / CALLS:.3f} Ollama calls per embedding, hedges won {hedges['won']} lost {hedges['lost']}")
+
+if __name__ == "__main__":
+    test_latency_window()
+    test_hedge_delay()
+    test_hedge_budget()
+    run_hedging_benchmark()
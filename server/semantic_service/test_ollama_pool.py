@@ -0,0 +1,153 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from ollama_pool import OllamaPool
+from ollama_scheduler import OllamaScheduler
+
+# Checks the Ollama pool's least-outstanding routing, ejection and
+# readmission, then measures embedding throughput in the optimized service
+# with one and two Ollama instances, and with a second instance that is down.
+# The benchmark needs Ollama at the service's OLLAMA_URLS and a second
+# instance at SECOND_INSTANCE (e.g. OLLAMA_HOST=127.0.0.1:11435 ollama serve).
+
+# Configuration
+SECOND_INSTANCE = "http://localhost:11435"
+DEAD_INSTANCE = "http://localhost:11499"   # Nothing listens here
+OLLAMA_PARALLEL = 2    # Calls each instance serves at once (its OLLAMA_NUM_PARALLEL)
+CLIENTS = 8
+CALLS = 200
+
+def test_least_outstanding():
+    pool = OllamaPool(["http://a", "http://b"])
+    a, b = pool.endpoints
+    taken = [pool.acquire() for _ in range(4)]
+    assert taken.count(a) == 2 and taken.count(b) == 2
+    for endpoint in taken:
+        pool.release(endpoint, 0.1 if endpoint is a else 0.05, ok=True)
+    # Equally idle: the faster endpoint wins
+    assert pool.acquire() is b
+    assert pool.acquire() is a
+    print("least outstanding: ok")
+
+def test_ejection():
+    changes = []
+    pool = OllamaPool(["http://a", "http://b", "http://c"], eject_failures=2, check_interval=60,
+                      on_change=lambda endpoint, admitted: changes.append((endpoint.url, admitted)))
+    a, b, c = pool.endpoints
+    for _ in range(2):
+        assert {pool.acquire().url for _ in range(3)} == {"http://a", "http://b", "http://c"}
+        pool.release(a, 0.1, ok=False)
+        pool.release(b, 0.1, ok=True)
+        pool.release(c, 0.1, ok=None)    # given up on: counts for nothing
+    assert a.ejected and not c.ejected and changes == [("http://a", False)]
+    # A refused connection ejects at once
+    refusing = pool.acquire()
+    pool.release(refusing, 0.1, ok=False, refused=True)
+    assert refusing.ejected and len(pool.admitted()) == 1
+    last = pool.admitted()[0]
+    assert all(pool.acquire() is last for _ in range(5))
+    print("ejection: ok")
+
+def test_readmission():
+    changes = []
+    pool = OllamaPool(["http://a", "http://b"], check_interval=0.02,
+                      on_change=lambda endpoint, admitted: changes.append((endpoint.url, admitted)))
+    healthy = threading.Event()
+    pool.check = lambda endpoint: healthy.is_set()
+    a, b = pool.endpoints
+    pool.release(pool.acquire(), 0.1, ok=False, refused=True)
+    time.sleep(0.1)
+    assert a.ejected
+    healthy.set()
+    time.sleep(0.1)
+    assert not a.ejected and changes == [("http://a", False), ("http://a", True)]
+    assert pool._checker is None     # the checker stops once all are back
+    print("readmission: ok")
+
+def test_all_ejected():
+    pool = OllamaPool(["http://a"])
+    a = pool.endpoints[0]
+    pool.check = lambda endpoint: False
+    pool.release(pool.acquire(), 0.1, ok=False, refused=True)
+    # With nothing admitted, calls still go out rather than being refused
+    assert pool.acquire() is a
+    assert pool.acquire(exclude=[a]) is None
+    print("all ejected: ok")
+
+def test_empty_pool():
+    import asyncio
+
+    import httpx
+
+    import async_semantic_service
+    import optimized_semantic_service as service
+
+    saved = service.ollama_pool
+    service.ollama_pool = OllamaPool([])
+    try:
+        # With no instance configured a call fails as a refused connection would
+        try:
+            service.send_to_ollama(service.OLLAMA_API_PATH, {}, 1)
+        except requests.exceptions.ConnectionError:
+            pass
+        else:
+            raise AssertionError("send_to_ollama returned without an instance")
+        try:
+            asyncio.run(async_semantic_service.send_to_ollama(service.OLLAMA_API_PATH, {}, 1))
+        except httpx.ConnectError:
+            pass
+        else:
+            raise AssertionError("async send_to_ollama returned without an instance")
+    finally:
+        service.ollama_pool = saved
+    print("empty pool: ok")
+
+def run_pool_benchmark():
+    import optimized_semantic_service as service
+
+    service.create_app()
+    if service.question_index is None:
+        print("Pool benchmark skipped: no question index (is Ollama running?)")
+        return
+    try:
+        requests.get(SECOND_INSTANCE + "/api/version", timeout=2)
+    except requests.exceptions.RequestException:
+        print(f"Pool benchmark skipped: no Ollama at {SECOND_INSTANCE}")
+        return
+
+    first = service.OLLAMA_URLS[0]
+    for label, urls in [("one instance", [first]),
+                        ("two instances", [first, SECOND_INSTANCE]),
+                        ("one instance and a dead one", [first, DEAD_INSTANCE])]:
+        service.ollama_pool = OllamaPool(urls, check_interval=60)
+        service.ollama_scheduler = OllamaScheduler(OLLAMA_PARALLEL * len(urls))
+        run = int(time.time() * 1000)
+
+        def client(n):
+            latencies = []
+            for i in range(CALLS // CLIENTS):
+                start = time.perf_counter()
+                service.get_ollama_embedding(f"pool benchmark {run} {n} {i}")
+                latencies.append((time.perf_counter() - start) * 1000)
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(CLIENTS) as executor:
+            latencies = sorted(ms for run_latencies in executor.map(client, range(CLIENTS))
+                               for ms in run_latencies)
+        elapsed = time.perf_counter() - start
+        calls = {url: stats["calls"] for url, stats in service.ollama_pool.stats().items()}
+        print(f"{label}: {len(latencies) / elapsed:.0f} embeddings/s, p50 {statistics.median(latencies):.0f}ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.0f}ms, calls per instance {calls}")
+
+if __name__ == "__main__":
+    test_least_outstanding()
+    test_ejection()
+    test_readmission()
+    test_all_ejected()
+    test_empty_pool()
+    run_pool_benchmark()
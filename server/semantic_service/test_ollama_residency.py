@@ -0,0 +1,124 @@
+import json
+import logging
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ollama_latency import LatencyWindow
+from ollama_pool import OllamaPool
+from ollama_residency import COLD_LOAD_MIN_SECONDS, is_cold_load
+
+# Checks cold-load detection and the pool's routing around cold instances,
+# then runs the optimized service's embedding path against a stand-in Ollama
+# that unloads its model after the requested keep-alive and takes
+# LOAD_SECONDS to load it again. Messages arrive after idle gaps, with a
+# short keep-alive, a long one, and a short one plus keep-warm pings. No
+# Ollama installation is needed.
+
+# Configuration
+LOAD_SECONDS = 1.5
+ANSWER_SECONDS = 0.02
+IDLE_GAP = 2.0          # Seconds between the messages of a quiet conversation
+MESSAGES = 5
+
+# Stand-in Ollama with model residency: unloaded after `keep_alive` idle seconds
+class ResidentOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        server = self.server
+        with server.lock:
+            now = time.monotonic()
+            if server.unload_at is None or now >= server.unload_at:
+                server.loads += 1
+                time.sleep(LOAD_SECONDS)
+            time.sleep(ANSWER_SECONDS)
+            server.unload_at = time.monotonic() + float(data.get("keep_alive", 300))
+        body = json.dumps({"embedding": [0.1] * 768}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_resident_ollama():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ResidentOllamaHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.unload_at = None
+    server.loads = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_cold_load_signature():
+    window = LatencyWindow(min_samples=20)
+    assert not is_cold_load(0.5, window) and is_cold_load(COLD_LOAD_MIN_SECONDS, window)
+    for _ in range(100):
+        window.record(0.02)
+    assert not is_cold_load(0.9, window) and is_cold_load(1.2, window)
+    for _ in range(512):
+        window.record(0.3)
+    # A slower Ollama raises the bar: 10x its typical call
+    assert not is_cold_load(2.5, window) and is_cold_load(3.0, window)
+    print("cold load signature: ok")
+
+def test_route_around_cold():
+    warming = []
+    pool = OllamaPool(["http://a", "http://b"], cold_after=60, on_cold=warming.append)
+    a, b = pool.endpoints
+    assert pool.warm() == [] and pool.idle(60) == [a, b]
+    pool.release(pool.acquire(), 0.02, ok=True)      # a is warm now, b never answered
+    assert pool.warm() == [a]
+    held = pool.acquire()
+    # b is less loaded but cold: the call goes to a, and b is warmed up once
+    second = pool.acquire()
+    assert held is a and second is a and warming == [b]
+    pool.acquire()
+    assert warming == [b]
+    pool.warmed(b, ok=True)
+    assert pool.acquire() is b and pool.idle(60) == []
+    print("route around cold: ok")
+
+def run_residency_benchmark():
+    import optimized_semantic_service as service
+    from service_logging import logger
+
+    logger.setLevel(logging.CRITICAL)
+    server = start_resident_ollama()
+    url = f"http://127.0.0.1:{server.server_port}"
+    run = int(time.time() * 1000)
+    keep_warm = threading.Thread(target=service.keep_warm_worker, daemon=True)
+
+    for label, keep_alive, keep_warm_idle in [("1s keep-alive", 1, 0),
+                                              ("10s keep-alive", 10, 0),
+                                              ("1s keep-alive, keep-warm pings", 1, 0.5)]:
+        service.OLLAMA_KEEP_ALIVE = keep_alive
+        service.OLLAMA_KEEP_WARM_IDLE = keep_warm_idle or 10 ** 6
+        service.ollama_pool = OllamaPool([url], cold_after=keep_alive, on_cold=service.warm_up_in_background)
+        if keep_warm_idle and not keep_warm.is_alive():
+            keep_warm.start()
+        loads = server.loads
+        # Some traffic first, so the latency window knows a loaded model
+        for i in range(30):
+            service.get_ollama_embedding(f"residency {label} {run} warm {i}")
+        latencies = []
+        for i in range(MESSAGES):
+            time.sleep(IDLE_GAP)
+            start = time.perf_counter()
+            service.get_ollama_embedding(f"residency {label} {run} {i}")
+            latencies.append((time.perf_counter() - start) * 1000)
+        endpoint = service.ollama_pool.endpoints[0]
+        print(f"{label}: message after {IDLE_GAP:.0f}s idle p50 {statistics.median(latencies):.0f}ms, "
+              f"max {max(latencies):.0f}ms, model loads {server.loads - loads}, "
+              f"cold loads detected {endpoint.cold_loads}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    test_cold_load_signature()
+    test_route_around_cold()
+    run_residency_benchmark()
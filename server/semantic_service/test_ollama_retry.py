@@ -0,0 +1,138 @@
+import json
+import logging
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ollama_latency import LatencyWindow
+from ollama_retry import AdaptiveTimeout, RetryBudget, backoff
+
+# Checks the adaptive attempt timeout, the retry budget and the jittered
+# backoff, then runs the optimized service's embedding path against a
+# stand-in Ollama: one that fails every call, to count the load retries add,
+# and one that hangs on an occasional call, to time how long a caller waits.
+# No Ollama installation is needed.
+
+# Configuration
+CALLS = 500
+HANG_EVERY = 250      # The stand-in hangs on every n-th call, beyond its p99, ...
+HANG_SECONDS = 3      # ... for this long
+ANSWER_SECONDS = 0.02
+
+# Stand-in Ollama: answers after ANSWER_SECONDS, or fails or hangs as told
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        with server.lock:
+            server.calls += 1
+            calls = server.calls
+        if server.failing:
+            body, status = b'{"error": "model runner has unexpectedly stopped"}', 500
+        else:
+            time.sleep(HANG_SECONDS if calls % HANG_EVERY == 0 else ANSWER_SECONDS)
+            body, status = json.dumps({"embedding": [0.1] * 768}).encode(), 200
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_fake_ollama():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.calls = 0
+    server.failing = False
+    server.handle_error = lambda request, address: None    # callers that timed out hang up
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_adaptive_timeout():
+    window = LatencyWindow(min_samples=20)
+    timeout = AdaptiveTimeout(window, percentile=99, multiplier=3, floor=0.5, ceiling=30)
+    assert timeout.timeout() == 30      # nothing observed yet: allow a cold model load
+    for _ in range(100):
+        window.record(0.02)
+    assert timeout.timeout() == 0.5     # 3 x 20 ms, held at the floor
+    for _ in range(500):
+        window.record(2.0)
+    assert timeout.timeout() == 6.0
+    for _ in range(500):
+        window.record(20.0)
+    assert timeout.timeout() == 30
+    print("adaptive timeout: ok")
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.1, burst=10)
+    retries = 0
+    for _ in range(1000):
+        budget.record_call()
+        # Every call fails and asks for two retries
+        retries += budget.take()
+        retries += budget.take()
+    assert 109 <= retries <= 110, retries
+    assert budget.denied == 2000 - retries
+    print("retry budget: ok")
+
+def test_backoff():
+    waits = [backoff(retry, 0.25, 2) for retry in (1, 2, 3, 4, 5) for _ in range(200)]
+    assert all(0 <= wait <= 2 for wait in waits)
+    first = [backoff(1, 0.25, 2) for _ in range(200)]
+    assert max(first) <= 0.25 and statistics.pstdev(first) > 0.05   # jittered, not fixed
+    print("backoff: ok")
+
+def run_retry_benchmark():
+    import optimized_semantic_service as service
+    from ollama_circuit import CircuitBreaker
+    from ollama_pool import OllamaPool
+    from service_logging import logger
+
+    logger.setLevel(logging.CRITICAL)
+    server = start_fake_ollama()
+    service.ollama_pool = OllamaPool([f"http://127.0.0.1:{server.server_port}"], eject_failures=10 ** 9)
+    service.EMBEDDING_RETRY_DELAY = 0.001
+    run = int(time.time() * 1000)
+
+    # A failing Ollama: Ollama calls per embedding, with the circuit breaker out of the way
+    server.failing = True
+    for label, budget in [("unbudgeted retries", RetryBudget(ratio=10 ** 9, burst=10 ** 9)),
+                          ("retry budget", RetryBudget(ratio=service.OLLAMA_RETRY_RATIO))]:
+        service.ollama_circuit = CircuitBreaker(10 ** 9, 30)
+        service.ollama_retry_budget = budget
+        server.calls = 0
+        for i in range(CALLS):
+            service.get_ollama_embedding(f"failing {label} {run} {i}")
+        print(f"failing Ollama, {label}: {server.calls / CALLS:.2f} Ollama calls per embedding")
+
+    # An Ollama that hangs now and then: how long callers wait
+    server.failing = False
+    service.ollama_circuit = CircuitBreaker(10 ** 9, 30)
+    service.ollama_retry_budget = RetryBudget(service.OLLAMA_RETRY_RATIO)
+    for label, floor in [("fixed 30s timeout", service.EMBEDDING_TIMEOUT),
+                         ("adaptive timeout", service.EMBEDDING_TIMEOUT_FLOOR)]:
+        window = service.ollama_latency[service.OLLAMA_API_PATH] = LatencyWindow()
+        timeout = service.embedding_timeout = AdaptiveTimeout(window, floor=floor, ceiling=service.EMBEDDING_TIMEOUT)
+        server.calls = 0
+        latencies = []
+        for i in range(CALLS):
+            start = time.perf_counter()
+            service.get_ollama_embedding(f"hanging {label} {run} {i}")
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        print(f"hanging Ollama, {label}: p50 {statistics.median(latencies):.0f}ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.0f}ms, max {latencies[-1]:.0f}ms, "
+              f"attempt timeout now {timeout.timeout():.2f}s")
+    server.shutdown()
+
+if __name__ == "__main__":
+    test_adaptive_timeout()
+    test_retry_budget()
+    test_backoff()
+    run_retry_benchmark()
@@ -0,0 +1,138 @@
+import asyncio
+import statistics
+import threading
+import time
+
+from ollama_scheduler import BACKGROUND, INTERACTIVE, WARMUP, OllamaScheduler, running_as, work_class
+
+# Checks the Ollama scheduler's priority order, slot reservation and
+# background pacing, then measures interactive latency in the optimized
+# service while bulk warmup work runs, with and without the scheduler. The
+# benchmark needs Ollama at the service's OLLAMA_URLS, ideally one with
+# limited parallelism (a busy GPU).
+
+# Configuration
+BULK_THREADS = 4       # Concurrent bulk jobs, e.g. re-embedding a larger bank
+BULK_TEXTS = 400
+INTERACTIVE_CALLS = 40
+OLLAMA_PARALLEL = 2    # Calls the benchmark's Ollama serves at once (its OLLAMA_NUM_PARALLEL)
+
+def test_priority_order():
+    scheduler = OllamaScheduler(max_in_flight=1)
+    assert scheduler.acquire(INTERACTIVE)[0]
+    order = []
+
+    def wait(work):
+        scheduler.acquire(work)
+        order.append(work)
+        scheduler.release(work)
+
+    threads = [threading.Thread(target=wait, args=(work,)) for work in (BACKGROUND, WARMUP, INTERACTIVE)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    assert scheduler.queued() == 3
+    scheduler.release(INTERACTIVE)
+    for thread in threads:
+        thread.join()
+    assert order == [INTERACTIVE, WARMUP, BACKGROUND], order
+    print("priority order: ok")
+
+def test_reserved_slot():
+    scheduler = OllamaScheduler(max_in_flight=3, background_slots=1)
+    assert scheduler.acquire(WARMUP, timeout=0)[0]
+    assert scheduler.acquire(WARMUP, timeout=0)[0]
+    # The last slot is kept for interactive calls
+    assert not scheduler.acquire(WARMUP, timeout=0.01)[0]
+    assert not scheduler.acquire(BACKGROUND, timeout=0.01)[0]
+    assert scheduler.acquire(INTERACTIVE, timeout=0)[0]
+    for work in (WARMUP, WARMUP, INTERACTIVE):
+        scheduler.release(work)
+    assert scheduler.acquire(BACKGROUND, timeout=0)[0]
+    assert not scheduler.acquire(BACKGROUND, timeout=0.01)[0]   # background_slots
+    scheduler.release(BACKGROUND)
+    assert sum(scheduler.in_flight.values()) == 0 and scheduler.queued() == 0
+    print("reserved slot: ok")
+
+def test_background_pacing():
+    scheduler = OllamaScheduler(max_in_flight=4, background_slots=2, background_rate=20)
+    start = time.perf_counter()
+    for _ in range(6):
+        scheduler.acquire(BACKGROUND)
+        scheduler.release(BACKGROUND)
+    elapsed = time.perf_counter() - start
+    # A burst of 2, then one call per 50ms
+    assert 0.18 <= elapsed < 0.5, elapsed
+    print("background pacing: ok")
+
+def test_async_acquire():
+    scheduler = OllamaScheduler(max_in_flight=1)
+
+    async def run():
+        assert (await scheduler.acquire_async(WARMUP))[0]
+        waiter = asyncio.ensure_future(scheduler.acquire_async(INTERACTIVE))
+        await asyncio.sleep(0.01)
+        threading.Thread(target=scheduler.release, args=(WARMUP,)).start()
+        acquired, waited = await waiter
+        assert acquired and waited > 0
+        assert not (await scheduler.acquire_async(WARMUP, timeout=0.01))[0]
+        scheduler.release(INTERACTIVE)
+
+    asyncio.run(run())
+    assert sum(scheduler.in_flight.values()) == 0 and scheduler.queued() == 0
+    print("async acquire: ok")
+
+def test_running_as():
+    assert work_class.get() == INTERACTIVE
+    with running_as(BACKGROUND):
+        assert work_class.get() == BACKGROUND
+    assert work_class.get() == INTERACTIVE
+    print("running as: ok")
+
+def run_bulk_benchmark():
+    import optimized_semantic_service as service
+
+    service.create_app()
+    if service.question_index is None:
+        print("Bulk benchmark skipped: no question index (is Ollama running?)")
+        return
+
+    for label, scheduler in [("no scheduling", OllamaScheduler(max_in_flight=1000)),
+                             ("scheduler", OllamaScheduler(OLLAMA_PARALLEL))]:
+        service.ollama_scheduler = scheduler
+        run = int(time.time() * 1000)
+        stop = threading.Event()
+
+        def bulk(job):
+            with running_as(WARMUP):
+                texts = [f"bulk text {run} {job} {i}" for i in range(BULK_TEXTS)]
+                for i in range(0, len(texts), 10):
+                    if stop.is_set():
+                        return
+                    service.process_embeddings_batch(texts[i:i + 10])
+
+        jobs = [threading.Thread(target=bulk, args=(job,)) for job in range(BULK_THREADS)]
+        for job in jobs:
+            job.start()
+        time.sleep(0.5)
+        latencies = []
+        for i in range(INTERACTIVE_CALLS):
+            start = time.perf_counter()
+            service.get_ollama_embedding(f"interactive message {run} {i}")
+            latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.02)
+        stop.set()
+        for job in jobs:
+            job.join()
+        latencies.sort()
+        print(f"{label}: interactive p50 {statistics.median(latencies):.0f}ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.0f}ms, "
+              f"warmup calls {scheduler.calls[WARMUP]}")
+
+if __name__ == "__main__":
+    test_priority_order()
+    test_reserved_slot()
+    test_background_pacing()
+    test_async_acquire()
+    test_running_as()
+    run_bulk_benchmark()
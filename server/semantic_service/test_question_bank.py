@@ -0,0 +1,105 @@
+from question_bank import QuestionBank
+
+# Checks the interned question and option ids: a category/question pair
+# round-trips through its id, a question whose options are listed under
+# another text resolves to that text's id, option ids are shared between
+# questions, and the bank version changes whenever the bank does. Conversation
+# state in Redis and the journal is namespaced by that version, so a wrong id
+# or an unchanged version would silently orphan or misread stored sessions.
+
+FREQUENCY = ["Not at all", "Several days", "More than half the days", "Nearly every day"]
+SEVERITY = ["None", "Mild", "Severe"]
+
+def bank_data():
+    return {
+        "PHQ-9": ["Little interest or pleasure in doing things?", "Feeling down, depressed, or hopeless?"],
+        "BDI": ["Sadness", "Loss of Pleasure"],
+    }
+
+def resolver(options=None):
+    """Options per question; 'Loss of Pleasure' is listed as 'Loss of pleasure'"""
+    table = {"Sadness": SEVERITY, "Loss of pleasure": options or SEVERITY}
+
+    def resolve(category, question):
+        if category == "PHQ-9":
+            return question, FREQUENCY
+        if question == "Loss of Pleasure":
+            question = "Loss of pleasure"
+        return question, table[question]
+    return resolve
+
+def test_round_trip():
+    bank = QuestionBank(bank_data(), resolver())
+    for category, questions in bank_data().items():
+        for question in questions:
+            question_id = bank.question_id(category, question)
+            assert bank.question_texts[question_id] == question
+            assert bank.question_categories[question_id] == category
+    # Ids number the questions in bank order
+    assert [bank.question_id(category, question) for category, questions in bank_data().items()
+            for question in questions] == [0, 1, 2, 3]
+    assert bank.question_id("PHQ-9", "Sadness") is None
+    assert bank.question_id("BDI", "Unknown") is None
+    print("round trip: ok")
+
+def test_canonical_variant():
+    bank = QuestionBank(bank_data(), resolver())
+    variant = bank.question_id("BDI", "Loss of Pleasure")
+    canonical = bank.canonical(variant)
+    # The text the options are listed under is interned as a question of its own
+    assert canonical != variant and bank.question_texts[canonical] == "Loss of pleasure"
+    assert bank.question_categories[canonical] == "BDI"
+    assert bank.question_id("BDI", "Loss of pleasure") == canonical and bank.canonical(canonical) == canonical
+    assert bank.options(variant) == bank.options(canonical) == SEVERITY
+    sadness = bank.question_id("BDI", "Sadness")
+    assert bank.canonical(sadness) == sadness
+    assert len(bank) == 5
+    print("canonical variant: ok")
+
+def test_option_ids():
+    bank = QuestionBank(bank_data(), resolver())
+    first, second = (bank.question_id("PHQ-9", question) for question in bank_data()["PHQ-9"])
+    assert bank.options(first) == FREQUENCY
+    # The same option texts share ids across questions
+    assert bank.option_ids(first) == bank.option_ids(second)
+    assert [bank.option_texts[option_id] for option_id in bank.option_ids(first)] == FREQUENCY
+    sadness = bank.question_id("BDI", "Sadness")
+    assert set(bank.option_ids(sadness)).isdisjoint(bank.option_ids(first))
+    print("option ids: ok")
+
+def test_version():
+    version = QuestionBank(bank_data(), resolver()).version
+    assert QuestionBank(bank_data(), resolver()).version == version
+    reordered = bank_data()
+    reordered["PHQ-9"].reverse()
+    added = bank_data()
+    added["BDI"].append("Pessimism")
+    changed = [
+        QuestionBank(reordered, resolver()),
+        QuestionBank(added, lambda category, question: (question, SEVERITY)
+                     if question == "Pessimism" else resolver()(category, question)),
+        QuestionBank(bank_data(), resolver(options=["None", "Mild", "Very severe"])),
+        QuestionBank({"PHQ-9": bank_data()["PHQ-9"]}, resolver()),
+    ]
+    assert all(bank.version != version for bank in changed)
+    assert len({bank.version for bank in changed}) == len(changed)
+    print("version: ok")
+
+def test_service_bank():
+    import optimized_semantic_service as service
+
+    bank = service.question_bank
+    for category, questions in service.questions_data.items():
+        for question in questions:
+            question_id = bank.question_id(category, question)
+            canonical, options = service.resolve_question_options(category, question)
+            assert bank.question_texts[bank.canonical(question_id)] == canonical
+            assert bank.options(question_id) == list(options)
+    print("service bank: ok")
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_canonical_variant()
+    test_option_ids()
+    test_version()
+    test_service_bank()
@@ -0,0 +1,131 @@
+import json
+import time
+
+import numpy as np
+from flask import Flask, jsonify
+
+import serialization
+from serialization import (JSON_TYPE, MSGPACK_TYPE, decode_body, embedding_from_json, embeddings_from_json,
+                           encode_body, prefers_msgpack)
+
+# Checks content negotiation, embedding decoding and the JSON 400 answers of
+# both services to bodies that do not decode or lack a 'message' string,
+# then measures the CPU a
+# request spends on (de)serialization before and after the fast codecs: one
+# Ollama embedding decoded, the request body parsed and the response encoded.
+
+# Configuration
+DIM = 768
+SAMPLES = 5000
+ROUNDS = 3
+
+PAYLOAD = {"success": True, "mappingType": "option", "questionId": 15,
+           "question": "Feeling tired or having little energy?", "category": "PHQ-9",
+           "optionId": 2, "mappedOption": "More than half the days", "score": 2, "confidence": 0.8734}
+REQUEST = {"message": "more than half the days I feel drained", "conversationId": "c-1234",
+           "mappingType": "auto", "debug": False}
+
+def test_negotiation():
+    if serialization.msgpack is None:
+        assert not prefers_msgpack(MSGPACK_TYPE)
+        print("negotiation: skipped (msgpack is not installed)")
+        return
+    assert prefers_msgpack(MSGPACK_TYPE)
+    assert prefers_msgpack("application/x-msgpack, application/json;q=0.5")
+    assert not prefers_msgpack("application/json, application/msgpack;q=0.5")
+    assert not prefers_msgpack("*/*")
+    assert not prefers_msgpack(None)
+    body, content_type = encode_body(PAYLOAD, MSGPACK_TYPE)
+    assert content_type == MSGPACK_TYPE and decode_body(body, MSGPACK_TYPE) == PAYLOAD
+    body, content_type = encode_body(PAYLOAD, "*/*")
+    assert content_type == JSON_TYPE and json.loads(body) == PAYLOAD
+    assert decode_body(b"", JSON_TYPE) is None
+    print("negotiation: ok")
+
+def test_numpy_values():
+    body, _ = encode_body({"score": np.float32(0.5), "ids": np.arange(3)})
+    assert json.loads(body) == {"score": 0.5, "ids": [0, 1, 2]}
+    print("numpy values: ok")
+
+def test_embedding_decoding():
+    vector = np.random.default_rng(0).standard_normal(DIM).astype(np.float32)
+    embedding = embedding_from_json(json.dumps({"embedding": vector.tolist()}).encode())
+    assert embedding.dtype == np.float32 and np.array_equal(embedding, vector)
+    rows = embeddings_from_json(json.dumps({"model": "m", "embeddings": [vector.tolist()] * 3}).encode())
+    assert rows.shape == (3, DIM) and rows.dtype == np.float32
+    print("embedding decoding: ok")
+
+def run_benchmark():
+    app = Flask(__name__)
+    ollama_body = json.dumps({"embedding": np.random.default_rng(1).standard_normal(DIM).tolist()}).encode()
+    json_request = json.dumps(REQUEST).encode()
+    msgpack_request = serialization.msgpack.packb(REQUEST) if serialization.msgpack else None
+
+    def before():
+        np.array(json.loads(ollama_body)["embedding"])
+        json.loads(json_request)
+        jsonify(PAYLOAD).get_data()
+
+    def after(request_body, content_type):
+        embedding_from_json(ollama_body)
+        decode_body(request_body, content_type)
+        encode_body(PAYLOAD, content_type)
+
+    cases = [("json module + jsonify", before),
+             ("fast JSON", lambda: after(json_request, JSON_TYPE))]
+    if msgpack_request is not None:
+        cases.append(("MessagePack", lambda: after(msgpack_request, MSGPACK_TYPE)))
+    with app.app_context():
+        for label, run in cases:
+            best = float("inf")
+            for _ in range(ROUNDS):
+                start = time.process_time()
+                for _ in range(SAMPLES):
+                    run()
+                best = min(best, (time.process_time() - start) / SAMPLES)
+            print(f"{label}: {best * 1e6:.1f}us CPU per request")
+
+MALFORMED = [("not json", JSON_TYPE), (b"\xc1", MSGPACK_TYPE), ("[1, 2]", JSON_TYPE),
+             ('{"message": 5}', JSON_TYPE), ('{"text": "hello"}', JSON_TYPE)]
+
+def check_malformed(status, body, headers, case):
+    assert status == 400 and body["success"] is False and body["message"], (case, status, body)
+    assert "Server-Timing" in headers and "X-Request-ID" in headers, case
+
+def test_malformed_bodies():
+    import optimized_semantic_service as service
+
+    client = service.app.test_client()
+    for route in ('/map-response', '/map-turn'):
+        for body, content_type in MALFORMED:
+            if content_type == MSGPACK_TYPE and serialization.msgpack is None:
+                continue
+            response = client.post(route, data=body, content_type=content_type)
+            check_malformed(response.status_code, response.get_json(), response.headers, (route, body))
+    print("malformed bodies (sync): ok")
+
+def test_malformed_bodies_async():
+    import asyncio
+    import async_semantic_service
+
+    async def check():
+        async with async_semantic_service.app.test_app() as test_app:
+            client = test_app.test_client()
+            for route in ('/map-response', '/map-turn'):
+                for body, content_type in MALFORMED:
+                    if content_type == MSGPACK_TYPE and serialization.msgpack is None:
+                        continue
+                    response = await client.post(route, data=body, headers={"Content-Type": content_type})
+                    check_malformed(response.status_code, await response.get_json(), response.headers,
+                                    (route, body))
+
+    asyncio.run(check())
+    print("malformed bodies (async): ok")
+
+if __name__ == "__main__":
+    test_negotiation()
+    test_numpy_values()
+    test_embedding_decoding()
+    test_malformed_bodies()
+    test_malformed_bodies_async()
+    run_benchmark()
@@ -0,0 +1,134 @@
+import json
+import logging
+import queue
+import time
+
+import service_logging
+from service_logging import (MAX_TRACE_ID_LENGTH, TRACE_HEADER, DeferredQueueHandler, JsonFormatter, collect_fields,
+                             logger, make_trace_id, note, request_log, trace_headers)
+
+# Checks the structured request log: sampling of successful requests while
+# errors and slow requests are always kept, note() fields, and trace ids
+# (the caller's kept when sane, replaced when too long or unprintable). The
+# records the request path queues are captured and formatted as the listener
+# thread would format them.
+
+class captured_records:
+    """Queue the logger's records for the block; yields a function returning them as dicts"""
+
+    def __enter__(self):
+        self.queue = queue.Queue()
+        self.saved = list(logger.handlers), logger.level, logger.propagate
+        for handler in self.saved[0]:
+            logger.removeHandler(handler)
+        logger.addHandler(DeferredQueueHandler(self.queue))
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        return self.records
+
+    def records(self):
+        formatter = JsonFormatter()
+        entries = []
+        while not self.queue.empty():
+            entries.append(json.loads(formatter.format(self.queue.get_nowait())))
+        return entries
+
+    def __exit__(self, *exc_info):
+        handlers, level, propagate = self.saved
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        for handler in handlers:
+            logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = propagate
+
+class log_settings:
+    """Override the sampling settings of service_logging for the block"""
+
+    def __init__(self, sample_rate, slow_ms):
+        self.values = {"LOG_SAMPLE_RATE": sample_rate, "LOG_SLOW_REQUEST_MS": slow_ms}
+
+    def __enter__(self):
+        self.saved = {name: getattr(service_logging, name) for name in self.values}
+        for name, value in self.values.items():
+            setattr(service_logging, name, value)
+
+    def __exit__(self, *exc_info):
+        for name, value in self.saved.items():
+            setattr(service_logging, name, value)
+
+def test_sampling():
+    with captured_records() as records, log_settings(sample_rate=0, slow_ms=50):
+        with request_log('/map-response') as log:
+            log["status"] = 200
+        assert records() == []
+        with request_log('/map-response') as log:
+            log["status"] = 503
+        with request_log('/map-response') as log:
+            time.sleep(0.06)
+            log["status"] = 200
+        try:
+            with request_log('/map-turn'):
+                raise RuntimeError("mapping failed")
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("request_log swallowed the exception")
+        # Client errors are sampled like successes
+        with request_log('/map-response') as log:
+            log["status"] = 400
+        entries = records()
+    assert [(entry["route"], entry["status"], entry["level"]) for entry in entries] == [
+        ('/map-response', 503, "ERROR"), ('/map-response', 200, "INFO"), ('/map-turn', 500, "ERROR")]
+    assert entries[1]["durationMs"] >= 50
+    with captured_records() as records, log_settings(sample_rate=1, slow_ms=1000):
+        with request_log('/map-response') as log:
+            log["status"] = 200
+        assert len(records()) == 1
+    print("sampling: ok")
+
+def test_note_fields():
+    with captured_records() as records, log_settings(sample_rate=1, slow_ms=1000):
+        note(ignored=True)  # Outside a request: no effect
+        with request_log('/map-turn', extra="field") as log:
+            note(decision="option", questionId=3)
+            with collect_fields() as item:
+                note(itemField=1)
+            log["status"] = 200
+        entries = records()
+    assert item == {"itemField": 1}
+    assert len(entries) == 1 and entries[0]["msg"] == "request"
+    entry = entries[0]
+    assert (entry["decision"], entry["questionId"], entry["extra"]) == ("option", 3, "field")
+    assert "itemField" not in entry and "ignored" not in entry
+    print("note fields: ok")
+
+def test_trace_ids():
+    assert make_trace_id("abc-123") == "abc-123"
+    for bad in ["x" * (MAX_TRACE_ID_LENGTH + 1), "bad\nid", "naïve", "", None]:
+        trace_id = make_trace_id(bad)
+        assert trace_id != bad and len(trace_id) == 16 and int(trace_id, 16) >= 0, bad
+    assert make_trace_id("x" * MAX_TRACE_ID_LENGTH) == "x" * MAX_TRACE_ID_LENGTH
+
+    assert trace_headers() is None
+    with captured_records() as records, log_settings(sample_rate=1, slow_ms=1000):
+        with request_log('/map-response', "caller-trace") as log:
+            assert trace_headers() == {TRACE_HEADER: "caller-trace"}
+            logger.warning("inside the request")
+            log["status"] = 200
+        logger.warning("after the request")
+        with request_log('/map-response', "y" * 500) as log:
+            log["status"] = 200
+        entries = records()
+    assert trace_headers() is None
+    # Records logged while the request runs carry its trace id, later ones none
+    assert entries[0]["msg"] == "inside the request" and entries[0]["traceId"] == "caller-trace"
+    assert entries[1]["msg"] == "request" and entries[1]["traceId"] == "caller-trace"
+    assert entries[2]["msg"] == "after the request" and "traceId" not in entries[2]
+    assert len(entries[3]["traceId"]) == 16
+    print("trace ids: ok")
+
+if __name__ == "__main__":
+    test_sampling()
+    test_note_fields()
+    test_trace_ids()
@@ -0,0 +1,156 @@
+import multiprocessing
+import time
+
+import numpy as np
+
+from shared_embedding_cache import SharedEmbeddingCache
+
+# Checks the embedding cache shared by forked workers: entries one worker
+# puts are seen by the others, a claimed key makes other workers wait for
+# its result instead of embedding it again, a released claim is taken over,
+# and a full cache evicts ready entries but never pending ones. The benchmark
+# then sends the same Zipf-distributed stream of messages to forked workers
+# with a cache each and with the shared cache, and compares hit rates. No
+# Ollama is needed.
+
+# Configuration
+DIM = 16
+WORKERS = 4
+KEYS_PER_WORKER = 50
+BENCHMARK_REQUESTS = 20000
+BENCHMARK_DISTINCT = 5000
+ZIPF_EXPONENT = 1.1
+SEED = 5
+
+fork = multiprocessing.get_context("fork")
+
+def vector_of(key):
+    return np.full(DIM, float(sum(key.encode()) % 97), dtype=np.float32)
+
+def put_then_read(cache, worker, barrier, results):
+    own = [f"worker {worker} key {i}" for i in range(KEYS_PER_WORKER)]
+    for key in own:
+        claimed, _ = cache.claim(key)
+        assert claimed
+        assert cache.put(key, vector_of(key))
+    barrier.wait()
+    others = [f"worker {other} key {i}" for other in range(WORKERS) if other != worker
+              for i in range(KEYS_PER_WORKER)]
+    seen = sum(1 for key in others
+               if (vector := cache.get(key)) is not None and np.array_equal(vector, vector_of(key)))
+    results.put((worker, seen, len(others)))
+
+def test_workers_share_entries():
+    cache = SharedEmbeddingCache(4096, DIM)
+    barrier, results = fork.Barrier(WORKERS), fork.Queue()
+    workers = [fork.Process(target=put_then_read, args=(cache, worker, barrier, results))
+               for worker in range(WORKERS)]
+    for process in workers:
+        process.start()
+    seen = [results.get(timeout=30) for _ in workers]
+    for process in workers:
+        process.join()
+        assert process.exitcode == 0
+    assert all(count == total for _, count, total in seen), seen
+    assert cache.stats()["entries"] == WORKERS * KEYS_PER_WORKER
+    print("workers share entries: ok")
+
+def wait_for_claimed(cache, results):
+    results.put(cache.claim("being embedded")[0])
+    started = time.monotonic()
+    vector = cache.wait("being embedded", timeout=5)
+    results.put((vector is not None and np.array_equal(vector, vector_of("being embedded")),
+                 time.monotonic() - started))
+
+def test_claim_wait_release():
+    cache = SharedEmbeddingCache(64, DIM)
+    assert cache.claim("being embedded") == (True, None)
+    results = fork.Queue()
+    process = fork.Process(target=wait_for_claimed, args=(cache, results))
+    process.start()
+    # The other worker may not claim a key this one is computing ...
+    assert results.get(timeout=10) is False
+    time.sleep(0.2)
+    assert cache.put("being embedded", vector_of("being embedded"))
+    # ... and waits for its result instead
+    received, waited = results.get(timeout=10)
+    process.join()
+    assert received and waited >= 0.1, (received, waited)
+    claimed, vector = cache.claim("being embedded")
+    assert not claimed and np.array_equal(vector, vector_of("being embedded"))
+
+    # A released claim is taken over at once, and a waiter stops waiting
+    assert cache.claim("failed call") == (True, None)
+    assert cache.claim("failed call") == (False, None)
+    cache.release("failed call")
+    started = time.monotonic()
+    assert cache.wait("failed call", timeout=5) is None
+    assert time.monotonic() - started < 1
+    assert cache.claim("failed call") == (True, None)
+    print("claim, wait and release: ok")
+
+def test_full_cache():
+    cache = SharedEmbeddingCache(8, DIM)
+    assert cache.capacity == 8
+    for i in range(8):
+        assert cache.put(f"ready {i}", vector_of(f"ready {i}"))
+    # Full of ready entries: a new key evicts one of them
+    assert cache.put("newcomer", vector_of("newcomer"))
+    assert cache.stats()["entries"] == 8
+    assert np.array_equal(cache.get("newcomer"), vector_of("newcomer"))
+    assert sum(cache.get(f"ready {i}") is not None for i in range(8)) == 7
+    # Pending entries are never evicted: with every slot claimed, nothing is stored
+    for i in range(8):
+        assert cache.claim(f"pending {i}") == (True, None)
+    assert cache.claim("no room") == (False, None)
+    assert not cache.put("no room", vector_of("no room"))
+    assert cache.get("no room") is None
+    # A vector of the wrong size is refused and its claim released
+    assert not cache.put("pending 0", np.zeros(DIM + 1))
+    assert cache.claim("pending 0") == (True, None)
+    print("full cache: ok")
+
+def zipf_stream():
+    rng = np.random.default_rng(SEED)
+    weights = 1 / np.arange(1, BENCHMARK_DISTINCT + 1) ** ZIPF_EXPONENT
+    return rng.choice(BENCHMARK_DISTINCT, BENCHMARK_REQUESTS, p=weights / weights.sum())
+
+def serve_share(cache, worker, stream, results):
+    """Serve every WORKERS-th request of the stream, as a load balancer would"""
+    local, hits = {}, 0
+    for key in stream[worker::WORKERS]:
+        key = f"message {key}"
+        if cache is None:
+            hits += key in local
+            local[key] = True
+            continue
+        claimed, vector = cache.claim(key)
+        if claimed:
+            cache.put(key, vector_of(key))
+        elif vector is not None or cache.wait(key, timeout=1) is not None:
+            hits += 1
+    results.put(hits)
+
+def run_hit_rate_benchmark():
+    stream = zipf_stream()
+    print(f"{BENCHMARK_REQUESTS} requests over {BENCHMARK_DISTINCT} distinct messages, {WORKERS} workers")
+    for label, cache in [("a cache per worker", None),
+                         ("shared cache", SharedEmbeddingCache(2 * BENCHMARK_DISTINCT, DIM))]:
+        results = fork.Queue()
+        workers = [fork.Process(target=serve_share, args=(cache, worker, stream, results))
+                   for worker in range(WORKERS)]
+        for process in workers:
+            process.start()
+        hits = sum(results.get(timeout=60) for _ in workers)
+        for process in workers:
+            process.join()
+        print(f"{label}: hit rate {hits / BENCHMARK_REQUESTS:.3f}, {BENCHMARK_REQUESTS - hits} embeddings computed")
+    # Upper bound: one process seeing every request
+    distinct = len(set(stream.tolist()))
+    print(f"single process: hit rate {1 - distinct / BENCHMARK_REQUESTS:.3f}, {distinct} embeddings computed")
+
+if __name__ == "__main__":
+    test_workers_share_entries()
+    test_claim_wait_release()
+    test_full_cache()
+    run_hit_rate_benchmark()
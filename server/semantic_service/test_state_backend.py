@@ -0,0 +1,210 @@
+import asyncio
+import socketserver
+import threading
+import time
+
+import redis_state_backend
+from conversation_store import InMemoryStateBackend, SessionState, create_state_backend, encode_state, decode_state
+
+# Exercises both conversation state backends. The Redis backend runs against a
+# small stand-in RESP server so no Redis installation is needed.
+
+# Stand-in server supporting the commands the backend uses
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            self.server.commands.append(command)
+            time.sleep(self.server.delay)
+            now = time.monotonic()
+            for key in [k for k, (_, expires) in store.items() if expires <= now]:
+                del store[key]
+            if command == b"PING":
+                reply = b"+PONG\r\n"
+            elif command == b"SET":
+                options = [arg.upper() for arg in args[3:]]
+                ttl = 1e9
+                if b"EX" in options:
+                    ttl = int(args[3 + options.index(b"EX") + 1])
+                elif b"PX" in options:
+                    ttl = int(args[3 + options.index(b"PX") + 1]) / 1000
+                if b"NX" in options and args[1] in store:
+                    reply = b"$-1\r\n"
+                else:
+                    store[args[1]] = (args[2], now + ttl)
+                    reply = b"+OK\r\n"
+            elif command == b"EVAL":
+                # Only the backend's lock release script: delete if the value matches
+                key, token = args[3], args[4]
+                deleted = store.get(key, (None,))[0] == token
+                if deleted:
+                    del store[key]
+                reply = b":%d\r\n" % deleted
+            elif command == b"GET":
+                reply = self.bulk(store.get(args[1], (None,))[0])
+            elif command == b"MGET":
+                reply = b"*%d\r\n" % (len(args) - 1) + b"".join(self.bulk(store.get(k, (None,))[0]) for k in args[1:])
+            elif command == b"DEL":
+                reply = b":%d\r\n" % (store.pop(args[1], None) is not None)
+            elif command == b"EXPIRE":
+                found = args[1] in store
+                if found:
+                    store[args[1]] = (store[args[1]][0], now + int(args[2]))
+                reply = b":%d\r\n" % found
+            else:
+                reply = b"-ERR unknown command\r\n"
+            self.wfile.write(reply)
+
+    @staticmethod
+    def bulk(value):
+        if value is None:
+            return b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+def start_fake_redis():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.store = {}
+    server.commands = []
+    server.delay = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def exercise_backend(backend):
+    state = SessionState(0, int(time.time()))
+    assert backend.get("missing") is None
+    backend.set("conv-1", state)
+    backend.set("conv-2", SessionState(40, int(time.time())))
+    assert backend.get("conv-1") == state
+    assert "conv-1" in backend
+    assert set(backend.get_many(["conv-1", "conv-2", "missing"])) == {"conv-1", "conv-2"}
+    with backend.lock("conv-1"):
+        assert backend.pop("conv-1") == state
+    assert backend.pop("conv-1") is None
+    assert backend.get("conv-1") is None
+
+def test_codec():
+    state = SessionState(31, int(time.time()))
+    assert decode_state(encode_state(state)) == state
+    assert len(encode_state(state)) == 8
+
+def test_memory_backend():
+    exercise_backend(InMemoryStateBackend(max_entries=10, ttl=60))
+
+def test_redis_backend():
+    server = start_fake_redis()
+    try:
+        backend = create_state_backend(f"redis://127.0.0.1:{server.server_address[1]}/0", ttl=60)
+        assert backend.ping()
+        exercise_backend(backend)
+        # get_many is one pipelined round trip: MGET plus one EXPIRE per key
+        del server.commands[:]
+        backend.get_many(["a", "b", "c"])
+        assert server.commands == [b"MGET", b"EXPIRE", b"EXPIRE", b"EXPIRE"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_redis_lock_across_nodes():
+    # Two backends on one server stand for two nodes handling one conversation
+    server = start_fake_redis()
+    url = f"redis://127.0.0.1:{server.server_address[1]}/0"
+    try:
+        first, second = create_state_backend(url, ttl=60), create_state_backend(url, ttl=60)
+        order = []
+
+        def turn(backend, name, conversation_id="conv-1"):
+            with backend.lock(conversation_id):
+                order.append(f"{name} start")
+                time.sleep(0.1)
+                order.append(f"{name} end")
+
+        with first.lock("conv-1"):
+            # Re-entrant within a thread
+            with first.lock("conv-1"):
+                pass
+            other = threading.Thread(target=turn, args=(second, "second"))
+            other.start()
+            time.sleep(0.1)
+            order.append("first end")
+        other.join()
+        assert order == ["first end", "second start", "second end"], order
+        assert not any(key.endswith(b":lock") for key in server.store)
+
+        # A lock outlived by its holder expires, and the late release leaves the new holder's lock alone
+        redis_state_backend.LOCK_TTL_MS = 100
+        try:
+            with first.lock("conv-2"):
+                time.sleep(0.2)
+                redis_state_backend.LOCK_TTL_MS = 5000
+                other = threading.Thread(target=turn, args=(second, "late", "conv-2"))
+                other.start()
+                time.sleep(0.05)
+            assert server.store[second._key("conv-2") + b":lock"]
+            other.join()
+        finally:
+            redis_state_backend.LOCK_TTL_MS = 5000
+        assert first.stats()["lockTimeouts"] == 0 and second.stats()["lockTimeouts"] == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_async_state_off_the_loop():
+    # With Redis, the async service must not block its event loop on state round trips
+    import async_semantic_service
+    server = start_fake_redis()
+    server.delay = 0.05
+    backend = create_state_backend(f"redis://127.0.0.1:{server.server_address[1]}/0", ttl=60)
+    saved = async_semantic_service.service.conversation_state
+    async_semantic_service.service.conversation_state = backend
+
+    async def check():
+        gaps, done = [], False
+
+        async def ticker():
+            last = time.perf_counter()
+            while not done:
+                await asyncio.sleep(0.005)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        task = asyncio.create_task(ticker())
+        await asyncio.gather(*(async_semantic_service.with_state(backend.get, f"conv-{i}") for i in range(8)))
+        done = True
+        await task
+        return max(gaps)
+
+    try:
+        assert asyncio.run(check()) < 0.04
+    finally:
+        async_semantic_service.service.conversation_state = saved
+        server.shutdown()
+        server.server_close()
+
+def test_redis_backend_unavailable():
+    # A dead backend degrades to "no state" instead of failing requests
+    backend = create_state_backend("redis://127.0.0.1:1/0", ttl=60)
+    assert backend.get("conv-1") is None
+    backend.set("conv-1", SessionState(3, int(time.time())))
+    assert backend.stats()["errors"] == 2
+
+if __name__ == "__main__":
+    for test in [test_codec, test_memory_backend, test_redis_backend, test_redis_lock_across_nodes,
+                 test_async_state_off_the_loop, test_redis_backend_unavailable]:
+        test()
+        print(f"{test.__name__}: OK")
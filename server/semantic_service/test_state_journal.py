@@ -0,0 +1,121 @@
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from conversation_store import InMemoryStateBackend, SessionState
+from state_journal import JournaledStateStore
+
+# Benchmarks the conversation state journal: write overhead on the request path
+# and recovery time against the number of tracked sessions.
+
+# Configuration
+WRITE_SAMPLES = 20000
+SESSION_COUNTS = [10000, 100000, 1000000]
+JOURNAL_TAIL = 0.05          # Share of writes left in the journal after the last snapshot
+
+STATES = [SessionState(i, int(time.time())) for i in range(47)]
+
+def write_latencies(store):
+    latencies = []
+    for i in range(WRITE_SAMPLES):
+        start = time.perf_counter()
+        store.set(f"conversation-{i}", STATES[i % len(STATES)])
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return latencies
+
+def test_recovery_roundtrip():
+    directory = tempfile.mkdtemp(prefix="state-journal-")
+    try:
+        store = JournaledStateStore(directory, ttl=60)
+        store.set("a", STATES[0])
+        store.set("b", STATES[1])
+        store.set("c", STATES[2])
+        store.pop("b")
+        store.journal.compact()
+        store.set("c", STATES[3])
+        store.set("d", STATES[4])
+
+        restored = JournaledStateStore(directory, ttl=60)
+        assert restored.get("a") == STATES[0]
+        assert restored.get("b") is None
+        assert restored.get("c") == STATES[3]
+        assert restored.get("d") == STATES[4]
+        assert len(restored) == 3
+    finally:
+        shutil.rmtree(directory)
+
+def test_sliding_expiry_survives_restart():
+    directory = tempfile.mkdtemp(prefix="state-journal-")
+    try:
+        store = JournaledStateStore(directory, ttl=4)
+        store.set("read", STATES[0])
+        store.set("unread", STATES[1])
+        time.sleep(1.5)
+        # Reading slides the expiry; the new one is journaled
+        assert store.get("read") == STATES[0]
+        assert store.refreshes == 1
+        assert store.get("read") == STATES[0] and store.refreshes == 1
+        time.sleep(2.7)
+        restored = JournaledStateStore(directory, ttl=4)
+        assert restored.get("read") == STATES[0]
+        assert restored.get("unread") is None
+    finally:
+        shutil.rmtree(directory)
+
+def test_evictions_are_journaled():
+    directory = tempfile.mkdtemp(prefix="state-journal-")
+    try:
+        store = JournaledStateStore(directory, max_entries=2, shards=1, ttl=60)
+        for i, name in enumerate("abc"):
+            store.set(name, STATES[i])
+        assert store.evictions == 1 and store.get("a") is None
+        restored = JournaledStateStore(directory, max_entries=2, shards=1, ttl=60)
+        assert restored.get("a") is None
+        assert restored.get("b") == STATES[1] and restored.get("c") == STATES[2]
+        assert len(restored) == 2
+    finally:
+        shutil.rmtree(directory)
+
+def run_journal_benchmark():
+    print(f"Write latency ({WRITE_SAMPLES} set() calls)")
+    directory = tempfile.mkdtemp(prefix="state-journal-")
+    try:
+        for name, store in [("memory", InMemoryStateBackend(max_entries=WRITE_SAMPLES)),
+                            ("journal", JournaledStateStore(directory, max_entries=WRITE_SAMPLES))]:
+            latencies = sorted(write_latencies(store))
+            print(f"  {name:>8}: p50 {statistics.median(latencies):.2f} us, "
+                  f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f} us")
+    finally:
+        shutil.rmtree(directory)
+
+    print(f"\nRecovery time (snapshot + {JOURNAL_TAIL:.0%} of sessions as journal records)")
+    print(f"{'sessions':>10} {'snapshot MB':>12} {'recovery ms':>12}")
+    for count in SESSION_COUNTS:
+        directory = tempfile.mkdtemp(prefix="state-journal-")
+        try:
+            # Headroom so uneven shards do not evict
+            store = JournaledStateStore(directory, max_entries=count * 2)
+            snapshotted = int(count * (1 - JOURNAL_TAIL))
+            for i in range(snapshotted):
+                store.set(f"conversation-{i}", STATES[i % len(STATES)])
+            store.journal.compact()
+            for i in range(snapshotted, count):
+                store.set(f"conversation-{i}", STATES[i % len(STATES)])
+            del store
+
+            start = time.perf_counter()
+            restored = JournaledStateStore(directory, max_entries=count * 2)
+            elapsed = (time.perf_counter() - start) * 1000
+            assert len(restored) == count
+            size = os.path.getsize(os.path.join(directory, "snapshot")) / 1e6
+            print(f"{count:>10} {size:>12.1f} {elapsed:>12.1f}")
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_recovery_roundtrip()
+    test_sliding_expiry_survives_restart()
+    test_evictions_are_journaled()
+    run_journal_benchmark()
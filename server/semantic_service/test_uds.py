@@ -0,0 +1,155 @@
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Compares per-call latency over loopback TCP and a Unix domain socket, each
+# with a new connection per call and with one persistent connection per
+# client. Starts the optimized service under Gunicorn on both (needs gunicorn
+# and Ollama, or the embedding artifact, for warmup).
+
+# Configuration
+PORT = 5077
+CLIENTS = 8          # Concurrent callers, like a busy chat server
+CALLS = 500          # Calls per client
+WORKERS = 2
+
+BODY = json.dumps({"message": "I feel tired all the time", "conversationId": "uds-bench",
+                   "mappingType": "question"}).encode()
+HEADERS = {"Content-Type": "application/json"}
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a Unix domain socket; the host only fills the Host header"""
+
+    def __init__(self, path, timeout=10):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+REQUESTS = {"/healthz": ("GET", "/healthz", None, {}),
+            "/map-response (cached)": ("POST", "/map-response", BODY, HEADERS)}
+
+
+def start_gunicorn(env):
+    return subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"], env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def test_unix_socket_keep_alive():
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        import pytest
+        pytest.skip("gunicorn is not installed")
+    socket_path = os.path.join(tempfile.mkdtemp(), "semantic.sock")
+    server = start_gunicorn(dict(os.environ, SEMANTIC_SERVICE_BIND="", SEMANTIC_SERVICE_SOCKET=socket_path,
+                                 SEMANTIC_SERVICE_WORKERS="1", LOG_LEVEL="WARNING",
+                                 SEMANTIC_SERVICE_APP="optimized_semantic_service:create_app(preload=False)"))
+    connection = UnixHTTPConnection(socket_path)
+    try:
+        deadline = time.monotonic() + 60
+        while not os.path.exists(socket_path):
+            assert server.poll() is None and time.monotonic() < deadline, "gunicorn did not start"
+            time.sleep(0.1)
+        sockets = []
+        for _ in range(2):
+            connection.request("GET", "/healthz")
+            response = connection.getresponse()
+            response.read()
+            assert response.status == 200, response.status
+            assert not response.will_close, response.getheaders()
+            sockets.append(connection.sock)
+        # http.client opens a new socket for a call after the server closed the connection
+        assert sockets[0] is not None and sockets[0] is sockets[1]
+    finally:
+        connection.close()
+        server.terminate()
+        server.wait()
+    print("Unix socket keep-alive: ok")
+
+
+def call(connection, request):
+    connection.request(*request)
+    response = connection.getresponse()
+    response.read()
+    assert response.status == 200, response.status
+
+
+def client(connect, persistent, request):
+    latencies = []
+    connection = connect() if persistent else None
+    for _ in range(CALLS):
+        start = time.perf_counter()
+        if persistent:
+            call(connection, request)
+        else:
+            fresh = connect()
+            call(fresh, request)
+            fresh.close()
+        latencies.append(time.perf_counter() - start)
+    if connection is not None:
+        connection.close()
+    return latencies
+
+
+def wait_ready(connect, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = connect()
+            connection.request("GET", "/readyz")
+            if connection.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def run_benchmark():
+    socket_path = os.path.join(tempfile.mkdtemp(), "semantic.sock")
+    env = dict(os.environ, SEMANTIC_SERVICE_BIND=f"127.0.0.1:{PORT}", SEMANTIC_SERVICE_SOCKET=socket_path,
+               SEMANTIC_SERVICE_WORKERS=str(WORKERS), LOG_LEVEL="WARNING")
+    server = start_gunicorn(env)
+    tcp = lambda: http.client.HTTPConnection("127.0.0.1", PORT, timeout=10)
+    uds = lambda: UnixHTTPConnection(socket_path)
+    try:
+        if not (wait_ready(tcp) and wait_ready(uds)):
+            print("Skipped: the service did not become ready")
+            return
+        for name, request in REQUESTS.items():
+            for connect in (tcp, uds):
+                client(connect, True, request)    # warm the caches
+            for label, connect, persistent in [("TCP, new connection per call", tcp, False),
+                                               ("TCP, keep-alive", tcp, True),
+                                               ("UDS, new connection per call", uds, False),
+                                               ("UDS, keep-alive", uds, True)]:
+                start = time.perf_counter()
+                with ThreadPoolExecutor(CLIENTS) as pool:
+                    runs = list(pool.map(lambda _: client(connect, persistent, request), range(CLIENTS)))
+                elapsed = time.perf_counter() - start
+                latencies = sorted(seconds * 1e6 for run in runs for seconds in run)
+                print(f"{name}, {label}: p50 {statistics.median(latencies):.0f}us, "
+                      f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.0f}us, "
+                      f"{len(latencies) / elapsed:.0f} calls/s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    test_unix_socket_keep_alive()
+    run_benchmark()
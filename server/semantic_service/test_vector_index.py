@@ -0,0 +1,94 @@
+import time
+import statistics
+import numpy as np
+
+from vector_index import build_index, normalize_rows
+
+# Configuration
+BANK_SIZES = [47, 1000, 10000, 50000]
+EMBEDDING_DIM = 768          # nomic-embed-text embedding size
+NUM_QUERIES = 200
+RECALL_K = 5
+NUM_TOPICS = 300             # Paraphrase sets cluster around shared topics
+
+# Generate a synthetic bank that clusters like real paraphrase sets do
+def make_bank(size, rng):
+    topics = rng.standard_normal((NUM_TOPICS, EMBEDDING_DIM)).astype(np.float32)
+    members = rng.integers(0, NUM_TOPICS, size)
+    noise = rng.standard_normal((size, EMBEDDING_DIM)).astype(np.float32) * 0.6
+    return topics[members] + noise
+
+def make_queries(bank, rng):
+    picks = bank[rng.integers(0, len(bank), NUM_QUERIES)]
+    return picks + rng.standard_normal(picks.shape).astype(np.float32) * 0.4
+
+# Measure per-query latency of single-vector searches (the map_to_question path)
+def query_latencies(index, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, k=RECALL_K)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def recall_at_k(exact_ids, approx_ids):
+    hits = sum(len(set(e) & set(a)) for e, a in zip(exact_ids, approx_ids))
+    return hits / exact_ids.size
+
+def test_empty_probed_lists():
+    rng = np.random.default_rng(7)
+    vectors = rng.standard_normal((200, 16)).astype(np.float32)
+    index = build_index(vectors, backend="ivf", nlist=8, nprobe=1)
+    query = rng.standard_normal((1, 16)).astype(np.float32)
+    # A centroid that owns no vectors and is the query's nearest
+    index.centroids = np.vstack([index.centroids, normalize_rows(query)])
+    index.offsets = np.append(index.offsets, index.offsets[-1])
+    _, ids = index.search(query, k=1)
+    _, exact = build_index(vectors, backend="flat").search(query, k=1)
+    assert ids[0, 0] == exact[0, 0] >= 0
+    print("empty probed lists: ok")
+
+def test_mismatched_query_keeps_index():
+    import optimized_semantic_service as service
+
+    service.create_app(preload=False)
+    index = service.question_index
+    if index is None:
+        import pytest
+        pytest.skip("no embedding artifact")
+    compiles = []
+    compile_question_index = service.compile_question_index
+    service.compile_question_index = lambda: compiles.append(1) or compile_question_index()
+    try:
+        # Fallback embeddings while Ollama is down are smaller than the index
+        for i in range(50):
+            assert service.search_questions(service.simple_text_embedding(f"I feel sad {i}")) is None
+    finally:
+        service.compile_question_index = compile_question_index
+    assert compiles == [] and service.question_index is index
+    print("mismatched query: ok")
+
+def run_index_benchmark():
+    rng = np.random.default_rng(42)
+    print(f"Vector index benchmark ({NUM_QUERIES} queries, dim {EMBEDDING_DIM}, recall@{RECALL_K})")
+    print(f"{'bank':>8} {'backend':>7} {'build ms':>10} {'recall':>8} {'p50 ms':>8} {'p99 ms':>8}")
+
+    for size in BANK_SIZES:
+        bank = make_bank(size, rng)
+        queries = make_queries(bank, rng)
+
+        exact = build_index(bank, backend="flat")
+        _, exact_ids = exact.search(queries, k=RECALL_K)
+
+        for backend in ["flat", "ivf"]:
+            index = exact if backend == "flat" else build_index(bank, backend="ivf")
+            _, ids = index.search(queries, k=RECALL_K)
+            latencies = query_latencies(index, queries)
+            p99 = sorted(latencies)[int(len(latencies) * 0.99) - 1]
+            print(f"{size:>8} {backend:>7} {index.build_seconds * 1000:>10.1f} "
+                  f"{recall_at_k(exact_ids, ids):>8.3f} {statistics.median(latencies):>8.3f} {p99:>8.3f}")
+
+if __name__ == "__main__":
+    test_empty_probed_lists()
+    test_mismatched_query_keeps_index()
+    run_index_benchmark()
@@ -0,0 +1,176 @@
+import time
+import numpy as np
+
+# Vector index backends used by the semantic service for question mapping.
+#
+# Every backend stores L2-normalised float32 vectors, so the inner product of a
+# (normalised) query with a stored vector is their cosine similarity. Searches
+# accept a single vector or a matrix of queries and always return two arrays of
+# shape (num_queries, k): similarity scores and row ids into the built bank.
+
+# Banks smaller than this are always searched exactly when backend is "auto"
+AUTO_EXACT_THRESHOLD = 4096
+
+
+def normalize_rows(vectors):
+    """Return a float32 copy of the vectors with every row scaled to unit length"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """Return (scores, ids) of the k largest entries of each row, best first"""
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        ids = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        ids = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    top_scores = np.take_along_axis(scores, ids, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+class FlatIndex:
+    """Exact search: one matrix product against every stored vector"""
+
+    name = "flat"
+
+    def __init__(self):
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.labels = []
+        self.build_seconds = 0.0
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def build(self, vectors):
+        start = time.perf_counter()
+        self.vectors = normalize_rows(vectors)
+        self.build_seconds = time.perf_counter() - start
+        return self
+
+    def search(self, queries, k=1):
+        queries = normalize_rows(queries)
+        return top_k(queries @ self.vectors.T, k)
+
+
+class IVFIndex:
+    """Approximate search with an inverted file over spherical k-means clusters
+
+    Vectors are grouped by their nearest centroid and stored contiguously per
+    cluster. A query scores the centroids first and then only scans the
+    `nprobe` closest clusters, so query cost grows with roughly sqrt(N)
+    instead of N.
+    """
+
+    name = "ivf"
+
+    def __init__(self, nlist=None, nprobe=8, iterations=10, sample_size=20000, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.sample_size = sample_size
+        self.seed = seed
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.row_ids = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.labels = []
+        self.build_seconds = 0.0
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def _train_centroids(self, vectors, nlist):
+        """Spherical k-means on a random sample of the bank"""
+        rng = np.random.default_rng(self.seed)
+        sample = vectors
+        if vectors.shape[0] > self.sample_size:
+            sample = vectors[rng.choice(vectors.shape[0], self.sample_size, replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+
+        for _ in range(self.iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            # Re-seed empty clusters from random sample points
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()))]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def build(self, vectors):
+        start = time.perf_counter()
+        vectors = normalize_rows(vectors)
+        nlist = self.nlist or max(1, int(np.sqrt(vectors.shape[0])))
+        nlist = min(nlist, vectors.shape[0])
+
+        self.centroids = self._train_centroids(vectors, nlist)
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+
+        # Store each inverted list contiguously so a probe is a single slice
+        order = np.argsort(assignment, kind="stable")
+        self.vectors = vectors[order]
+        self.row_ids = order.astype(np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=nlist))))
+        self.build_seconds = time.perf_counter() - start
+        return self
+
+    def search(self, queries, k=1):
+        queries = normalize_rows(queries)
+        nprobe = min(self.nprobe, self.centroids.shape[0])
+        _, probes = top_k(queries @ self.centroids.T, nprobe)
+
+        all_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        all_ids = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        for qi, query in enumerate(queries):
+            candidates = np.concatenate([
+                np.arange(self.offsets[p], self.offsets[p + 1]) for p in probes[qi]
+            ])
+            if candidates.size == 0:
+                # Every probed list is empty (a re-seeded centroid may own no
+                # vectors), so scan the whole bank rather than return no match
+                candidates = np.arange(self.vectors.shape[0])
+            if candidates.size == 0:
+                continue
+            scores, positions = top_k((self.vectors[candidates] @ query)[None, :], k)
+            found = scores.shape[1]
+            all_scores[qi, :found] = scores[0]
+            all_ids[qi, :found] = self.row_ids[candidates[positions[0]]]
+        return all_scores, all_ids
+
+
+INDEX_BACKENDS = {
+    "flat": FlatIndex,
+    "ivf": IVFIndex,
+}
+
+
+def build_index(vectors, backend="auto", labels=None, **options):
+    """Build a vector index over `vectors` using the named backend
+
+    `labels` is stored on the index unchanged so callers can map the row ids
+    returned by `search` back to whatever each vector represents. With the
+    "auto" backend small banks use exact search and large ones use IVF.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    if backend == "auto":
+        backend = "flat" if vectors.shape[0] < AUTO_EXACT_THRESHOLD else "ivf"
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown vector index backend '{backend}'")
+
+    index = INDEX_BACKENDS[backend](**options).build(vectors)
+    index.labels = list(labels) if labels is not None else list(range(len(vectors)))
+    return index